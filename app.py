@@ -1,5 +1,5 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, get_flashed_messages, send_from_directory, Response
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, get_flashed_messages, send_from_directory, send_file, Response
 from flask_sqlalchemy import SQLAlchemy
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta
@@ -12,7 +12,7 @@ import re
 from rq import Queue
 from redis import Redis
 import threading
-from config import redis_url, get_redis_connection  # Import redis_url and the connection function
+from config import redis_url, get_redis_connection, apply_sqlite_pragmas, database_url, get_engine_options, http_session, http_get, http_post, get_http_stats, publish_connection_stats, HTTP_STATS_KEY  # Import redis_url and the connection function
 import time # Import the time module
 import logging # Import logging
 import atexit # Import atexit for shutdown hook
@@ -21,21 +21,36 @@ import socket
 from flask_migrate import Migrate  # Add Flask-Migrate
 import glob
 import json
-
-# Add caching library
-from functools import lru_cache
+import math
+import csv
 import io
-from PIL import Image
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from html import escape as html_escape
+from urllib.parse import urlparse
+
+from PIL import Image, ImageChops, ImageDraw, ImageFont
 
 # Load environment variables
 load_dotenv()
 
 # Initialize Flask app and configuration
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///ai_website_monitor.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url  # DATABASE_URL, defaults to the local SQLite file
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = get_engine_options(database_url)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'devsecret')
 app.config['DATA_DIR'] = os.path.join(os.path.dirname(__file__), 'data')  # Add DATA_DIR config
 db = SQLAlchemy(app)
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply WAL/synchronous/busy_timeout to every new SQLite connection."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        apply_sqlite_pragmas(dbapi_connection)
 migrate = Migrate(app, db)  # Setup Flask-Migrate
 
 # Global variable for queue - will be initialized in create_app
@@ -43,43 +58,179 @@ queue = None
 
 # Cache configuration
 CACHE_TIMEOUT = 3600  # Cache timeout in seconds (1 hour)
-IMAGE_QUALITY = 85  # JPEG quality for optimized images
-MAX_WIDTH = 1600  # Maximum image width
-ENABLE_IMAGE_OPTIMIZATION = True  # Toggle for image optimization
-
-# LRU cache for optimized images (stores most recently used items)
-@lru_cache(maxsize=50)
-def get_optimized_image(path, max_width=MAX_WIDTH, quality=IMAGE_QUALITY):
-    """Cache and optimize images for faster loading."""
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '85'))  # Quality for lossy image derivatives (JPEG/WebP/AVIF)
+MAX_WIDTH = int(os.getenv('IMAGE_MAX_WIDTH', '1600'))  # Maximum image width
+ENABLE_IMAGE_OPTIMIZATION = os.getenv('ENABLE_IMAGE_OPTIMIZATION', 'true').lower() != 'false'  # Toggle for image optimization
+# Widths a client may ask for with ?w=. Requests are rounded up to the next step so the
+# number of derivatives kept on disk per screenshot stays small.
+IMAGE_WIDTH_STEPS = tuple(sorted({w for w in (320, 480, 640, 960, 1280) if w < MAX_WIDTH} | {MAX_WIDTH}))
+DERIVED_IMAGE_DIR = os.path.join(os.path.dirname(__file__), 'data', '_derived')  # On-disk cache for resized images
+DATA_RETENTION_DAYS = int(os.getenv('DATA_RETENTION_DAYS', '30'))  # Default days of check history kept when no user/website policy is set
+# Tiered storage: checks older than these ages keep a downsampled screenshot instead of the full PNG
+RETENTION_TIERS_ENABLED = os.getenv('RETENTION_TIERS_ENABLED', 'false').lower() == 'true'  # Run tiering from the scheduler
+RETENTION_REDUCED_AFTER_DAYS = int(os.getenv('RETENTION_REDUCED_AFTER_DAYS', '7'))  # Full PNG -> half-size WebP
+RETENTION_THUMBNAIL_AFTER_DAYS = int(os.getenv('RETENTION_THUMBNAIL_AFTER_DAYS', '90'))  # -> thumbnail only (HTML snapshot dropped)
+RETENTION_KEEP_CHANGED_AFTER_DAYS = int(os.getenv('RETENTION_KEEP_CHANGED_AFTER_DAYS', '0'))  # Drop unchanged checks past N days; 0 disables
+RETENTION_REDUCED_SCALE = 0.5
+RETENTION_THUMBNAIL_WIDTH = 320
+# Email images: one contact sheet (before/after thumbnails + changed-region crop) instead of the full-page PNG
+EMAIL_IMAGE_MAX_BYTES = int(os.getenv('EMAIL_IMAGE_MAX_BYTES', str(400 * 1024)))  # Attachment budget per email
+CONTACT_SHEET_MAX_ITEMS = int(os.getenv('CONTACT_SHEET_MAX_ITEMS', '6'))  # Rows (websites) on a digest's sheet
+CONTACT_SHEET_THUMB_WIDTH = 360
+CONTACT_SHEET_THUMB_MAX_HEIGHT = 480  # Taller thumbnails show the top of the page only
+CONTACT_SHEET_DIFF_THRESHOLD = 32  # Grey-level difference counted as a change
+
+# Output format name -> (Pillow format, mime type)
+IMAGE_FORMATS = {
+    'avif': ('AVIF', 'image/avif'),
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+}
+
+def snap_image_width(requested_width):
+    """Round a requested width up to the nearest allowed step (MAX_WIDTH when missing/invalid)."""
+    if not requested_width or requested_width <= 0:
+        return MAX_WIDTH
+    for step in IMAGE_WIDTH_STEPS:
+        if requested_width <= step:
+            return step
+    return MAX_WIDTH
+
+def negotiate_image_format(accept_header):
+    """Pick the best output format from the Accept header that this Pillow build can encode."""
+    accept = (accept_header or '').lower()
+    Image.init()
+    if 'image/avif' in accept and 'AVIF' in Image.SAVE:
+        return 'avif'
+    if 'image/webp' in accept and 'WEBP' in Image.SAVE:
+        return 'webp'
+    return 'jpeg'
+
+def get_image_derivative(path, width=MAX_WIDTH, fmt='jpeg', quality=IMAGE_QUALITY):
+    """Return (derivative_path, mime_type) for an image resized to `width` and encoded as `fmt`.
+
+    Derivatives are written once to DERIVED_IMAGE_DIR and reused until the source file changes.
+    """
     try:
-        img = Image.open(path)
-        # Check if optimization needed
-        width, height = img.size
-        if width > max_width:
-            # Calculate new height while maintaining aspect ratio
-            new_height = int(height * (max_width / width))
-            img = img.resize((max_width, new_height), Image.LANCZOS)
-        
-        # Save to memory buffer
-        output = io.BytesIO()
-        format = img.format if img.format else 'JPEG'
-        # Save as JPEG with compression if it's a color image
-        if img.mode in ('RGB', 'RGBA'):
-            if format == 'PNG' and 'transparency' in img.info:
-                # Preserve PNG transparency
-                img.save(output, format='PNG', optimize=True)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        with Image.open(path) as img:
+            # Preserve PNG transparency rather than flattening it into a JPEG
+            if fmt == 'jpeg' and img.format == 'PNG' and 'transparency' in img.info:
+                fmt = 'png'
+            pil_format, mime_type = IMAGE_FORMATS[fmt]
+            derived_path = os.path.join(DERIVED_IMAGE_DIR, f"{stem}_w{width}.{fmt}")
+            if os.path.exists(derived_path) and os.path.getmtime(derived_path) >= os.path.getmtime(path):
+                return derived_path, mime_type
+
+            src_width, src_height = img.size
+            if src_width > width:
+                # Calculate new height while maintaining aspect ratio
+                new_height = int(src_height * (width / src_width))
+                img = img.resize((width, new_height), Image.LANCZOS)
+
+            os.makedirs(DERIVED_IMAGE_DIR, exist_ok=True)
+            tmp_path = f"{derived_path}.{os.getpid()}.tmp"
+            if pil_format == 'PNG':
+                img.save(tmp_path, format='PNG', optimize=True)
+            elif pil_format == 'JPEG':
+                img.convert('RGB').save(tmp_path, format='JPEG', quality=quality, optimize=True)
             else:
-                img = img.convert('RGB')
-                img.save(output, format='JPEG', quality=quality, optimize=True)
-        else:
-            img.save(output, format=format)
-        output.seek(0)
-        return output.getvalue(), f"image/{format.lower()}"
+                if img.mode not in ('RGB', 'RGBA'):
+                    img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+                img.save(tmp_path, format=pil_format, quality=quality)
+        # Atomic rename so concurrent requests never see a half-written file
+        os.replace(tmp_path, derived_path)
+        return derived_path, mime_type
     except Exception as e:
-        app.logger.error(f"Image optimization error: {e}")
+        app.logger.error(f"Image optimization error for {path}: {e}")
         # Return None if optimization fails, will fall back to original
         return None, None
 
+def _sheet_thumb(img, region=None):
+    """RGB thumbnail of `img` (or of `region` of it) at CONTACT_SHEET_THUMB_WIDTH, cut to the max height."""
+    if region:
+        img = img.crop(region)
+    width, height = img.size
+    scale = min(1.0, CONTACT_SHEET_THUMB_WIDTH / width)
+    # Crop before resizing so tall full-page screenshots aren't resized in full
+    img = img.crop((0, 0, width, min(height, int(CONTACT_SHEET_THUMB_MAX_HEIGHT / scale))))
+    if scale < 1.0:
+        img = img.resize((CONTACT_SHEET_THUMB_WIDTH, max(1, int(img.height * scale))), Image.LANCZOS)
+    return img.convert('RGB')
+
+def changed_region(before, after, padding=16):
+    """Bounding box, in `after` pixels, of where two screenshots differ (content added at the bottom counts), or None."""
+    work_width = 256
+
+    def small(img):
+        return img.convert('L').resize((work_width, max(1, int(img.height * work_width / img.width))), Image.BILINEAR)
+
+    a, b = small(before), small(after)
+    height = min(a.height, b.height)
+    diff = ImageChops.difference(a.crop((0, 0, work_width, height)), b.crop((0, 0, work_width, height)))
+    box = diff.point(lambda v: 255 if v > CONTACT_SHEET_DIFF_THRESHOLD else 0).getbbox()
+    if b.height > a.height:
+        grown = (0, a.height, work_width, b.height)
+        box = grown if box is None else (min(box[0], grown[0]), min(box[1], grown[1]), max(box[2], grown[2]), max(box[3], grown[3]))
+    if not box:
+        return None
+    scale = after.width / work_width
+    return (max(0, int(box[0] * scale) - padding), max(0, int(box[1] * scale) - padding),
+            min(after.width, int(box[2] * scale) + padding), min(after.height, int(box[3] * scale) + padding))
+
+def build_contact_sheet(items, output_path, max_bytes=EMAIL_IMAGE_MAX_BYTES):
+    """Write a JPEG contact sheet for [(label, before_path, after_path)] within max_bytes. Returns output_path or None.
+
+    Each row shows the previous screenshot, the new one and a crop of the region that changed.
+    Quality, then scale, is reduced until the file fits the budget.
+    """
+    gap, label_height = 8, 20
+    font = ImageFont.load_default()
+    rows = []
+    for label, before_path, after_path in items:
+        with Image.open(after_path) as after:
+            after.load()
+            before = None
+            if before_path:
+                with Image.open(before_path) as img:
+                    img.load()
+                    before = img
+            region = changed_region(before, after) if before is not None else None
+            rows.append((label, _sheet_thumb(before) if before is not None else None, _sheet_thumb(after),
+                         _sheet_thumb(after, region) if region else None))
+    if not rows:
+        return None
+
+    width = 3 * CONTACT_SHEET_THUMB_WIDTH + 4 * gap
+    heights = [label_height + max(t.height for t in row[1:] if t is not None) + gap for row in rows]
+    sheet = Image.new('RGB', (width, sum(heights) + gap), 'white')
+    draw = ImageDraw.Draw(sheet)
+    y = gap
+    for (label, *thumbs), row_height in zip(rows, heights):
+        draw.text((gap, y + 4), label[:110], fill='black', font=font)
+        for column, (caption, thumb) in enumerate(zip(('Before', 'After', 'Changed area'), thumbs)):
+            x = gap + column * (CONTACT_SHEET_THUMB_WIDTH + gap)
+            if thumb is None:
+                draw.text((x, y + label_height + 4), f"{caption}: n/a", fill='gray', font=font)
+            else:
+                sheet.paste(thumb, (x, y + label_height))
+        y += row_height
+
+    for scale in (1.0, 0.75, 0.5, 0.35):
+        img = sheet if scale == 1.0 else sheet.resize((int(sheet.width * scale), max(1, int(sheet.height * scale))), Image.LANCZOS)
+        for quality in (80, 65, 50):
+            buffer = io.BytesIO()
+            img.save(buffer, format='JPEG', quality=quality, optimize=True)
+            if buffer.tell() <= max_bytes:
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                tmp_path = f"{output_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(buffer.getvalue())
+                os.replace(tmp_path, output_path)
+                return output_path
+    return None
+
 # Create scheduler instance but don't start it yet
 scheduler = BackgroundScheduler()
 
@@ -97,6 +248,56 @@ app.logger.setLevel(logging.DEBUG) # Ensure Flask logger captures DEBUG
 
 # --- Add Route to Serve Data Files ---
 DATA_FOLDER = os.path.join(os.path.dirname(__file__), 'data')
+DIFF_MAX_BYTES = 256 * 1024  # Rendered diffs are truncated past this many bytes of diff text
+
+def resolve_data_path(path):
+    """Resolve a stored data path (e.g. 'data/x.txt', relative to the working dir) to an existing file, or None."""
+    if not path:
+        return None
+    if os.path.exists(path):
+        return path
+    fallback = os.path.join(DATA_FOLDER, os.path.basename(path.replace('\\', '/')))
+    return fallback if os.path.exists(fallback) else None
+
+def render_diff_html(diff_path):
+    """Render a unified diff file to a highlighted, size-capped HTML fragment cached in DERIVED_IMAGE_DIR.
+
+    Returns the path of the rendered fragment, or None if the diff file is missing.
+    """
+    source = resolve_data_path(diff_path)
+    if not source:
+        return None
+    stem = os.path.splitext(os.path.basename(source))[0]
+    rendered_path = os.path.join(DERIVED_IMAGE_DIR, f"{stem}.html")
+    if os.path.exists(rendered_path) and os.path.getmtime(rendered_path) >= os.path.getmtime(source):
+        return rendered_path
+
+    with open(source, 'r', encoding='utf-8', errors='replace') as f:
+        diff_text = f.read(DIFF_MAX_BYTES + 1)
+    truncated = len(diff_text) > DIFF_MAX_BYTES
+    lines = []
+    for line in diff_text[:DIFF_MAX_BYTES].splitlines():
+        if line.startswith(('+++', '---')):
+            css_class = 'diff-file'
+        elif line.startswith('@@'):
+            css_class = 'diff-hunk'
+        elif line.startswith('+'):
+            css_class = 'diff-add'
+        elif line.startswith('-'):
+            css_class = 'diff-del'
+        else:
+            css_class = 'diff-ctx'
+        lines.append(f'<span class="{css_class}">{html_escape(line)}</span>')
+    body = '\n'.join(lines) if lines else '<span class="diff-ctx">No textual differences.</span>'
+    if truncated:
+        body += f'\n<span class="diff-hunk">… diff truncated at {DIFF_MAX_BYTES // 1024} KB</span>'
+
+    os.makedirs(DERIVED_IMAGE_DIR, exist_ok=True)
+    tmp_path = f"{rendered_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(f'<pre class="diff"><code>{body}</code></pre>')
+    os.replace(tmp_path, rendered_path)
+    return rendered_path
 
 # --- Custom RQ Worker for Windows ---
 from rq import SimpleWorker
@@ -159,20 +360,23 @@ def serve_data_file(filename):
             return "File not found", 404
 
     # Optimization for image files (screenshots)
-    if ENABLE_IMAGE_OPTIMIZATION and filename.endswith(('.png', '.jpg', '.jpeg')):
+    if ENABLE_IMAGE_OPTIMIZATION and filename.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
         # Check if optimization parameter was passed
         optimize = request.args.get('optimize', 'true').lower() != 'false'
         
         if optimize:
             try:
-                # Try to get optimized image from cache
-                image_data, mime_type = get_optimized_image(safe_path)
+                # Resize to the width the page renders and encode in the best format the browser accepts
+                width = snap_image_width(request.args.get('w', type=int))
+                fmt = negotiate_image_format(request.headers.get('Accept'))
+                derived_path, mime_type = get_image_derivative(safe_path, width, fmt)
                 
-                if image_data:
-                    app.logger.debug(f"Serving optimized image: {filename}")
+                if derived_path:
+                    app.logger.debug(f"Serving optimized image: {filename} (w={width}, {mime_type})")
                     # Add caching headers to improve performance
-                    response = Response(image_data, mimetype=mime_type)
+                    response = send_file(derived_path, mimetype=mime_type, conditional=True)
                     response.headers['Cache-Control'] = f'max-age={CACHE_TIMEOUT}, public'
+                    response.headers['Vary'] = 'Accept'
                     return response
             except Exception as e:
                 app.logger.error(f"Error optimizing image {filename}: {e}")
@@ -184,6 +388,31 @@ def serve_data_file(filename):
     response.headers['Cache-Control'] = f'max-age={CACHE_TIMEOUT}, public'
     return response
 
+@app.route('/img/<int:check_id>')
+def check_image(check_id):
+    """Serve the screenshot of a check. Accepts ?w= and honours the Accept header like serve_data_file."""
+    check = db.session.get(CheckHistory, check_id)
+    if not check or not check.screenshot_path:
+        return "File not found", 404
+    return serve_data_file(check.screenshot_path)
+
+@app.route('/diff/<int:check_id>')
+def check_diff(check_id):
+    """Serve the text diff of a check as a highlighted HTML fragment (rendered once, then cached on disk)."""
+    check = db.session.get(CheckHistory, check_id)
+    if not check or not check.diff_path:
+        return "Diff not found", 404
+    try:
+        rendered_path = render_diff_html(check.diff_path)
+    except Exception as e:
+        app.logger.error(f"Error rendering diff for check {check_id}: {e}", exc_info=True)
+        return "Error rendering diff", 500
+    if not rendered_path:
+        return "Diff not found", 404
+    response = send_file(rendered_path, mimetype='text/html', conditional=True)
+    response.headers['Cache-Control'] = f'max-age={CACHE_TIMEOUT}, public'
+    return response
+
 # Models
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -198,8 +427,12 @@ class User(db.Model):
     summary_times = db.Column(db.String(100), default='09:00') # Comma-separated HH:MM, e.g., "09:00,17:00"
     # New field for notifications on changes only
     notify_only_changes = db.Column(db.Boolean, default=True) # True = notify only on changes, False = notify on all checks
+    retention_days = db.Column(db.Integer, default=None) # Days of check history to keep; None = DATA_RETENTION_DAYS
 
 class Website(db.Model):
+    __table_args__ = (
+        db.Index('ix_website_user_id', 'user_id'),  # Dashboard / per-user lookups
+    )
     id = db.Column(db.Integer, primary_key=True)
     url = db.Column(db.String(2048), nullable=False)
     user_id = db.Column(db.String(64), db.ForeignKey('user.user_id'))
@@ -213,12 +446,45 @@ class Website(db.Model):
     # New fields for monitoring type
     monitoring_type = db.Column(db.String(50), default='general_updates') # 'general_updates', 'specific_elements'
     monitoring_keywords = db.Column(db.Text, default=None) # Optional comma-separated keywords for specific elements
+    retention_days = db.Column(db.Integer, default=None) # Overrides the user's retention policy for this website
 
     def get_latest_history(self):
         """Get the latest check history for this website."""
         return CheckHistory.query.filter_by(website_id=self.id).order_by(CheckHistory.checked_at.desc()).first()
 
+    @staticmethod
+    def get_latest_histories(website_ids):
+        """Get the latest check and the latest changed check for many websites in a single query.
+
+        Returns (latest_map, last_change_map), both keyed by website_id.
+        """
+        latest_map, last_change_map = {}, {}
+        if not website_ids:
+            return latest_map, last_change_map
+        newest_first = (CheckHistory.checked_at.desc(), CheckHistory.id.desc())
+        ranked = db.session.query(
+            CheckHistory.id.label('id'),
+            db.func.row_number().over(partition_by=CheckHistory.website_id, order_by=newest_first).label('latest_rank'),
+            db.func.row_number().over(partition_by=(CheckHistory.website_id, CheckHistory.change_detected), order_by=newest_first).label('change_rank')
+        ).filter(CheckHistory.website_id.in_(website_ids)).subquery()
+        rows = db.session.query(CheckHistory, ranked.c.latest_rank, ranked.c.change_rank).join(
+            ranked, CheckHistory.id == ranked.c.id
+        ).filter(
+            db.or_(ranked.c.latest_rank == 1, db.and_(CheckHistory.change_detected == True, ranked.c.change_rank == 1))
+        ).all()
+        for check, latest_rank, change_rank in rows:
+            if latest_rank == 1:
+                latest_map[check.website_id] = check
+            if check.change_detected and change_rank == 1:
+                last_change_map[check.website_id] = check
+        return latest_map, last_change_map
+
 class CheckHistory(db.Model):
+    __table_args__ = (
+        db.Index('ix_check_history_website_id_checked_at', 'website_id', 'checked_at'),  # Latest check / history per site
+        db.Index('ix_check_history_website_id_change_detected_checked_at', 'website_id', 'change_detected', 'checked_at'),  # Last change per site
+        db.Index('ix_check_history_checked_at', 'checked_at'),  # Retention sweeps
+    )
     id = db.Column(db.Integer, primary_key=True)
     website_id = db.Column(db.Integer, db.ForeignKey('website.id'))
     checked_at = db.Column(db.DateTime, default=datetime.now)
@@ -229,28 +495,156 @@ class CheckHistory(db.Model):
     change_detected = db.Column(db.Boolean, default=False)
     error = db.Column(db.String(512))
     response_time = db.Column(db.Float, default=None)
-    ai_significance = db.Column(db.String(256))
-    ai_detailed = db.Column(db.Text)
-    ai_focus = db.Column(db.String(256))
-    ai_error = db.Column(db.String(256))
+    # Structured AI result, written once by the worker; ai_description holds the summary text
+    ai_significance = db.Column(db.String(256))  # 'none', 'low', 'medium', 'high', 'critical'
+    ai_detailed = db.Column(db.JSON)  # List of detailed change strings
+    ai_focus = db.Column(db.Text)  # Focus area assessment
+    ai_error = db.Column(db.Text)  # Set when the AI output could not be parsed
+    storage_tier = db.Column(db.String(16), default='full')  # 'full', 'reduced' or 'thumbnail' (see tasks.apply_retention_tiers)
 
 class Notification(db.Model):
+    __table_args__ = (
+        db.Index('ix_notification_user_id_notification_type_created_at', 'user_id', 'notification_type', 'created_at'),  # Summaries
+        db.Index('ix_notification_check_history_id', 'check_history_id'),  # Retention / cascade deletes
+        db.Index('ix_notification_dispatch_pending', 'dispatch_pending'),  # Outbox sweep
+        db.Index('ix_notification_website_id_created_at', 'website_id', 'created_at'),  # Dedup / flap checks
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(64), db.ForeignKey('user.user_id'))
     website_id = db.Column(db.Integer, db.ForeignKey('website.id'))
     check_history_id = db.Column(db.Integer, db.ForeignKey('check_history.id'), nullable=True)
-    notification_type = db.Column(db.String(20), default='immediate')  # 'immediate' or 'summary'
+    notification_type = db.Column(db.String(20), default='immediate')  # 'immediate', 'summary' or an alert type (tasks.ALERT_NOTIFICATIONS)
     content = db.Column(db.Text)  # The notification message content
     screenshot_path = db.Column(db.String(256), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
     sent = db.Column(db.Boolean, default=False)  # Whether the notification has been sent
     included_in_summary = db.Column(db.Boolean, default=False)  # Whether included in a summary notification
     summary_id = db.Column(db.Integer, nullable=True)  # ID of the summary notification that includes this notification
+    dispatch_pending = db.Column(db.Boolean, default=False)  # Outbox: committed with its check, sent by tasks.dispatch_notification
+    delivery_status = db.Column(db.String(16), default=None)  # 'sent', 'partial', 'failed', 'retrying' or 'skipped' (no channel configured)
+    delivery_channels = db.Column(db.JSON, default=None)  # {channel: {'status', 'error', 'at'}} from the latest attempt per channel
+    delivery_attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=None)  # Dispatch lease / retry backoff; the sweeper ignores rows before this
+    content_hash = db.Column(db.String(40), default=None)  # Change notifications: hash of the normalized summary + changed region
+    check_history = db.relationship('CheckHistory')
+
+# Response-time sketch for rollups: log-spaced buckets, each 10% wider than the last, so percentiles
+# read from merged daily histograms are within ~10% of the exact value
+RESPONSE_TIME_BUCKET_MIN = 0.01  # Seconds; everything faster lands in bucket 0
+RESPONSE_TIME_BUCKET_GROWTH = 1.1
+
+def response_time_bucket(seconds):
+    if seconds <= RESPONSE_TIME_BUCKET_MIN:
+        return 0
+    return math.ceil(math.log(seconds / RESPONSE_TIME_BUCKET_MIN) / math.log(RESPONSE_TIME_BUCKET_GROWTH))
+
+def response_time_percentile(histogram, pct):
+    """Approximate percentile (upper bucket bound, seconds) from a {bucket: count} histogram."""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank, seen = total * pct / 100, 0
+    for bucket in sorted(histogram, key=int):
+        seen += histogram[bucket]
+        if seen >= rank:
+            return RESPONSE_TIME_BUCKET_MIN * RESPONSE_TIME_BUCKET_GROWTH ** int(bucket)
+
+class CheckRollup(db.Model):
+    """Per-website, per-day check aggregates, updated as each check is saved (see tasks.rebuild_check_rollups)."""
+    __table_args__ = (
+        db.UniqueConstraint('website_id', 'day', name='uq_check_rollup_website_id_day'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    website_id = db.Column(db.Integer, db.ForeignKey('website.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    check_count = db.Column(db.Integer, default=0)
+    error_count = db.Column(db.Integer, default=0)
+    change_count = db.Column(db.Integer, default=0)
+    response_time_count = db.Column(db.Integer, default=0)
+    response_time_sum = db.Column(db.Float, default=0.0)
+    response_time_max = db.Column(db.Float, default=None)
+    response_time_histogram = db.Column(db.JSON, default=dict)  # {bucket: count}, see response_time_bucket()
+
+    @staticmethod
+    def empty(website_id, day):
+        return CheckRollup(website_id=website_id, day=day, check_count=0, error_count=0, change_count=0,
+                           response_time_count=0, response_time_sum=0.0, response_time_histogram={})
+
+    def add(self, error=None, change_detected=False, response_time=None):
+        self.check_count += 1
+        self.error_count += 1 if error else 0
+        self.change_count += 1 if change_detected else 0
+        if response_time is not None:
+            self.response_time_count += 1
+            self.response_time_sum += response_time
+            self.response_time_max = max(self.response_time_max or 0.0, response_time)
+            histogram = dict(self.response_time_histogram or {})  # New dict so the JSON column is marked dirty
+            bucket = str(response_time_bucket(response_time))
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+            self.response_time_histogram = histogram
+
+    @staticmethod
+    def _insert_missing(website_id, day):
+        """Create an empty rollup row unless another worker already has (INSERT ... ON CONFLICT DO NOTHING)."""
+        row = dict(website_id=website_id, day=day, check_count=0, error_count=0, change_count=0,
+                   response_time_count=0, response_time_sum=0.0, response_time_histogram={})
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            insert = sqlite_insert if dialect == 'sqlite' else postgresql_insert
+            db.session.execute(insert(CheckRollup).values(**row).on_conflict_do_nothing(index_elements=['website_id', 'day']))
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(CheckRollup).values(**row))
+        except IntegrityError:  # Another worker created the row first
+            pass
+
+    @staticmethod
+    def record(check):
+        """Count a new CheckHistory row in its website's rollup for the day; commits with the caller's transaction.
+
+        Counters are incremented in SQL so concurrent workers never lose an update. The UPDATE also locks
+        the row (the database write lock on SQLite) before the histogram is read and rewritten.
+        """
+        day = (check.checked_at or datetime.now()).date()
+        response_time = check.response_time
+        values = {
+            'check_count': CheckRollup.check_count + 1,
+            'error_count': CheckRollup.error_count + (1 if check.error else 0),
+            'change_count': CheckRollup.change_count + (1 if check.change_detected else 0),
+        }
+        if response_time is not None:
+            values.update({
+                'response_time_count': CheckRollup.response_time_count + 1,
+                'response_time_sum': CheckRollup.response_time_sum + response_time,
+                'response_time_max': db.case(
+                    (db.or_(CheckRollup.response_time_max.is_(None), CheckRollup.response_time_max < response_time), response_time),
+                    else_=CheckRollup.response_time_max),
+            })
+        where = (CheckRollup.website_id == check.website_id, CheckRollup.day == day)
+        increment = db.update(CheckRollup).where(*where).values(**values).execution_options(synchronize_session=False)
+        if db.session.execute(increment).rowcount == 0:
+            CheckRollup._insert_missing(check.website_id, day)
+            db.session.execute(increment)
+        if response_time is not None:
+            histogram = dict(db.session.execute(db.select(CheckRollup.response_time_histogram).where(*where)).scalar() or {})
+            bucket = str(response_time_bucket(response_time))
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+            db.session.execute(db.update(CheckRollup).where(*where).values(response_time_histogram=histogram)
+                               .execution_options(synchronize_session=False))
 
 # Utility for safe file naming
 def safe_filename(name):
     return re.sub(r'[^a-zA-Z0-9_-]', '_', name)[:40]
 
+def parse_retention_days(value):
+    """Parse a retention form field; blank or invalid input means 'use the default policy'."""
+    try:
+        days = int(value)
+    except (TypeError, ValueError):
+        return None
+    return days if days > 0 else None
+
 # Home / User ID Management
 @app.route('/', methods=['GET']) # Only GET needed now for the main page
 def index():
@@ -285,18 +679,9 @@ def dashboard(user_id):
 
     # User exists (or was just created), proceed to dashboard
     websites = Website.query.filter_by(user_id=user_id).all()
-    # Parse ai_description for each website's latest history
-    ai_data_map = {}
-    for website in websites:
-        latest = website.get_latest_history()
-        if latest and latest.ai_description:
-            try:
-                ai_data_map[website.id] = json.loads(latest.ai_description)
-            except Exception:
-                ai_data_map[website.id] = None
-        else:
-            ai_data_map[website.id] = None
-    return render_template('dashboard.html', user=user, websites=websites, CheckHistory=CheckHistory, ai_data_map=ai_data_map)
+    latest_map, last_change_map = Website.get_latest_histories([w.id for w in websites])
+    return render_template('dashboard.html', user=user, websites=websites, latest_map=latest_map,
+                           last_change_map=last_change_map)
 
 # Add Website
 @app.route('/add_website/<user_id>', methods=['GET', 'POST'])
@@ -370,6 +755,201 @@ def add_website(user_id):
     # GET request - display the form
     return render_template('add_website.html', user_id=user_id)
 
+# Bulk import / export of a user's websites
+WEBSITE_EXPORT_FIELDS = ('url', 'frequency_type', 'frequency_value', 'ai_focus_area', 'proxy',
+                         'monitoring_type', 'monitoring_keywords', 'retention_days')
+IMPORT_MAX_WEBSITES = int(os.getenv('IMPORT_MAX_WEBSITES', '1000'))  # Rows accepted per import
+IMPORT_CHECK_BURST = int(os.getenv('IMPORT_CHECK_BURST', '5'))  # Initial checks started right away
+IMPORT_CHECK_SPREAD_SECONDS = float(os.getenv('IMPORT_CHECK_SPREAD_SECONDS', '10'))  # Gap between the remaining initial checks
+SPECIFIC_TIME_RE = re.compile(r'^([01]?\d|2[0-3]):[0-5]\d$')
+
+def parse_website_import(text, filename=''):
+    """Parse CSV (header row using WEBSITE_EXPORT_FIELDS names) or JSON (a list of objects or URL strings) into row dicts."""
+    text = text.lstrip('﻿').strip()
+    if filename.lower().endswith('.json') or text[:1] in ('[', '{'):
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get('websites', [])
+        if not isinstance(data, list):
+            raise ValueError('JSON import must be a list of websites')
+        return [row if isinstance(row, dict) else {'url': row} for row in data]
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or 'url' not in [(f or '').strip().lower() for f in reader.fieldnames]:
+        # No header: one URL per line
+        return [{'url': line.split(',')[0]} for line in text.splitlines() if line.strip()]
+    return [{(k or '').strip().lower(): v for k, v in row.items()} for row in reader]
+
+def optional_text(value, max_length=None):
+    """Strip an optional imported field; blank means None."""
+    value = str(value or '').strip()
+    return value[:max_length] if value else None
+
+def validate_website_row(row):
+    """Normalize one imported row into Website column values. Returns (values, error)."""
+    url = str(row.get('url') or '').strip()
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.netloc or len(url) > 2048:
+        return None, f'invalid URL "{url[:80]}"'
+
+    frequency_type = str(row.get('frequency_type') or 'interval').strip()
+    frequency_value = str(row.get('frequency_value') or '').strip()
+    if frequency_type == 'interval':
+        frequency_value = frequency_value or '60'
+        if not frequency_value.isdigit() or int(frequency_value) < 1:
+            return None, f'{url}: interval must be a positive number of minutes'
+    elif frequency_type == 'specific_times':
+        times = [t.strip() for t in frequency_value.split(',') if t.strip()]
+        if not times or not all(SPECIFIC_TIME_RE.match(t) for t in times):
+            return None, f'{url}: specific_times must be HH:MM values'
+        frequency_value = ','.join(times)
+    else:
+        return None, f'{url}: unknown frequency_type "{frequency_type}"'
+    if len(frequency_value) > 128:
+        return None, f'{url}: frequency_value is too long'
+
+    monitoring_type = str(row.get('monitoring_type') or 'general_updates').strip()
+    if monitoring_type not in ('general_updates', 'specific_elements'):
+        return None, f'{url}: unknown monitoring_type "{monitoring_type}"'
+
+    return {
+        'url': url,
+        'frequency_type': frequency_type,
+        'frequency_value': frequency_value,
+        'ai_focus_area': optional_text(row.get('ai_focus_area'), 256),
+        'proxy': optional_text(row.get('proxy'), 128),
+        'monitoring_type': monitoring_type,
+        'monitoring_keywords': optional_text(row.get('monitoring_keywords')) if monitoring_type == 'specific_elements' else None,
+        'retention_days': parse_retention_days(row.get('retention_days')),
+    }, None
+
+def import_websites(user_id, rows):
+    """Validate rows, skip URLs the user already monitors (one query), insert the rest in one transaction
+    and enqueue their initial checks. Returns a summary dict."""
+    if len(rows) > IMPORT_MAX_WEBSITES:
+        raise ValueError(f'Too many websites in one import ({len(rows)}); the limit is {IMPORT_MAX_WEBSITES}')
+
+    errors, candidates = [], {}
+    for row in rows:
+        values, error = validate_website_row(row) if isinstance(row, dict) else (None, 'row is not an object')
+        if error:
+            errors.append(error)
+        elif values['url'] not in candidates:  # First occurrence in the file wins
+            candidates[values['url']] = values
+    duplicates = len(rows) - len(errors) - len(candidates)
+
+    if candidates:
+        existing = {url for (url,) in db.session.query(Website.url).filter(
+            Website.user_id == user_id, Website.url.in_(list(candidates)))}
+        duplicates += len(existing)
+        websites = [Website(user_id=user_id, status='checking', **values)
+                    for url, values in candidates.items() if url not in existing]
+    else:
+        websites = []
+
+    website_ids = []
+    if websites:
+        db.session.add_all(websites)
+        db.session.flush()  # Batched INSERT ... RETURNING id
+        website_ids = [w.id for w in websites]
+        db.session.commit()
+        app.logger.info(f"Imported {len(website_ids)} websites for user {user_id}")
+
+    return {
+        'added': len(website_ids),
+        'duplicates': duplicates,
+        'invalid': len(errors),
+        'errors': errors[:20],
+        'enqueued': enqueue_initial_checks(website_ids),
+    }
+
+def enqueue_initial_checks(website_ids, burst=IMPORT_CHECK_BURST, spread_seconds=IMPORT_CHECK_SPREAD_SECONDS):
+    """Enqueue tasks.check_website for new websites in one Redis pipeline.
+
+    The first `burst` checks are queued immediately; the rest are scheduled spread_seconds apart
+    (run by the worker's --with-scheduler) so a large import doesn't flood the workers.
+    Returns the number of jobs enqueued.
+    """
+    if not website_ids:
+        return 0
+    redis_conn = get_redis_connection()
+    if not redis_conn:
+        app.logger.error("Redis connection failed. Imported websites will be checked by the scheduler.")
+        return 0
+    try:
+        q = Queue(connection=redis_conn)
+        with redis_conn.pipeline() as pipe:
+            q.enqueue_many([Queue.prepare_data('tasks.check_website', args=(website_id,))
+                            for website_id in website_ids[:burst]], pipeline=pipe)
+            for i, website_id in enumerate(website_ids[burst:], start=1):
+                q.enqueue_in(timedelta(seconds=i * spread_seconds), 'tasks.check_website', website_id, pipeline=pipe)
+            pipe.execute()
+    except Exception as e:
+        app.logger.error(f"Failed to queue initial checks for {len(website_ids)} imported websites: {e}", exc_info=True)
+        return 0
+    return len(website_ids)
+
+@app.route('/import_websites/<user_id>', methods=['POST'])
+def import_websites_route(user_id):
+    """Bulk-add websites from an uploaded CSV/JSON file, pasted text, or a JSON request body."""
+    user = User.query.filter_by(user_id=user_id).first()
+    if not user:
+        if request.is_json:
+            return jsonify({'error': 'User not found'}), 404
+        flash(f"User ID '{user_id}' not found.", 'danger')
+        return redirect(url_for('index'))
+
+    try:
+        if request.is_json:
+            rows = parse_website_import(request.get_data(as_text=True), 'import.json')
+        else:
+            upload = request.files.get('websites_file')
+            if upload and upload.filename:
+                rows = parse_website_import(upload.read().decode('utf-8', errors='replace'), upload.filename)
+            else:
+                rows = parse_website_import(request.form.get('websites_text', ''))
+        result = import_websites(user_id, rows)
+    except ValueError as e:  # Includes malformed JSON
+        if request.is_json:
+            return jsonify({'error': str(e)}), 400
+        flash(f'Import failed: {e}', 'danger')
+        return redirect(url_for('add_website', user_id=user_id))
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f'Error importing websites for user {user_id}: {e}', exc_info=True)
+        if request.is_json:
+            return jsonify({'error': 'Failed to save websites to database'}), 500
+        flash('Failed to save websites to database.', 'danger')
+        return redirect(url_for('add_website', user_id=user_id))
+
+    if request.is_json:
+        return jsonify(result)
+    flash(f"Imported {result['added']} websites ({result['duplicates']} duplicates skipped, {result['invalid']} invalid).",
+          'success' if result['added'] else 'warning')
+    for error in result['errors'][:5]:
+        flash(f'Skipped: {error}', 'warning')
+    return redirect(url_for('dashboard', user_id=user_id))
+
+@app.route('/export_websites/<user_id>')
+def export_websites(user_id):
+    """Download a user's websites as CSV (default) or JSON (?format=json), re-importable via /import_websites."""
+    user = User.query.filter_by(user_id=user_id).first()
+    if not user:
+        flash(f"User ID '{user_id}' not found.", 'danger')
+        return redirect(url_for('index'))
+
+    rows = [{field: getattr(w, field) for field in WEBSITE_EXPORT_FIELDS}
+            for w in Website.query.filter_by(user_id=user_id).order_by(Website.id)]
+    name = safe_filename(user_id)
+    if request.args.get('format') == 'json':
+        return Response(json.dumps(rows, indent=2), mimetype='application/json',
+                        headers={'Content-Disposition': f'attachment; filename=websites_{name}.json'})
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=WEBSITE_EXPORT_FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return Response(out.getvalue(), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=websites_{name}.csv'})
+
 # Edit Website
 @app.route('/edit_website/<int:website_id>', methods=['GET', 'POST'])
 def edit_website(website_id):
@@ -385,68 +965,218 @@ def edit_website(website_id):
         # NEW: Update monitoring type and keywords
         website.monitoring_type = request.form.get('monitoring_type', website.monitoring_type)
         website.monitoring_keywords = request.form.get('monitoring_keywords') if website.monitoring_type == 'specific_elements' else None
+        website.retention_days = parse_retention_days(request.form.get('retention_days'))
 
         db.session.commit()
         flash('Website updated!', 'success')
         return redirect(url_for('dashboard', user_id=website.user_id))
     return render_template('edit_website.html', website=website)
 
-# Delete Website
+# Delete Website / User
+FILE_REMOVAL_CHUNK = 5000  # Paths handed to one tasks.remove_deleted_files job
+
+def purge_websites(site_ids, user_id=None):
+    """Delete the websites selected by site_ids (a Website.id subquery) with their check history,
+    rollups and notifications, as set-based DELETEs in the caller's transaction. With user_id,
+    the user's remaining notifications go too. Returns the data file paths the rows referenced.
+    """
+    check_ids = db.session.query(CheckHistory.id).filter(CheckHistory.website_id.in_(site_ids))
+    paths = set()
+    for row in db.session.query(CheckHistory.screenshot_path, CheckHistory.html_path, CheckHistory.diff_path).filter(
+            CheckHistory.website_id.in_(site_ids)).execution_options(yield_per=5000):
+        paths.update(path for path in row if path)
+
+    notification_scope = db.or_(Notification.website_id.in_(site_ids), Notification.check_history_id.in_(check_ids))
+    if user_id:
+        notification_scope = db.or_(notification_scope, Notification.user_id == user_id)
+    paths.update(path for (path,) in db.session.query(Notification.screenshot_path).filter(
+        notification_scope, Notification.screenshot_path.isnot(None)))
+
+    # Children first so the foreign keys stay valid on backends that enforce them
+    Notification.query.filter(notification_scope).delete(synchronize_session=False)
+    CheckHistory.query.filter(CheckHistory.website_id.in_(site_ids)).delete(synchronize_session=False)
+    CheckRollup.query.filter(CheckRollup.website_id.in_(site_ids)).delete(synchronize_session=False)
+    Website.query.filter(Website.id.in_(site_ids)).delete(synchronize_session=False)
+    return paths
+
+def enqueue_file_removal(paths):
+    """Hand deleted rows' files to tasks.remove_deleted_files on RQ. Files left behind if Redis is
+    unavailable are reclaimed by the orphan file collector."""
+    if not paths:
+        return []
+    from tasks import remove_deleted_files  # Import here to avoid circular imports
+    redis_conn = get_redis_connection()
+    if not redis_conn:
+        app.logger.error(f"Redis connection failed. {len(paths)} files of deleted rows left for orphan collection.")
+        return []
+    q = Queue(connection=redis_conn)
+    paths = sorted(paths)
+    jobs = [q.enqueue(remove_deleted_files, kwargs={'paths': paths[i:i + FILE_REMOVAL_CHUNK]}, job_timeout=3600)
+            for i in range(0, len(paths), FILE_REMOVAL_CHUNK)]
+    app.logger.info(f"Enqueued removal of {len(paths)} files in {len(jobs)} job(s).")
+    return jobs
+
 @app.route('/delete_website/<int:website_id>', methods=['POST'])
 def delete_website(website_id):
     website = db.session.get(Website, website_id)
     if not website:
         return redirect(url_for('index'))
     user_id = website.user_id
-    db.session.delete(website)
-    db.session.commit()
+    try:
+        paths = purge_websites(db.session.query(Website.id).filter(Website.id == website_id))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error deleting website {website_id}: {e}", exc_info=True)
+        flash(f'Error deleting website: {e}', 'danger')
+        return redirect(url_for('dashboard', user_id=user_id))
+    enqueue_file_removal(paths)
     flash('Website deleted!', 'success')
     return redirect(url_for('dashboard', user_id=user_id))
 
-# Delete User
 @app.route('/delete_user/<user_id>', methods=['POST'])
 def delete_user_post(user_id):
     user = User.query.filter_by(user_id=user_id).first()
     if not user:
         flash('User not found.', 'error')
         return redirect(url_for('index'))
-    # Delete all websites and histories for this user
-    websites = Website.query.filter_by(user_id=user_id).all()
-    for website in websites:
-        CheckHistory.query.filter_by(website_id=website.id).delete()
-        db.session.delete(website)
-    
-    # Delete the user itself
-    db.session.delete(user)
-    
     try:
+        # All websites, histories, rollups and notifications for this user, then the user itself
+        paths = purge_websites(db.session.query(Website.id).filter(Website.user_id == user_id), user_id=user_id)
+        User.query.filter(User.id == user.id).delete(synchronize_session=False)
         db.session.commit()
-        flash('User deleted!', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error deleting user: {e}', 'danger')
         app.logger.error(f"Error committing user deletion for {user_id}: {e}")
-        
+        return redirect(url_for('index'))
+    enqueue_file_removal(paths)
+    redis_conn = get_redis_connection()
+    if redis_conn:
+        redis_conn.zrem(SUMMARY_SCHEDULE_KEY, user_id)  # The hourly sync would drop it too
+    flash('User deleted!', 'success')
     return redirect(url_for('index'))
 
 # Website Check History
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '50'))
+HISTORY_MAX_PAGE_SIZE = 200
+
+def encode_history_cursor(check):
+    return f"{check.checked_at.isoformat()}_{check.id}"
+
+def decode_history_cursor(cursor):
+    """Parse a '<checked_at ISO>_<id>' cursor; raises ValueError if malformed."""
+    checked_at, check_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(checked_at), int(check_id)
+
+def get_history_page(website_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """One page of a website's checks, newest first, keyset-paginated on (checked_at, id).
+
+    Returns (checks, next_cursor); next_cursor is None on the last page.
+    """
+    query = CheckHistory.query.filter(CheckHistory.website_id == website_id, CheckHistory.checked_at.isnot(None))
+    if cursor:
+        checked_at, check_id = decode_history_cursor(cursor)
+        query = query.filter(db.or_(
+            CheckHistory.checked_at < checked_at,
+            db.and_(CheckHistory.checked_at == checked_at, CheckHistory.id < check_id),
+        ))
+    checks = query.order_by(CheckHistory.checked_at.desc(), CheckHistory.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_history_cursor(checks[limit - 1]) if len(checks) > limit else None
+    return checks[:limit], next_cursor
+
+def serialize_check(check):
+    return {
+        'id': check.id,
+        'checked_at': check.checked_at.isoformat() if check.checked_at else None,
+        'change_detected': bool(check.change_detected),
+        'error': check.error,
+        'response_time': check.response_time,
+        'screenshot_url': url_for('check_image', check_id=check.id, w=480) if check.screenshot_path else None,
+        'diff_url': url_for('visual_diff', website_id=check.website_id, curr_check_id=check.id),
+        'ai_description': check.ai_description,
+        'ai_significance': check.ai_significance,
+        'ai_detailed': check.ai_detailed or [],
+        'ai_focus': check.ai_focus,
+        'ai_error': check.ai_error,
+    }
+
 @app.route('/history/<int:website_id>')
 def history(website_id):
     website = db.session.get(Website, website_id)
     if not website:
         return redirect(url_for('index'))
-    checks = CheckHistory.query.filter_by(website_id=website_id).order_by(CheckHistory.checked_at.desc()).all()
-    # Parse ai_description for each check
-    ai_data_list = []
-    for check in checks:
-        if check.ai_description:
-            try:
-                ai_data_list.append(json.loads(check.ai_description))
-            except Exception:
-                ai_data_list.append(None)
-        else:
-            ai_data_list.append(None)
-    return render_template('check_history.html', website=website, checks=checks, ai_data_list=ai_data_list)
+    try:
+        checks, next_cursor = get_history_page(website_id, request.args.get('cursor'))
+    except ValueError:
+        return redirect(url_for('history', website_id=website_id))
+    return render_template('check_history.html', website=website, checks=checks, next_cursor=next_cursor)
+
+@app.route('/api/history/<int:website_id>')
+def api_history(website_id):
+    """JSON page of check history for infinite scroll; pass next_cursor back as ?cursor=."""
+    website = db.session.get(Website, website_id)
+    if not website:
+        return jsonify({'status': 'error', 'message': f'Website {website_id} not found'}), 404
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), HISTORY_MAX_PAGE_SIZE)
+    try:
+        checks, next_cursor = get_history_page(website_id, request.args.get('cursor'), limit)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid cursor'}), 400
+    return jsonify({
+        'status': 'success',
+        'checks': [serialize_check(check) for check in checks],
+        'html': render_template('_history_cards.html', website=website, checks=checks),  # Same markup as the first page
+        'next_cursor': next_cursor,
+    })
+
+# Website Stats (read from CheckRollup only)
+STATS_MAX_DAYS = 366
+
+def summarize_rollups(rollups):
+    """Merge CheckRollup rows into totals, rates and response time percentiles."""
+    checks = sum(r.check_count for r in rollups)
+    errors = sum(r.error_count for r in rollups)
+    changes = sum(r.change_count for r in rollups)
+    timed = sum(r.response_time_count for r in rollups)
+    histogram = {}
+    for r in rollups:
+        for bucket, count in (r.response_time_histogram or {}).items():
+            histogram[bucket] = histogram.get(bucket, 0) + count
+    max_times = [r.response_time_max for r in rollups if r.response_time_max is not None]
+    return {
+        'checks': checks,
+        'errors': errors,
+        'changes': changes,
+        'error_rate': errors / checks if checks else None,
+        'change_rate': changes / checks if checks else None,
+        'response_time': {
+            'count': timed,
+            'avg': sum(r.response_time_sum for r in rollups) / timed if timed else None,
+            'max': max(max_times) if max_times else None,
+            'p50': response_time_percentile(histogram, 50),
+            'p95': response_time_percentile(histogram, 95),
+            'p99': response_time_percentile(histogram, 99),
+        },
+    }
+
+@app.route('/api/stats/<int:website_id>')
+def api_website_stats(website_id):
+    """Check counts, change/error rates and response time percentiles for the last ?days= days (default 30)."""
+    website = db.session.get(Website, website_id)
+    if not website:
+        return jsonify({'status': 'error', 'message': f'Website {website_id} not found'}), 404
+    days = min(max(request.args.get('days', 30, type=int), 1), STATS_MAX_DAYS)
+    since = (datetime.now() - timedelta(days=days - 1)).date()
+    rollups = CheckRollup.query.filter(CheckRollup.website_id == website_id, CheckRollup.day >= since).order_by(CheckRollup.day).all()
+    stats = summarize_rollups(rollups)
+    stats.update({
+        'status': 'success',
+        'website_id': website_id,
+        'days': days,
+        'daily': [dict(summarize_rollups([r]), day=r.day.isoformat()) for r in rollups],
+    })
+    return jsonify(stats)
 
 # Visual diff viewer route
 @app.route('/visual_diff/<int:website_id>/<int:curr_check_id>')
@@ -460,16 +1190,9 @@ def visual_diff(website_id, curr_check_id):
     prev_check = CheckHistory.query.filter(CheckHistory.website_id==website_id, CheckHistory.id<curr_check_id).order_by(CheckHistory.id.desc()).first()
     prev_screenshot = prev_check.screenshot_path if prev_check and prev_check.screenshot_path else None
     curr_screenshot = curr_check.screenshot_path if curr_check and curr_check.screenshot_path else None
-    diff_path = curr_check.diff_path if curr_check and curr_check.diff_path else None
-    # For HTML diff, pass the relative path for Jinja2 include
-    diff_include = None
-    if diff_path and os.path.exists(diff_path):
-        # Copy diff to static so it can be included (jinja can't include from outside templates/static)
-        import shutil
-        static_diff_path = f'static/diff_{website_id}_{curr_check_id}.txt'
-        shutil.copyfile(diff_path, static_diff_path)
-        diff_include = static_diff_path.replace('\\', '/')
-    return render_template('visual_diff.html', website=website, prev_screenshot=prev_screenshot, curr_screenshot=curr_screenshot, diff_path=diff_include)
+    # The text diff is fetched separately from check_diff, which renders and caches it once
+    diff_url = url_for('check_diff', check_id=curr_check.id) if curr_check.diff_path else None
+    return render_template('visual_diff.html', website=website, prev_screenshot=prev_screenshot, curr_screenshot=curr_screenshot, diff_url=diff_url)
 
 # Settings
 @app.route('/settings/<user_id>', methods=['GET', 'POST'])
@@ -505,7 +1228,15 @@ def settings(user_id):
                 flash('Notification preferences updated!', 'success')
             else:
                 flash('Invalid time format in summary times. Please use HH:MM format, separated by commas (example: 09:00,17:30).', 'warning')
+        elif 'submit_retention' in request.form:
+            user.retention_days = parse_retention_days(request.form.get('retention_days'))
+            flash('Data retention settings updated!', 'success')
         db.session.commit()
+        if 'submit_notification_prefs' in request.form:
+            try:
+                schedule_user_summary(user)
+            except Exception as e:
+                app.logger.error(f"Failed to update summary schedule for user {user_id}: {e}")
         return redirect(url_for('settings', user_id=user_id))
     
     # Fetch system prompts for display in the settings
@@ -521,7 +1252,8 @@ def settings(user_id):
                            user=user,
                            ai_compare_prompt=ai_compare_prompt,
                            ai_notification_prompt=ai_notification_prompt,
-                           ai_summary_prompt=ai_summary_prompt)
+                           ai_summary_prompt=ai_summary_prompt,
+                           default_retention_days=DATA_RETENTION_DAYS)
 
 @app.route('/update_ai_prompt/<user_id>', methods=['POST'])
 def update_ai_prompt(user_id):
@@ -586,6 +1318,7 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
+import mimetypes
 from email import encoders
 import telebot
 import requests as pyrequests
@@ -598,7 +1331,7 @@ from browser_agent.screenshot import get_screenshot_playwright
 def fetch_website_content(website):
     try:
         proxies = {"http": website.proxy, "https": website.proxy} if website.proxy else None
-        response = pyrequests.get(website.url, timeout=15, proxies=proxies)
+        response = http_get(website.url, timeout=15, proxies=proxies)
         response.raise_for_status()
         html = response.text
         screenshot = None  # Placeholder for screenshot logic
@@ -618,98 +1351,430 @@ def compare_html(old_html, new_html):
     )
     return '\n'.join(diff)
 
-def send_email_notification(user, subject, body, screenshot_path=None):
-    app.logger.debug(f"Attempting to send email to user_id: {user.user_id} (Email: {user.email})")
-    if not user.email:
-        app.logger.warning(f"No email address configured for user_id: {user.user_id}")
-        return False, "No email address configured."
-
-    # --- Retrieve Credentials ---
-    smtp_host = os.getenv('SMTP_HOST')
-    smtp_port_str = os.getenv('SMTP_PORT', '587') # Default to 587 for TLS
-    smtp_user = os.getenv('SMTP_USER')
-    smtp_pass = os.getenv('SMTP_PASS')
-    email_from = os.getenv('EMAIL_FROM')
-
-    # --- Validate Credentials ---
-    if not all([smtp_host, smtp_port_str, smtp_user, smtp_pass, email_from]):
-        app.logger.error(f"Email credentials missing in .env for user {user.user_id}")
-        return False, "Email server credentials missing in configuration."
+NOTIFICATION_CHANNEL_TIMEOUT = int(os.getenv('NOTIFICATION_CHANNEL_TIMEOUT', '30'))  # Seconds a single email/Telegram/Teams send may take
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', '2'))  # Authenticated SMTP sessions kept open per worker process
+SMTP_IDLE_TIMEOUT = int(os.getenv('SMTP_IDLE_TIMEOUT', '60'))  # Idle sessions older than this are closed instead of reused
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'true').lower() != 'false'  # Disable for local relays without TLS (ports other than 465)
+
+def channel_time_left(deadline):
+    """Socket timeout for the next blocking call of a channel send that must finish by `deadline` (monotonic)."""
+    if deadline is None:
+        return NOTIFICATION_CHANNEL_TIMEOUT
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise TimeoutError(f"No time left of the {NOTIFICATION_CHANNEL_TIMEOUT}s channel timeout")
+    return min(left, NOTIFICATION_CHANNEL_TIMEOUT)
+
+class SMTPSessionPool:
+    """Authenticated SMTP sessions reused across messages.
+
+    Sessions idle for longer than idle_timeout are closed rather than reused, and a session the
+    server has dropped is replaced once per message before the send is reported as failed.
+    """
 
+    def __init__(self, host, port, user, password, size=SMTP_POOL_SIZE, idle_timeout=SMTP_IDLE_TIMEOUT):
+        self.host, self.port, self.user, self.password = host, port, user, password
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._idle = []  # (server, last_used)
+        self._lock = threading.Lock()
+        self.stats = {'connects': 0, 'reuses': 0, 'reconnects': 0, 'messages': 0}
+
+    def _connect(self, timeout=NOTIFICATION_CHANNEL_TIMEOUT):
+        if self.port == 465:
+            server = smtplib.SMTP_SSL(self.host, self.port, context=ssl.create_default_context(), timeout=timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=timeout)
+            if SMTP_STARTTLS:
+                server.ehlo()
+                server.starttls()
+                server.ehlo()
+        try:
+            server.login(self.user, self.password)
+        except Exception:
+            server.close()
+            raise
+        self.stats['connects'] += 1
+        return server
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    @staticmethod
+    def _session_lost(error):
+        """True if the error means the session is unusable (as opposed to this message being refused)."""
+        if isinstance(error, smtplib.SMTPServerDisconnected):
+            return True
+        if isinstance(error, smtplib.SMTPResponseException):
+            return error.smtp_code == 421  # Service closing transmission channel
+        return not isinstance(error, smtplib.SMTPException)  # Socket errors (reset, broken pipe, timeout)
+
+    def _acquire(self, deadline=None):
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                server, last_used = self._idle.pop()
+                if now - last_used < self.idle_timeout:
+                    self.stats['reuses'] += 1
+                    return server
+                self._close(server)
+        return self._connect(channel_time_left(deadline))
+
+    def _release(self, server):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((server, time.monotonic()))
+                return
+        self._close(server)
+
+    def send(self, messages, deadline=None):
+        """Send (from_addr, to_addrs, message) tuples over one session.
+
+        Returns one entry per message: None if sent, else the exception. Raises if no session
+        can be established at all; if a reconnect fails or the deadline passes partway through,
+        that error is reported for the current and remaining messages and earlier results are kept.
+        """
+        server = self._acquire(deadline)
+        results = []
+        for index, (from_addr, to_addrs, message) in enumerate(messages):
+            try:
+                if server is None:  # Previous message lost the session
+                    server = self._reconnect(deadline)
+                server.sock.settimeout(channel_time_left(deadline))  # Pooled sessions keep the last caller's timeout
+                try:
+                    server.sendmail(from_addr, to_addrs, message)
+                except Exception as e:
+                    if not self._session_lost(e):
+                        results.append(e)
+                        continue
+                    self._close(server)
+                    server = None
+                    server = self._reconnect(deadline)
+                    try:
+                        server.sendmail(from_addr, to_addrs, message)
+                    except Exception as retry_error:
+                        if self._session_lost(retry_error):
+                            self._close(server)
+                            server = None
+                        results.append(retry_error)
+                        continue
+            except Exception as connect_error:
+                results.extend([connect_error] * (len(messages) - index))
+                break
+            self.stats['messages'] += 1
+            results.append(None)
+        if server:
+            self._release(server)
+        return results
+
+    def _reconnect(self, deadline=None):
+        server = self._connect(channel_time_left(deadline))
+        self.stats['reconnects'] += 1
+        return server
+
+_smtp_pools = {}
+_smtp_pools_lock = threading.Lock()
+
+def get_smtp_pool(host, port, user, password):
+    """Shared SMTPSessionPool for these settings, per process (forked workers don't share sockets)."""
+    key = (os.getpid(), host, port, user, password)
+    with _smtp_pools_lock:
+        pool = _smtp_pools.get(key)
+        if pool is None:
+            pool = _smtp_pools[key] = SMTPSessionPool(host, port, user, password)
+        return pool
+
+def notification_email_image(notification):
+    """Contact sheet JPEG for a notification's email: its check, or for a summary the latest check per website.
+
+    Built once into DERIVED_IMAGE_DIR and reused on delivery retries. Returns the path, or None.
+    """
+    path = os.path.join(DERIVED_IMAGE_DIR, f"sheet_n{notification.id}.jpg")
+    if os.path.exists(path):
+        return path
     try:
-        smtp_port = int(smtp_port_str)
-    except ValueError:
-        app.logger.error(f"Invalid SMTP_PORT value: {smtp_port_str}")
-        return False, "Invalid SMTP port configured."
-
-    # --- Construct Email Message ---
+        if notification.notification_type == 'summary':
+            sources, seen = [], set()
+            for website_id, check_id in db.session.query(Notification.website_id, Notification.check_history_id).filter(
+                    Notification.summary_id == notification.id, Notification.check_history_id.isnot(None)
+            ).order_by(Notification.id.desc()):
+                if website_id not in seen and len(sources) < CONTACT_SHEET_MAX_ITEMS:
+                    seen.add(website_id)
+                    sources.append(check_id)
+            sources.reverse()
+        else:
+            sources = [notification.check_history_id] if notification.check_history_id else []
+        if not sources:
+            return None
+        checks = {c.id: c for c in CheckHistory.query.filter(CheckHistory.id.in_(sources))}
+        urls = dict(db.session.query(Website.id, Website.url).filter(Website.id.in_({c.website_id for c in checks.values()})))
+        items = []
+        for check_id in sources:
+            check = checks.get(check_id)
+            after_path = resolve_data_path(check.screenshot_path) if check else None
+            if not after_path:
+                continue
+            previous = db.session.query(CheckHistory.screenshot_path).filter(
+                CheckHistory.website_id == check.website_id, CheckHistory.id < check.id, CheckHistory.screenshot_path.isnot(None)
+            ).order_by(CheckHistory.id.desc()).first()
+            when = check.checked_at.strftime('%Y-%m-%d %H:%M') if check.checked_at else ''
+            items.append((f"{urls.get(check.website_id, '')} ({when})", resolve_data_path(previous[0]) if previous else None, after_path))
+        return build_contact_sheet(items, path) if items else None
+    except Exception as e:
+        app.logger.error(f"Could not build contact sheet for notification {notification.id}: {e}", exc_info=True)
+        return None
+
+def email_image_within_budget(path, max_bytes=EMAIL_IMAGE_MAX_BYTES):
+    """The path itself if it fits the email budget, else a downscaled JPEG derivative that does, else None."""
+    if os.path.getsize(path) <= max_bytes:
+        return path
+    for width in (1280, 960, 640):
+        derived_path, _ = get_image_derivative(path, width=width, fmt='jpeg', quality=70)
+        if derived_path and os.path.getsize(derived_path) <= max_bytes:
+            return derived_path
+    return None
+
+def build_email_message(email_from, to_addr, subject, body, screenshot_path=None):
     msg = MIMEMultipart()
     msg['From'] = email_from
-    msg['To'] = user.email
+    msg['To'] = to_addr
     msg['Subject'] = subject
 
     msg.attach(MIMEText(body, 'plain'))
 
-    # --- Attach Screenshot (if provided and exists) ---
+    # --- Attach Screenshot (if provided and exists), kept within EMAIL_IMAGE_MAX_BYTES ---
     if screenshot_path and os.path.exists(screenshot_path):
         try:
-            with open(screenshot_path, 'rb') as attachment:
-                part = MIMEBase('application', 'octet-stream')
+            attachment_path = email_image_within_budget(screenshot_path)
+            if not attachment_path:
+                app.logger.warning(f"Screenshot {screenshot_path} exceeds the {EMAIL_IMAGE_MAX_BYTES} byte email budget; not attached")
+                return msg
+            mime_type = mimetypes.guess_type(attachment_path)[0] or 'application/octet-stream'
+            with open(attachment_path, 'rb') as attachment:
+                part = MIMEBase(*mime_type.split('/', 1))
                 part.set_payload(attachment.read())
             encoders.encode_base64(part)
             part.add_header(
                 'Content-Disposition',
-                f"attachment; filename= {os.path.basename(screenshot_path)}",
+                f"attachment; filename= {os.path.basename(attachment_path)}",
             )
             msg.attach(part)
-            app.logger.debug(f"Attached screenshot {screenshot_path} to email for {user.user_id}")
+            app.logger.debug(f"Attached screenshot {screenshot_path} to email for {to_addr}")
         except Exception as e:
-            app.logger.error(f"Error attaching screenshot {screenshot_path} to email for {user.user_id}: {e}", exc_info=True)
+            app.logger.error(f"Error attaching screenshot {screenshot_path} to email for {to_addr}: {e}", exc_info=True)
             # Continue sending email without attachment
+    return msg
+
+def send_email_notification(user, subject, body, screenshot_path=None, deadline=None):
+    return send_email_batch([(user, subject, body, screenshot_path)], deadline)[0]
+
+def send_email_batch(items, deadline=None):
+    """Send (user, subject, body, screenshot_path) emails over one pooled SMTP session.
+
+    Returns an (ok, message) tuple per item, in order. No socket call blocks past `deadline` (monotonic).
+    """
+    results = [None] * len(items)
+    pending = []
+    for i, (user, subject, body, screenshot_path) in enumerate(items):
+        app.logger.debug(f"Attempting to send email to user_id: {user.user_id} (Email: {user.email})")
+        if not user.email:
+            app.logger.warning(f"No email address configured for user_id: {user.user_id}")
+            results[i] = (False, "No email address configured.")
+        else:
+            pending.append(i)
+    if not pending:
+        return results
+
+    # --- Retrieve Credentials ---
+    smtp_host = os.getenv('SMTP_HOST')
+    smtp_port_str = os.getenv('SMTP_PORT', '587') # Default to 587 for TLS
+    smtp_user = os.getenv('SMTP_USER')
+    smtp_pass = os.getenv('SMTP_PASS')
+    email_from = os.getenv('EMAIL_FROM')
+
+    # --- Validate Credentials ---
+    if not all([smtp_host, smtp_port_str, smtp_user, smtp_pass, email_from]):
+        app.logger.error(f"Email credentials missing in .env for {len(pending)} email(s)")
+        for i in pending:
+            results[i] = (False, "Email server credentials missing in configuration.")
+        return results
+
+    try:
+        smtp_port = int(smtp_port_str)
+    except ValueError:
+        app.logger.error(f"Invalid SMTP_PORT value: {smtp_port_str}")
+        for i in pending:
+            results[i] = (False, "Invalid SMTP port configured.")
+        return results
 
     # --- Send Email ---
+    messages = []
+    for i in pending:
+        user, subject, body, screenshot_path = items[i]
+        msg = build_email_message(email_from, user.email, subject, body, screenshot_path)
+        messages.append((email_from, user.email, msg.as_string()))
     try:
-        app.logger.debug(f"Connecting to SMTP server: {smtp_host}:{smtp_port}")
-        # Use SSL if port is 465, otherwise use TLS (STARTTLS)
-        if smtp_port == 465:
-            context = ssl.create_default_context()
-            with smtplib.SMTP_SSL(smtp_host, smtp_port, context=context) as server:
-                app.logger.debug(f"Logging in as {smtp_user}")
-                server.login(smtp_user, smtp_pass)
-                app.logger.debug(f"Sending email to {user.email}")
-                server.sendmail(email_from, user.email, msg.as_string())
-                app.logger.info(f"Email sent successfully to {user.email} for user {user.user_id}")
-        else: # Assume STARTTLS for other ports like 587
-            with smtplib.SMTP(smtp_host, smtp_port) as server:
-                server.ehlo() # Can be omitted
-                server.starttls()
-                server.ehlo() # Can be omitted
-                app.logger.debug(f"Logging in as {smtp_user}")
-                server.login(smtp_user, smtp_pass)
-                app.logger.debug(f"Sending email to {user.email}")
-                server.sendmail(email_from, user.email, msg.as_string())
-                app.logger.info(f"Email sent successfully to {user.email} for user {user.user_id}")
-        return True, "Email sent successfully."
-    except smtplib.SMTPAuthenticationError as e:
-        app.logger.error(f"SMTP Authentication Error for user {user.user_id} ({smtp_user}): {e}", exc_info=True)
+        app.logger.debug(f"Sending {len(messages)} email(s) via pooled SMTP session to {smtp_host}:{smtp_port}")
+        errors = get_smtp_pool(smtp_host, smtp_port, smtp_user, smtp_pass).send(messages, deadline)
+    except Exception as e:
+        errors = [e] * len(messages)  # No session could be established
+    for i, error in zip(pending, errors):
+        user = items[i][0]
+        if error is None:
+            app.logger.info(f"Email sent successfully to {user.email} for user {user.user_id}")
+            results[i] = (True, "Email sent successfully.")
+        else:
+            results[i] = _email_error_result(user, error, smtp_host, smtp_port, smtp_user, email_from)
+    return results
+
+def _email_error_result(user, e, smtp_host, smtp_port, smtp_user, email_from):
+    """Log an SMTP failure and map it to the (False, message) returned by send_email_notification."""
+    if isinstance(e, smtplib.SMTPAuthenticationError):
+        app.logger.error(f"SMTP Authentication Error for user {user.user_id} ({smtp_user}): {e}", exc_info=e)
         return False, f"Email authentication failed: {e}"
-    except smtplib.SMTPConnectError as e:
-        app.logger.error(f"SMTP Connection Error for user {user.user_id} ({smtp_host}:{smtp_port}): {e}", exc_info=True)
+    if isinstance(e, smtplib.SMTPConnectError):
+        app.logger.error(f"SMTP Connection Error for user {user.user_id} ({smtp_host}:{smtp_port}): {e}", exc_info=e)
         return False, f"Failed to connect to email server: {e}"
-    except smtplib.SMTPSenderRefused as e:
-         app.logger.error(f"SMTP Sender Refused for user {user.user_id} (From: {email_from}): {e}", exc_info=True)
-         return False, f"Email sender refused: {e}"
-    except smtplib.SMTPRecipientsRefused as e:
-        app.logger.error(f"SMTP Recipient Refused for user {user.user_id} (To: {user.email}): {e}", exc_info=True)
+    if isinstance(e, smtplib.SMTPSenderRefused):
+        app.logger.error(f"SMTP Sender Refused for user {user.user_id} (From: {email_from}): {e}", exc_info=e)
+        return False, f"Email sender refused: {e}"
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        app.logger.error(f"SMTP Recipient Refused for user {user.user_id} (To: {user.email}): {e}", exc_info=e)
         return False, f"Email recipient refused: {e}"
-    except socket.gaierror as e:
-        app.logger.error(f"SMTP Hostname Resolution Error for user {user.user_id} (Host: {smtp_host}): {e}", exc_info=True)
+    if isinstance(e, socket.gaierror):
+        app.logger.error(f"SMTP Hostname Resolution Error for user {user.user_id} (Host: {smtp_host}): {e}", exc_info=e)
         return False, f"Could not resolve email server hostname: {e}"
-    except Exception as e:
-        app.logger.error(f"Generic error sending email for user {user.user_id}: {e}", exc_info=True)
-        return False, f"An unexpected error occurred sending email: {e}"
+    app.logger.error(f"Generic error sending email for user {user.user_id}: {e}", exc_info=e)
+    return False, f"An unexpected error occurred sending email: {e}"
+
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '25'))  # Messages/second per bot token (Telegram allows about 30)
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))  # Messages/second per chat
+TELEGRAM_MAX_RETRIES = 3  # 429 responses honoured (waiting retry_after) before giving up
+TELEGRAM_MESSAGE_LIMIT = 4096  # Characters per sendMessage
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token, returning the seconds to wait before using it (0 if available now)."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def refund(self):
+        """Return a reserved token that won't be used."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+    def pause(self, seconds):
+        """Hold the bucket empty for `seconds` (server asked us to back off)."""
+        with self._lock:
+            self._tokens = min(self._tokens, -seconds * self.rate)
+            self._updated = time.monotonic()
+
+class TelegramSender:
+    """Bot API client with a keep-alive session and per-bot / per-chat rate limiting.
+
+    Long messages are split at TELEGRAM_MESSAGE_LIMIT. A 429 pauses the chat's bucket for
+    retry_after seconds and the message is retried; nothing waits past `deadline`.
+    """
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.session = http_session()  # Shared keep-alive pool
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.stats = {'sent': 0, 'rate_limited': 0, 'throttled_seconds': 0.0}
+
+    def _bucket(self, key, rate, capacity):
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(rate, capacity)
+            return self._buckets[key]
+
+    @staticmethod
+    def split_message(text, limit=TELEGRAM_MESSAGE_LIMIT):
+        chunks = []
+        while len(text) > limit:
+            cut = text.rfind('\n', 0, limit)
+            cut = cut if cut > limit // 2 else limit
+            chunks.append(text[:cut])
+            text = text[cut:].lstrip('\n')
+        chunks.append(text)
+        return chunks
+
+    def _wait_for_slot(self, bot_token, chat_id, deadline):
+        buckets = (self._bucket(bot_token, self.global_rate, max(1, int(self.global_rate))),
+                   self._bucket((bot_token, chat_id), self.chat_rate, 1))
+        wait = max(bucket.reserve() for bucket in buckets)
+        if time.monotonic() + wait > deadline:
+            for bucket in buckets:
+                bucket.refund()
+            return False
+        if wait:
+            self.stats['throttled_seconds'] += wait
+            time.sleep(wait)
+        return True
+
+    def send(self, bot_token, chat_id, text, parse_mode='Markdown', deadline=None):
+        """Send text to a chat. Returns (ok, message)."""
+        deadline = deadline or time.monotonic() + NOTIFICATION_CHANNEL_TIMEOUT
+        api_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+        for chunk in self.split_message(text):
+            payload = {'chat_id': chat_id, 'text': chunk}
+            if parse_mode:
+                payload['parse_mode'] = parse_mode
+            for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+                if not self._wait_for_slot(bot_token, chat_id, deadline):
+                    return False, "Telegram rate limit: no send slot before the deadline."
+                response = self.session.post(api_url, data=payload, timeout=max(1.0, deadline - time.monotonic()))
+                try:
+                    response_data = response.json()
+                except ValueError:
+                    response.raise_for_status()
+                    response_data = {}
+                if response.status_code == 429:
+                    retry_after = (response_data.get('parameters') or {}).get('retry_after', 1)
+                    self.stats['rate_limited'] += 1
+                    self._bucket((bot_token, chat_id), self.chat_rate, 1).pause(retry_after)
+                    app.logger.warning(f"Telegram rate limited chat {chat_id}; retrying after {retry_after}s")
+                    continue
+                if response.status_code == 400 and 'parse entities' in response_data.get('description', '') and 'parse_mode' in payload:
+                    del payload['parse_mode']  # Markdown broken by the content (or a split); resend as plain text
+                    continue
+                if not response_data.get('ok'):
+                    return False, f"Telegram API Error: {response_data.get('description', response.status_code)}"
+                self.stats['sent'] += 1
+                break
+            else:
+                return False, "Telegram API Error: still rate limited after retries."
+        return True, "Telegram message sent successfully."
+
+_telegram_senders = {}
 
-def send_telegram_notification(user_id, message):
+def get_telegram_sender():
+    """Per-process TelegramSender (forked workers don't share sessions or buckets)."""
+    pid = os.getpid()
+    if pid not in _telegram_senders:
+        _telegram_senders[pid] = TelegramSender()
+    return _telegram_senders[pid]
+
+def send_telegram_notification(user_id, message, deadline=None):
     app.logger.debug(f"Attempting to send Telegram notification to user_id: {user_id}")
     user = User.query.filter_by(user_id=user_id).first()
     if not user:
@@ -730,24 +1795,14 @@ def send_telegram_notification(user_id, message):
         return False, "Telegram Chat ID not configured."
 
     # --- Send Message ---
-    api_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    payload = {
-        'chat_id': chat_id,
-        'text': message,
-        'parse_mode': 'Markdown' # Optional: use Markdown for formatting
-    }
     try:
         app.logger.debug(f"Sending Telegram message to chat_id: {chat_id}")
-        response = ext_requests.post(api_url, data=payload, timeout=10)
-        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-        response_data = response.json()
-        if response_data.get('ok'):
+        ok, result = get_telegram_sender().send(bot_token, chat_id, message, deadline=deadline)
+        if ok:
             app.logger.info(f"Telegram message sent successfully to chat_id {chat_id} for user {user_id}")
-            return True, "Telegram message sent successfully."
         else:
-            error_description = response_data.get('description', 'Unknown error')
-            app.logger.error(f"Telegram API error for user {user_id}: {error_description} (Payload: {payload}, Response: {response.text})")
-            return False, f"Telegram API Error: {error_description}"
+            app.logger.error(f"Telegram delivery failed for user {user_id}: {result}")
+        return ok, result
     except ext_requests.exceptions.RequestException as e:
         app.logger.error(f"Network error sending Telegram message for user {user_id}: {e}", exc_info=True)
         return False, f"Network error sending Telegram message: {e}"
@@ -755,7 +1810,7 @@ def send_telegram_notification(user_id, message):
         app.logger.error(f"Generic error sending Telegram message for user {user_id}: {e}", exc_info=True)
         return False, f"An unexpected error occurred sending Telegram message: {e}"
 
-def send_teams_notification(user_id, message):
+def send_teams_notification(user_id, message, deadline=None):
     print(f"[DEBUG] Attempting to send Teams notification to user_id: {user_id}")
     """Send notification to a user via Microsoft Teams"""
     user = User.query.filter_by(user_id=user_id).first()
@@ -781,7 +1836,7 @@ def send_teams_notification(user_id, message):
         }
 
         # Send the message to Teams
-        response = ext_requests.post(webhook_url, json=card)
+        response = http_post(webhook_url, json=card, timeout=channel_time_left(deadline))
 
         # Check if the request was successful
         if response.status_code == 200:
@@ -930,34 +1985,73 @@ def detect_anomaly(website, last_check, new_html, response_time, error=None):
     return change_detected, ai_description
 
 # Data cleanup
-def cleanup_old_data(max_age_days=30):
-    """Deletes check history, screenshots, html, and diff files older than max_age_days."""
-    app.logger.info(f"Starting data cleanup for data older than {max_age_days} days.")
-    cutoff_date = datetime.now() - timedelta(days=max_age_days)
-
-    old_checks = CheckHistory.query.filter(CheckHistory.checked_at < cutoff_date).all()
-    deleted_count = 0
-
-    for check in old_checks:
-        # Delete associated files
-        for file_path in [check.screenshot_path, check.html_path, check.diff_path]:
-            if file_path and os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                    app.logger.debug(f"Deleted old file: {file_path}")
-                    deleted_count += 1
-                except OSError as e:
-                    app.logger.error(f"Error deleting file {file_path}: {e}")
+def cleanup_old_data(max_age_days=None):
+    """Deletes check history, screenshots, html, and diff files past their retention policy.
+
+    Runs inline; HTTP routes enqueue tasks.apply_retention on RQ instead.
+    """
+    from tasks import apply_retention
+    return apply_retention(max_age_days=max_age_days)
 
-        # Delete the history record
-        db.session.delete(check)
+def enqueue_maintenance_job(func, **kwargs):
+    """Enqueue a data maintenance task on RQ. Returns the job, or None if Redis is unavailable."""
+    redis_conn = get_redis_connection()
+    if not redis_conn:
+        app.logger.error(f"Redis connection failed. Cannot enqueue {func.__name__} job.")
+        return None
+    q = Queue(connection=redis_conn)
+    job = q.enqueue(func, kwargs=kwargs, job_timeout=3600)
+    app.logger.info(f"{func.__name__} job enqueued ({kwargs}). Job ID: {job.id}")
+    return job
+
+def enqueue_retention_job(user_id=None, website_id=None, max_age_days=None):
+    """Enqueue tasks.apply_retention on RQ. Returns the job, or None if Redis is unavailable."""
+    from tasks import apply_retention  # Import here to avoid circular imports
+    return enqueue_maintenance_job(apply_retention, user_id=user_id, website_id=website_id, max_age_days=max_age_days)
+
+@app.route('/admin/apply_retention_tiers', methods=['POST'])
+def admin_apply_retention_tiers():
+    """Admin route to downsample old screenshots according to the retention tiers."""
+    submitted_admin_key = request.form.get('admin_key')
+    correct_admin_key = os.getenv('ADMIN_KEY')
+    if not correct_admin_key or submitted_admin_key != correct_admin_key:
+        app.logger.warning(f"Unauthorized attempt to apply retention tiers (invalid/missing Admin Key).")
+        flash('Invalid or missing Admin Key. Retention tiering not permitted.', 'danger')
+        return redirect(url_for('index'))
 
+    from tasks import apply_retention_tiers  # Import here to avoid circular imports
     try:
-        db.session.commit()
-        app.logger.info(f"Data cleanup complete. Deleted {deleted_count} files and {len(old_checks)} history records.")
+        job = enqueue_maintenance_job(apply_retention_tiers)
+        if job:
+            flash(f"Screenshot downsampling started in the background (job {job.id}).", "success")
+        else:
+            flash("Could not start screenshot downsampling: Redis is unavailable.", "danger")
     except Exception as e:
-        app.logger.error(f"Error during data cleanup commit: {e}")
-        db.session.rollback()
+        app.logger.error(f"Error enqueueing retention tiers: {e}", exc_info=True)
+        flash(f"Error starting screenshot downsampling: {e}", "danger")
+    return redirect(url_for('index'))
+
+@app.route('/admin/rebuild_rollups', methods=['POST'])
+def admin_rebuild_rollups():
+    """Admin route to recompute the daily check rollups from CheckHistory."""
+    submitted_admin_key = request.form.get('admin_key')
+    correct_admin_key = os.getenv('ADMIN_KEY')
+    if not correct_admin_key or submitted_admin_key != correct_admin_key:
+        app.logger.warning(f"Unauthorized attempt to rebuild rollups (invalid/missing Admin Key).")
+        flash('Invalid or missing Admin Key. Rollup rebuild not permitted.', 'danger')
+        return redirect(url_for('index'))
+
+    from tasks import rebuild_check_rollups  # Import here to avoid circular imports
+    try:
+        job = enqueue_maintenance_job(rebuild_check_rollups, website_id=request.form.get('website_id', type=int))
+        if job:
+            flash(f"Rollup rebuild started in the background (job {job.id}).", "success")
+        else:
+            flash("Could not start the rollup rebuild: Redis is unavailable.", "danger")
+    except Exception as e:
+        app.logger.error(f"Error enqueueing rollup rebuild: {e}", exc_info=True)
+        flash(f"Error starting the rollup rebuild: {e}", "danger")
+    return redirect(url_for('index'))
 
 @app.route('/admin/cleanup_data', methods=['POST'])
 def admin_cleanup_data():
@@ -970,12 +2064,15 @@ def admin_cleanup_data():
         flash('Invalid or missing Admin Key. Data cleanup not permitted.', 'danger')
         return redirect(url_for('index'))
     
-    app.logger.info(f"Admin-authorized request received to clean up data older than 30 days")
+    app.logger.info(f"Admin-authorized request received to apply data retention policies (default {DATA_RETENTION_DAYS} days)")
     
     try:
-        # Execute the cleanup process
-        cleanup_old_data(max_age_days=30)
-        flash("Successfully deleted data older than 30 days.", "success")
+        # Run the cleanup on the worker so large deletions don't block the request
+        job = enqueue_retention_job()
+        if job:
+            flash(f"Data cleanup started in the background (job {job.id}). Data older than each site's retention policy (default {DATA_RETENTION_DAYS} days) will be deleted.", "success")
+        else:
+            flash("Could not start data cleanup: Redis is unavailable.", "danger")
     except Exception as e:
         app.logger.error(f"Error during data cleanup: {e}", exc_info=True)
         flash(f"Error during data cleanup: {e}", "danger")
@@ -989,11 +2086,11 @@ def delete_old_data(user_id, period):
     submitted_admin_key = request.form.get('admin_key')
     correct_admin_key = os.getenv('ADMIN_KEY')
     if not correct_admin_key or submitted_admin_key != correct_admin_key:
-        logger.warning(f"Unauthorized attempt to delete data for user {user_id} (invalid/missing Admin Key).")
+        app.logger.warning(f"Unauthorized attempt to delete data for user {user_id} (invalid/missing Admin Key).")
         flash('Invalid or missing Admin Key. Data deletion not permitted.', 'danger')
         return redirect(url_for('settings', user_id=user_id))
 
-    logger.info(f"Admin-authorized request received to delete data older than {period} for user {user_id}")
+    app.logger.info(f"Admin-authorized request received to delete data older than {period} for user {user_id}")
 
     user = User.query.filter_by(user_id=user_id).first()
     if not user:
@@ -1002,84 +2099,90 @@ def delete_old_data(user_id, period):
 
     if period == 'month':
         days = 30
-        cutoff_date = datetime.now() - timedelta(days=days)
-        logger.info(f"Deleting data older than {days} days (cutoff: {cutoff_date}) for user {user_id}")
     elif period == 'year':
         days = 365
-        cutoff_date = datetime.now() - timedelta(days=days)
-        logger.info(f"Deleting data older than {days} days (cutoff: {cutoff_date}) for user {user_id}")
     else:
         flash('Invalid time period specified.', 'danger')
         return redirect(url_for('settings', user_id=user_id))
 
-    # Find websites associated with the user
-    websites = Website.query.filter_by(user_id=user_id).all()
-    website_ids = [w.id for w in websites]
-
-    if not website_ids:
-        flash('No websites found for this user.', 'info')
-        return redirect(url_for('settings', user_id=user_id))
-
-    # Find history records older than the cutoff date for these websites
-    old_history = CheckHistory.query.filter(
-        CheckHistory.website_id.in_(website_ids),
-        CheckHistory.checked_at < cutoff_date
-    ).all()
-
-    deleted_files_count = 0
-    deleted_records_count = 0
-    failed_deletions = []
-
-    data_dir = app.config.get('DATA_FOLDER', 'data')
-
-    for history in old_history:
-        # Delete associated files first
-        for file_path_attr in ['screenshot_path', 'html_path', 'diff_path']:
-            file_path = getattr(history, file_path_attr, None)
-            if file_path:
-                # Construct full path relative to app root
-                # full_file_path = os.path.join(data_dir, os.path.basename(file_path))
-                # Correction: Assume paths stored are relative to app root (e.g., 'data/file.png')
-                full_file_path = os.path.abspath(file_path)
-                if os.path.exists(full_file_path):
-                    try:
-                        os.remove(full_file_path)
-                        logger.debug(f"Deleted old data file: {full_file_path}")
-                        deleted_files_count += 1
-                    except OSError as e:
-                        logger.error(f"Error deleting file {full_file_path}: {e}")
-                        failed_deletions.append(os.path.basename(full_file_path))
-                else:
-                    logger.warning(f"File path in history record not found, skipping deletion: {full_file_path}")
-
-        # Delete the history record itself
-        try:
-            db.session.delete(history)
-            deleted_records_count += 1
-        except Exception as e:
-            logger.error(f"Error deleting history record ID {history.id}: {e}")
-            db.session.rollback() # Rollback the specific deletion failure
-            # Continue trying to delete other records
-
-    # Commit deletions after processing all records
     try:
-        db.session.commit()
-        logger.info(f"Committed deletion of {deleted_records_count} history records for user {user_id}.")
+        job = enqueue_retention_job(user_id=user_id, max_age_days=days)
+        if job:
+            flash(f'Deletion of data older than {period} started in the background (job {job.id}).', 'success')
+        else:
+            flash('Could not start data deletion: Redis is unavailable.', 'danger')
     except Exception as e:
-        logger.error(f"Error committing final deletions for user {user_id}: {e}")
-        db.session.rollback()
-        flash('An error occurred during the final commit of data deletion.', 'danger')
-        return redirect(url_for('settings', user_id=user_id))
-
-    if failed_deletions:
-        flash(f'Deleted {deleted_records_count} history records and {deleted_files_count} associated files. Failed to delete some files: {", ".join(failed_deletions)}', 'warning')
-    elif deleted_records_count > 0 or deleted_files_count > 0:
-        flash(f'Successfully deleted {deleted_records_count} history records and {deleted_files_count} associated files older than {period}.', 'success')
-    else:
-        flash(f'No data found older than {period} to delete.', 'info')
+        app.logger.error(f"Failed to enqueue data deletion for user {user_id}: {e}", exc_info=True)
+        flash(f'Error starting data deletion: {e}', 'danger')
 
     return redirect(url_for('settings', user_id=user_id))
 
+@app.route('/job_status/<job_id>')
+def job_status(job_id):
+    """Report status and progress of a background job (e.g. data retention)."""
+    from rq.job import Job
+    from rq.exceptions import NoSuchJobError
+    redis_conn = get_redis_connection()
+    if not redis_conn:
+        return jsonify({'status': 'error', 'message': 'Redis connection failed'}), 500
+    try:
+        job = Job.fetch(job_id, connection=redis_conn)
+    except NoSuchJobError:
+        return jsonify({'status': 'error', 'message': f'Job {job_id} not found'}), 404
+    return jsonify({
+        'status': job.get_status(),
+        'progress': job.meta.get('progress'),
+        'result': job.result if job.is_finished else None,
+        'error': job.exc_info if job.is_failed else None
+    })
+
+def outbound_connection_stats():
+    """Connection reuse for this process: pooled HTTP hosts, SMTP sessions and the Telegram sender."""
+    pid = os.getpid()
+    smtp = {}
+    for key, pool in list(_smtp_pools.items()):
+        if key[0] == pid:
+            smtp[f"{key[1]}:{key[2]}"] = dict(pool.stats)
+    telegram = _telegram_senders.get(pid)
+    return {'http': get_http_stats(), 'smtp': smtp, 'telegram': dict(telegram.stats) if telegram else None}
+
+@app.route('/api/http_stats')
+def api_http_stats():
+    """Outbound connection reuse stats for this web process and the snapshots published by workers."""
+    processes = {f"web:{os.getpid()}": outbound_connection_stats()}
+    redis_conn = get_redis_connection()
+    if redis_conn:
+        for name, raw in redis_conn.hgetall(HTTP_STATS_KEY).items():
+            try:
+                processes[name.decode() if isinstance(name, bytes) else name] = json.loads(raw)
+            except ValueError:
+                continue
+    return jsonify({'processes': processes})
+
+@app.route('/api/summary_lag')
+def api_summary_lag():
+    """How long after their due time summaries were generated and delivered, over the last ?days= days (default 1)."""
+    from tasks import SUMMARY_LAG_KEY  # Import here to avoid circular imports
+    days = max(1, min(request.args.get('days', 1, type=int), 7))
+    redis_conn = get_redis_connection()
+    if not redis_conn:
+        return jsonify({'status': 'error', 'message': 'Redis connection failed'}), 500
+    today = datetime.now().date()
+    stages = {}
+    for stage in ('generated', 'delivered'):
+        histogram = {}
+        for offset in range(days):
+            key = SUMMARY_LAG_KEY.format(stage=stage, day=(today - timedelta(days=offset)).isoformat())
+            for bucket, count in redis_conn.hgetall(key).items():
+                bucket = int(bucket)
+                histogram[bucket] = histogram.get(bucket, 0) + int(count)
+        stages[stage] = {
+            'count': sum(histogram.values()),
+            'p50': response_time_percentile(histogram, 50),
+            'p95': response_time_percentile(histogram, 95),
+            'max': response_time_percentile(histogram, 100),
+        }
+    return jsonify({'days': days, 'lag_seconds': stages})
 
 # RQ Queue setup
 q = Queue(connection=redis_url)
@@ -1219,8 +2322,74 @@ def scheduled_checks():
 
 
 # --- NEW: Daily Summary Notification Job --- #
-@scheduler.scheduled_job('interval', minutes=10) # Check every 10 minute
+SUMMARY_SCHEDULE_KEY = 'summary_schedule'  # Redis sorted set: user_id scored by the epoch time its next summary is due
+SUMMARY_POLL_SECONDS = int(os.getenv('SUMMARY_POLL_SECONDS', '30'))  # How often due summaries are looked up
+SUMMARY_PREFERENCES = ('summary', 'both')
+SUMMARY_IN_CHUNK = 500  # Max notification IDs per IN (...) clause (SQLite variable limit)
+
+def parse_summary_times(summary_times):
+    """Valid (hour, minute) pairs from a comma-separated HH:MM string, sorted and de-duplicated."""
+    slots = set()
+    for part in (summary_times or '').split(','):
+        try:
+            hour, minute = (int(x) for x in part.strip().split(':'))
+        except ValueError:
+            continue
+        if 0 <= hour < 24 and 0 <= minute < 60:
+            slots.add((hour, minute))
+    return sorted(slots)
+
+def next_summary_due(summary_times, after):
+    """The first configured summary time strictly after `after` (local time), or None if none are configured."""
+    slots = parse_summary_times(summary_times)
+    for days in (0, 1):
+        day = after + timedelta(days=days)
+        for hour, minute in slots:
+            due = day.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if due > after:
+                return due
+    return None
+
+def schedule_user_summary(user, redis_conn=None, after=None):
+    """Store the user's next summary due time in the schedule, or remove the user if they get no summaries."""
+    redis_conn = redis_conn or get_redis_connection()
+    if not redis_conn:
+        return None
+    due = None
+    if user.notification_preference in SUMMARY_PREFERENCES:
+        due = next_summary_due(user.summary_times, after or datetime.now())
+    if due:
+        redis_conn.zadd(SUMMARY_SCHEDULE_KEY, {user.user_id: due.timestamp()})
+    else:
+        redis_conn.zrem(SUMMARY_SCHEDULE_KEY, user.user_id)
+    return due
+
+def sync_summary_schedule(redis_conn):
+    """Add summary users missing from the schedule and drop members that no longer get summaries.
+
+    Existing entries keep their score, so a summary that is due but not yet sent is not skipped.
+    """
+    now = datetime.now()
+    wanted = {}
+    summary_users = db.session.query(User.user_id, User.summary_times).filter(
+        User.notification_preference.in_(SUMMARY_PREFERENCES))
+    for user_id, summary_times in summary_users:
+        due = next_summary_due(summary_times, now)
+        if due:
+            wanted[user_id] = due.timestamp()
+    scheduled = {m.decode() if isinstance(m, bytes) else m for m in redis_conn.zrange(SUMMARY_SCHEDULE_KEY, 0, -1)}
+    stale = scheduled - set(wanted)
+    pipe = redis_conn.pipeline()
+    if wanted:
+        pipe.zadd(SUMMARY_SCHEDULE_KEY, wanted, nx=True)
+    if stale:
+        pipe.zrem(SUMMARY_SCHEDULE_KEY, *stale)
+    pipe.execute()
+    app.logger.info(f"Summary schedule synced: {len(wanted)} users, {len(stale)} stale entries removed")
+
+@scheduler.scheduled_job('interval', seconds=SUMMARY_POLL_SECONDS)
 def send_daily_summaries():
+    """Send summaries for users whose next summary time in the schedule has arrived, then reschedule them."""
     app.logger.debug("Running daily summary check.")
     
     # Get a fresh Redis connection
@@ -1231,169 +2400,262 @@ def send_daily_summaries():
         
     with app.app_context():
         now_local = datetime.now()
-        current_time_str = now_local.strftime('%H:%M')
+        if not redis_conn.exists(SUMMARY_SCHEDULE_KEY):
+            sync_summary_schedule(redis_conn)  # First run, or Redis lost the schedule
+
+        # Only users whose due time has passed are loaded
+        claimed = {}
+        for member, score in redis_conn.zrangebyscore(SUMMARY_SCHEDULE_KEY, '-inf', now_local.timestamp(), withscores=True):
+            if redis_conn.zrem(SUMMARY_SCHEDULE_KEY, member):  # Only one scheduler process claims each due entry
+                claimed[member.decode() if isinstance(member, bytes) else member] = datetime.fromtimestamp(score)
+        if not claimed:
+            return
+
+        due = {}
+        for user in User.query.filter(User.user_id.in_(list(claimed))).all():
+            try:
+                schedule_user_summary(user, redis_conn, after=now_local)
+            except Exception as e:
+                app.logger.error(f"Failed to reschedule summary for user {user.user_id}: {e}")
+            if user.notification_preference in SUMMARY_PREFERENCES:
+                due[user.user_id] = claimed[user.user_id]
+
+        # Each summary is built by its own job on the summaries worker pool
+        from tasks import enqueue_user_summaries, generate_user_summary  # Import here to avoid circular imports
+        if due and not enqueue_user_summaries(due):
+            app.logger.warning(f"Could not queue {len(due)} summary jobs; generating them here")
+            for user_id, due_at in due.items():
+                try:
+                    generate_user_summary(user_id, due_at.timestamp())
+                except Exception as e:
+                    app.logger.error(f"Summary for user {user_id} failed: {e}", exc_info=True)
+        elif due:
+            app.logger.info(f"Queued {len(due)} summary jobs")
 
-        # Find users who want summaries
-        users_for_summary = User.query.filter(
-            (User.notification_preference == 'summary') | (User.notification_preference == 'both')
-        ).all()
+@scheduler.scheduled_job('interval', hours=1)
+def scheduled_summary_schedule_sync():
+    """Repair the summary schedule for users added or changed outside the settings page."""
+    redis_conn = get_redis_connection()
+    if not redis_conn:
+        return
+    with app.app_context():
+        try:
+            sync_summary_schedule(redis_conn)
+        except Exception as e:
+            app.logger.error(f"Summary schedule sync failed: {e}", exc_info=True)
 
-        for user in users_for_summary:
-            if not user.summary_times:
-                continue
+def send_user_summary(user, redis_conn, slot_str, due_ts=None):
+    """Summarize the user's queued notifications into one summary notification and queue it for delivery.
 
-            # Check if current time matches one of the user's summary times
-            summary_times_list = [t.strip() for t in user.summary_times.split(',')]
-            if current_time_str in summary_times_list:
-                app.logger.info(f"Matched summary time {current_time_str} for user {user.user_id}")
-                redis_key = f"summary_queue:{user.user_id}"
-                try:
-                    # Get all queued messages (LPOP until empty or use LRANGE + LTRIM)
-                    queued_items_json = redis_conn.lrange(redis_key, 0, -1)
-                    if not queued_items_json:
-                        app.logger.info(f"No summary items queued for user {user.user_id} at {current_time_str}.")
-                        continue # Nothing to summarize
-
-                    # Get notification IDs from the queue
-                    notification_ids = []
-                    import json
-                    for item_json in queued_items_json:
-                        try:
-                            item = json.loads(item_json)
-                            notification_id = item.get('notification_id')
-                            if notification_id:
-                                notification_ids.append(notification_id)
-                        except json.JSONDecodeError as e:
-                            app.logger.error(f"Failed to decode JSON summary item for user {user.user_id}: {e}")
-                    
-                    # Find the last summary notification to prevent duplicates
-                    last_summary = Notification.query.filter_by(
-                        user_id=user.user_id,
-                        notification_type='summary'
-                    ).order_by(Notification.created_at.desc()).first()
-                    
-                    # Set the cutoff time to filter out older notifications that may have already been summarized
-                    cutoff_time = last_summary.created_at if last_summary else None
-                    
-                    # Query database for notifications that haven't been included in a summary yet
-                    query = Notification.query.filter(
-                        Notification.id.in_(notification_ids),
-                        Notification.included_in_summary == False
-                    )
-                    
-                    # Add time filter if we have a last summary
-                    if cutoff_time:
-                        query = query.filter(Notification.created_at > cutoff_time)
-                        
-                    notifications = query.all()
-                    
-                    if not notifications:
-                        app.logger.info(f"No new notifications to summarize for user {user.user_id}.")
-                        # Clear the processed items from the Redis queue
-                        redis_conn.ltrim(redis_key, len(queued_items_json), -1)
-                        continue
+    Runs in tasks.generate_user_summary. Returns the summary notification id, or None if nothing was sent.
+    """
+    from tasks import enqueue_notification_dispatch, drain_summary_queue, ack_summary_queue, summary_ai_slot, note_summary_generated  # Import here to avoid circular imports
+    try:
+        # Atomically move the queue onto the processing list; it is only deleted once the summary is committed
+        queued_items_json = drain_summary_queue(redis_conn, user.user_id)
+        if not queued_items_json:
+            app.logger.info(f"No summary items queued for user {user.user_id} at {slot_str}.")
+            return # Nothing to summarize
+
+        # Get notification IDs from the queue
+        notification_ids = []
+        import json
+        for item_json in queued_items_json:
+            try:
+                item = json.loads(item_json)
+                notification_id = item.get('notification_id')
+                if notification_id:
+                    notification_ids.append(notification_id)
+            except json.JSONDecodeError as e:
+                app.logger.error(f"Failed to decode JSON summary item for user {user.user_id}: {e}")
+
+        # Find the last summary notification to prevent duplicates
+        last_summary = Notification.query.filter_by(
+            user_id=user.user_id,
+            notification_type='summary'
+        ).order_by(Notification.created_at.desc()).first()
+
+        # Set the cutoff time to filter out older notifications that may have already been summarized
+        cutoff_time = last_summary.created_at if last_summary else None
+
+        # Query database for notifications that haven't been included in a summary yet, with their website URL
+        notification_ids = list(dict.fromkeys(notification_ids))
+        notifications = []
+        for i in range(0, len(notification_ids), SUMMARY_IN_CHUNK):
+            query = db.session.query(
+                Notification.id, Notification.created_at, Notification.content, Website.url
+            ).outerjoin(Website, Website.id == Notification.website_id).filter(
+                Notification.id.in_(notification_ids[i:i + SUMMARY_IN_CHUNK]),
+                Notification.included_in_summary == False
+            )
 
-                    # Process notifications
-                    default_summary_prompt = "You are an AI that generates a consolidated summary of website changes from multiple comparison reports, your purpose is to summary all the send out notification. You will have input from all the AI compare description and summarizes. Write me output format to include bullet points with explanation. Summary what user want to compare. Skip what have been cover in the lastest summary notification. Be analytical and comprehensive."
-                    summary_prompt = os.getenv('AI_NOTIFICATION_SUMMARY_SYSTEM_PROMPT', default_summary_prompt)
-                    
-                    summary_body_parts = [f"AI Website Monitor Summary for {current_time_str} UTC:"]
-                    processed_count = 0
-                    change_details = []
-                    
-                    for notification in notifications:
-                        try:
-                            # Get the website info
-                            website = Website.query.get(notification.website_id)
-                            if not website:
-                                continue
-                                
-                            time_str = notification.created_at.strftime('%H:%M') if notification.created_at else '[time unknown]'
-                            
-                            # Store the change details for potential AI processing
-                            change_details.append({
-                                'url': website.url,
-                                'time': time_str,
-                                'description': notification.content
-                            })
-                            
-                            # Also add to the basic summary format as fallback
-                            summary_body_parts.append(f"\n- {website.url} ({time_str}): {notification.content}")
-                            processed_count += 1
-                        except Exception as e:
-                            app.logger.error(f"Error processing notification {notification.id} for user {user.user_id}: {e}")
-
-                    if processed_count > 0:
-                        summary_body = ""
-                        summary_subject = f"Website Change Summary - {current_time_str} UTC"
-                        
-                        # If we have the Gemini API key, try to generate a nicer summary
-                        gemini_api_key = os.getenv('GEMINI_API_KEY')
-                        if gemini_api_key and len(change_details) > 0:
-                            try:
-                                import google.generativeai as genai
-                                genai.configure(api_key=gemini_api_key)
-                                
-                                # Prepare the prompt for the AI
-                                ai_prompt = f"{summary_prompt}\n\n"
-                                for i, change in enumerate(change_details, 1):
-                                    ai_prompt += f"Site {i}: {change['url']} (at {change['time']})\n"
-                                    ai_prompt += f"Change description: {change['description']}\n\n"
-                                
-                                # Generate the summary
-                                model = genai.GenerativeModel('gemini-2.5-flash-preview-05-20')
-                                response = model.generate_content(ai_prompt)
-                                if response and response.text:
-                                    # Use the AI-generated summary
-                                    summary_body = f"AI Website Monitor Summary for {current_time_str} UTC:\n\n{response.text}"
-                                    app.logger.info(f"Generated AI summary for user {user.user_id}")
-                                else:
-                                    # Fallback to the basic summary
-                                    summary_body = "\n".join(summary_body_parts)
-                                    app.logger.warning(f"AI summary generation returned empty result, using basic summary")
-                            except Exception as e:
-                                # Fallback to the basic summary
-                                summary_body = "\n".join(summary_body_parts)
-                                app.logger.error(f"Error generating AI summary: {e}, using basic summary")
-                        else:
-                            # Use the basic summary if no Gemini API key
-                            summary_body = "\n".join(summary_body_parts)
-
-                        # Create a summary notification record
-                        summary_notification = Notification(
-                            user_id=user.user_id,
-                            website_id=None,  # Summary isn't specific to one website
-                            check_history_id=None,  # Summary doesn't relate to a specific check
-                            notification_type='summary',
-                            content=summary_body,
-                            screenshot_path=None,
-                            sent=True
-                        )
-                        db.session.add(summary_notification)
-                        db.session.flush()  # Get the ID without committing
-                        
-                        # Update all notifications as included in this summary
-                        for notification in notifications:
-                            notification.included_in_summary = True
-                            notification.summary_id = summary_notification.id
-                        
-                        # Commit all changes to the database
-                        db.session.commit()
-
-                        # Send summary notifications
-                        app.logger.info(f"Sending summary to user {user.user_id} ({processed_count} items)")
-                        send_email_notification(user, summary_subject, summary_body)
-                        send_telegram_notification(user.user_id, summary_body)
-                        send_teams_notification(user.user_id, summary_body)
-
-                        # Clear the processed items from the queue
-                        redis_conn.ltrim(redis_key, len(queued_items_json), -1)
-                        app.logger.info(f"Cleared summary queue {redis_key}")
-                    else:
-                        app.logger.warning(f"Failed to process any summary items for user {user.user_id} despite queue having {len(queued_items_json)} items.")
+            # Add time filter if we have a last summary
+            if cutoff_time:
+                query = query.filter(Notification.created_at > cutoff_time)
+
+            notifications.extend(query.all())
+        notifications.sort(key=lambda row: row.id)
 
+        if not notifications:
+            app.logger.info(f"No new notifications to summarize for user {user.user_id}.")
+            # Clear the processed items from the Redis queue
+            ack_summary_queue(redis_conn, user.user_id)
+            return
+
+        # Process notifications
+        default_summary_prompt = "You are an AI that generates a consolidated summary of website changes from multiple comparison reports, your purpose is to summary all the send out notification. You will have input from all the AI compare description and summarizes. Write me output format to include bullet points with explanation. Summary what user want to compare. Skip what have been cover in the lastest summary notification. Be analytical and comprehensive."
+        summary_prompt = os.getenv('AI_NOTIFICATION_SUMMARY_SYSTEM_PROMPT', default_summary_prompt)
+
+        summary_body_parts = [f"AI Website Monitor Summary for {slot_str} UTC:"]
+        processed_count = 0
+        change_details = []
+
+        for notification in notifications:
+            if not notification.url:
+                continue  # Website was deleted
+
+            time_str = notification.created_at.strftime('%H:%M') if notification.created_at else '[time unknown]'
+
+            # Store the change details for potential AI processing
+            change_details.append({
+                'url': notification.url,
+                'time': time_str,
+                'description': notification.content
+            })
+
+            # Also add to the basic summary format as fallback
+            summary_body_parts.append(f"\n- {notification.url} ({time_str}): {notification.content}")
+            processed_count += 1
+
+        if processed_count > 0:
+            summary_body = ""
+            summary_subject = f"Website Change Summary - {slot_str} UTC"
+
+            # If we have the Gemini API key, try to generate a nicer summary
+            gemini_api_key = os.getenv('GEMINI_API_KEY')
+            if gemini_api_key and len(change_details) > 0:
+                try:
+                    import google.generativeai as genai
+                    genai.configure(api_key=gemini_api_key)
+
+                    # Prepare the prompt for the AI
+                    ai_prompt = f"{summary_prompt}\n\n"
+                    for i, change in enumerate(change_details, 1):
+                        ai_prompt += f"Site {i}: {change['url']} (at {change['time']})\n"
+                        ai_prompt += f"Change description: {change['description']}\n\n"
+
+                    # Generate the summary
+                    model = genai.GenerativeModel('gemini-2.5-flash-preview-05-20')
+                    with summary_ai_slot(redis_conn):  # Bounded across all summary workers
+                        response = model.generate_content(ai_prompt)
+                    if response and response.text:
+                        # Use the AI-generated summary
+                        summary_body = f"AI Website Monitor Summary for {slot_str} UTC:\n\n{response.text}"
+                        app.logger.info(f"Generated AI summary for user {user.user_id}")
+                    else:
+                        # Fallback to the basic summary
+                        summary_body = "\n".join(summary_body_parts)
+                        app.logger.warning(f"AI summary generation returned empty result, using basic summary")
                 except Exception as e:
-                    app.logger.error(f"Error processing summary queue {redis_key} for user {user.user_id}: {e}", exc_info=True)
+                    # Fallback to the basic summary
+                    summary_body = "\n".join(summary_body_parts)
+                    app.logger.error(f"Error generating AI summary: {e}, using basic summary")
+            else:
+                # Use the basic summary if no Gemini API key
+                summary_body = "\n".join(summary_body_parts)
+
+            # Create a summary notification record
+            summary_notification = Notification(
+                user_id=user.user_id,
+                website_id=None,  # Summary isn't specific to one website
+                check_history_id=None,  # Summary doesn't relate to a specific check
+                notification_type='summary',
+                content=summary_body,
+                screenshot_path=None,
+                sent=False,
+                dispatch_pending=True  # Outbox: delivered by the notification worker
+            )
+            db.session.add(summary_notification)
+            db.session.flush()  # Get the ID without committing
+
+            # Mark all notifications as included in this summary with one UPDATE per IN chunk
+            summarized_ids = [notification.id for notification in notifications]
+            for i in range(0, len(summarized_ids), SUMMARY_IN_CHUNK):
+                Notification.query.filter(Notification.id.in_(summarized_ids[i:i + SUMMARY_IN_CHUNK])).update(
+                    {Notification.included_in_summary: True, Notification.summary_id: summary_notification.id},
+                    synchronize_session=False)
+
+            # Commit all changes to the database
+            db.session.commit()
+
+            # Hand the summary to the notification queue
+            app.logger.info(f"Queuing summary for user {user.user_id} ({processed_count} items)")
+            if due_ts:
+                note_summary_generated(redis_conn, summary_notification.id, due_ts)
+            enqueue_notification_dispatch(summary_notification.id, summary_subject)
+
+            # Clear the processed items from the queue
+            ack_summary_queue(redis_conn, user.user_id)
+            app.logger.info(f"Cleared summary queue for user {user.user_id}")
+            return summary_notification.id
+        else:
+            app.logger.warning(f"Failed to process any summary items for user {user.user_id} despite queue having {len(queued_items_json)} items.")
+            ack_summary_queue(redis_conn, user.user_id)  # Their websites are gone; retrying won't help
+
+    except Exception as e:
+        app.logger.error(f"Error processing summary queue for user {user.user_id}: {e}", exc_info=True)
+    return None
+
+
+@app.route('/admin/collect_orphans', methods=['POST'])
+def admin_collect_orphans():
+    """Admin route to garbage-collect unreferenced files in the data directory.
+
+    Form fields: admin_key, dry_run ('false' to actually remove), quarantine ('true' to move instead of delete).
+    """
+    submitted_admin_key = request.form.get('admin_key')
+    correct_admin_key = os.getenv('ADMIN_KEY')
+    if not correct_admin_key or submitted_admin_key != correct_admin_key:
+        app.logger.warning(f"Unauthorized attempt to collect orphaned files (invalid/missing Admin Key).")
+        return jsonify({'status': 'error', 'message': 'Invalid or missing Admin Key.'}), 403
+
+    dry_run = request.form.get('dry_run', 'true').lower() != 'false'
+    quarantine = request.form.get('quarantine', 'false').lower() == 'true'
+    from tasks import collect_orphan_files  # Import here to avoid circular imports
+    try:
+        job = enqueue_maintenance_job(collect_orphan_files, dry_run=dry_run, quarantine=quarantine)
+    except Exception as e:
+        app.logger.error(f"Error enqueueing orphan file collection: {e}", exc_info=True)
+        return jsonify({'status': 'error', 'message': f'Failed to enqueue job: {e}'}), 500
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Redis connection failed'}), 500
+    return jsonify({
+        'status': 'success',
+        'message': 'Orphan file collection enqueued' + (' (dry run)' if dry_run else ''),
+        'job_id': job.id,
+        'status_url': url_for('job_status', job_id=job.id)
+    })
+
+
+@scheduler.scheduled_job('interval', minutes=5)
+def scheduled_outbox_sweep():
+    """Re-queue outbox notifications whose dispatch job never completed."""
+    from tasks import dispatch_pending_notifications  # Import here to avoid circular imports
+    try:
+        dispatch_pending_notifications()
+    except Exception as e:
+        app.logger.error(f"Outbox sweep failed: {e}", exc_info=True)
+
+# Nightly tiered retention (opt-in via RETENTION_TIERS_ENABLED)
+@scheduler.scheduled_job('cron', hour=3, minute=30)
+def scheduled_retention_tiers():
+    if not RETENTION_TIERS_ENABLED:
+        return
+    from tasks import apply_retention_tiers  # Import here to avoid circular imports
+    try:
+        enqueue_maintenance_job(apply_retention_tiers)
+    except Exception as e:
+        app.logger.error(f"Failed to enqueue nightly retention tiers: {e}", exc_info=True)
 
 
 # Manual check route
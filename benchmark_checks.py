@@ -0,0 +1,135 @@
+"""
+Benchmark the database side of a website check: one commit per step (the old
+check_website_direct flow: history, immediate notification, summary notification,
+website status) versus the single transaction used now (tasks.stage_check_notifications
++ one commit). Screenshots, AI calls and notification sending are not exercised.
+
+Runs against a throwaway SQLite database through the app's own models and engine
+settings, with several worker processes to reproduce write contention, and prints
+checks/second for both flows.
+
+Usage: python benchmark_checks.py [--checks 2000] [--workers 4] [--websites 50] [--synchronous NORMAL|FULL]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+
+def _load_app(db_path, synchronous):
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    import app as app_module
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, "connect")
+    def set_synchronous(dbapi_connection, connection_record):
+        dbapi_connection.execute(f"PRAGMA synchronous={synchronous}")  # Runs after the app's own PRAGMAs
+
+    return app_module
+
+
+def legacy_check(app_module, user, website, now):
+    """The pre-outbox flow: every step commits on its own."""
+    db, CheckHistory, CheckRollup, Notification = app_module.db, app_module.CheckHistory, app_module.CheckRollup, app_module.Notification
+    check = CheckHistory(website_id=website.id, checked_at=now, ai_description="Change detected: new banner.",
+                         ai_significance='medium', change_detected=True, response_time=1.2)
+    db.session.add(check)
+    CheckRollup.record(check)
+    db.session.commit()
+    db.session.add(Notification(user_id=user.user_id, website_id=website.id, check_history_id=check.id,
+                                notification_type='immediate', content="Change detected", sent=True))
+    db.session.commit()
+    db.session.add(Notification(user_id=user.user_id, website_id=website.id, check_history_id=check.id,
+                                notification_type='immediate', content="Change detected", sent=False, included_in_summary=False))
+    db.session.commit()
+    website.status = 'change'
+    website.last_checked = now
+    db.session.commit()
+
+
+def single_transaction_check(app_module, user, website, now):
+    """The current flow: stage everything, flush once, commit once."""
+    from tasks import stage_check_notifications
+    db, CheckHistory, CheckRollup = app_module.db, app_module.CheckHistory, app_module.CheckRollup
+    website.status = 'change'
+    website.last_checked = now
+    check = CheckHistory(website_id=website.id, checked_at=now, ai_description="Change detected: new banner.",
+                         ai_significance='medium', change_detected=True, response_time=1.2)
+    db.session.add(check)
+    CheckRollup.record(check)
+    stage_check_notifications(user, website, check, check.ai_description, "Change detected", None, now, True)
+    db.session.flush()
+    db.session.commit()
+
+
+FLOWS = {'legacy': legacy_check, 'single': single_transaction_check}
+
+
+def worker(db_path, synchronous, flow, website_ids, checks, results):
+    app_module = _load_app(db_path, synchronous)
+    run_check = FLOWS[flow]
+    with app_module.app.app_context():
+        user = app_module.User.query.filter_by(user_id='bench').one()
+        websites = [app_module.db.session.get(app_module.Website, site_id) for site_id in website_ids]
+        start = time.perf_counter()
+        for i in range(checks):
+            run_check(app_module, user, websites[i % len(websites)], datetime.now())
+        results.put(time.perf_counter() - start)
+
+
+def run(args, app_module, db_path, flow):
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+        app_module.db.session.add(app_module.User(user_id='bench', notification_preference='both'))
+        websites = [app_module.Website(url=f"https://site{i}.example.com", user_id='bench') for i in range(args.websites)]
+        app_module.db.session.add_all(websites)
+        app_module.db.session.commit()
+        site_ids = [w.id for w in websites]
+        app_module.db.engine.dispose()
+
+    per_worker = args.checks // args.workers
+    ctx = multiprocessing.get_context('spawn')  # Fresh interpreter per worker, each with its own engine
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(db_path, args.synchronous, flow, site_ids[i::args.workers] or site_ids, per_worker, results))
+             for i in range(args.workers)]
+    for p in procs:
+        p.start()
+    elapsed = max(results.get() for _ in procs)
+    for p in procs:
+        p.join()
+    return per_worker * args.workers, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checks', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--websites', type=int, default=50)
+    parser.add_argument('--synchronous', default='NORMAL', choices=['OFF', 'NORMAL', 'FULL'])
+    args = parser.parse_args()
+
+    print(f"{args.checks} checks, {args.workers} workers, {args.websites} websites, synchronous={args.synchronous}")
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    rates = {}
+    try:
+        app_module = _load_app(db_path, args.synchronous)
+        for flow, label in (('legacy', 'Commit per step (before)'), ('single', 'Single transaction (after)')):
+            total, elapsed = run(args, app_module, db_path, flow)
+            rates[flow] = total / elapsed
+            print(f"- {label}: {total} checks in {elapsed:.2f}s ({rates[flow]:.0f} checks/s)")
+    finally:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    print(f"Speedup: {rates['single'] / rates['legacy']:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+Benchmark the hot database queries before and after the composite indexes
+added in migration c5e8f1a2b3d4.
+
+Seeds a throwaway SQLite database (1M check_history rows by default), runs each
+query without indexes, creates the indexes, and runs them again, printing the
+query plan and timings for both.
+
+Usage: python benchmark_queries.py [--rows 1000000] [--websites 2000] [--users 200] [--db bench.db]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+SCHEMA = """
+CREATE TABLE user (id INTEGER PRIMARY KEY, user_id VARCHAR(64) UNIQUE NOT NULL, notification_preference VARCHAR(20));
+CREATE TABLE website (id INTEGER PRIMARY KEY, url VARCHAR(2048) NOT NULL, user_id VARCHAR(64), status VARCHAR(32));
+CREATE TABLE check_history (id INTEGER PRIMARY KEY, website_id INTEGER, checked_at DATETIME, screenshot_path VARCHAR(256),
+    ai_description TEXT, change_detected BOOLEAN, error VARCHAR(512), response_time FLOAT);
+CREATE TABLE notification (id INTEGER PRIMARY KEY, user_id VARCHAR(64), website_id INTEGER, check_history_id INTEGER,
+    notification_type VARCHAR(20), content TEXT, created_at DATETIME, sent BOOLEAN, included_in_summary BOOLEAN);
+"""
+
+# Must match migrations/versions/c5e8f1a2b3d4_add_composite_indexes.py
+INDEXES = """
+CREATE INDEX ix_website_user_id ON website (user_id);
+CREATE INDEX ix_check_history_website_id_checked_at ON check_history (website_id, checked_at);
+CREATE INDEX ix_check_history_website_id_change_detected_checked_at ON check_history (website_id, change_detected, checked_at);
+CREATE INDEX ix_check_history_checked_at ON check_history (checked_at);
+CREATE INDEX ix_notification_user_id_notification_type_created_at ON notification (user_id, notification_type, created_at);
+CREATE INDEX ix_notification_check_history_id ON notification (check_history_id);
+"""
+
+# (name, sql, params factory) - params are drawn per run so caching one key doesn't flatter results
+QUERIES = [
+    ("latest check for a website (every check / get_latest_history)",
+     "SELECT * FROM check_history WHERE website_id = ? ORDER BY checked_at DESC LIMIT 1",
+     lambda a: (random.randint(1, a.websites),)),
+    ("last changed check for a website (dashboard)",
+     "SELECT * FROM check_history WHERE website_id = ? AND change_detected = 1 ORDER BY checked_at DESC LIMIT 1",
+     lambda a: (random.randint(1, a.websites),)),
+    ("history page for a website",
+     "SELECT id, checked_at FROM check_history WHERE website_id = ? ORDER BY checked_at DESC LIMIT 50",
+     lambda a: (random.randint(1, a.websites),)),
+    ("websites for a user (dashboard)",
+     "SELECT * FROM website WHERE user_id = ?",
+     lambda a: (f"user{random.randint(1, a.users)}",)),
+    ("last summary for a user (send_daily_summaries)",
+     "SELECT * FROM notification WHERE user_id = ? AND notification_type = 'summary' ORDER BY created_at DESC LIMIT 1",
+     lambda a: (f"user{random.randint(1, a.users)}",)),
+    ("retention sweep batch",
+     "SELECT id FROM check_history WHERE checked_at < ? ORDER BY id LIMIT 500",
+     lambda a: ((datetime.now() - timedelta(days=300)).isoformat(sep=' '),)),
+]
+
+
+def seed(conn, args):
+    print(f"Seeding {args.users} users, {args.websites} websites, {args.rows} check_history rows...")
+    start = time.perf_counter()
+    conn.executescript(SCHEMA)
+    conn.executemany("INSERT INTO user (id, user_id, notification_preference) VALUES (?, ?, 'both')",
+                     [(i, f"user{i}") for i in range(1, args.users + 1)])
+    conn.executemany("INSERT INTO website (id, url, user_id, status) VALUES (?, ?, ?, 'no-change')",
+                     [(i, f"https://site{i}.example.com", f"user{random.randint(1, args.users)}") for i in range(1, args.websites + 1)])
+    now = datetime.now()
+    batch = []
+    notifications = []
+    for i in range(1, args.rows + 1):
+        checked_at = (now - timedelta(minutes=random.randint(0, 365 * 24 * 60))).isoformat(sep=' ')
+        changed = random.random() < 0.1
+        batch.append((i, random.randint(1, args.websites), checked_at, f"data/screenshot_{i}.png", "No significant change.", changed))
+        if changed:
+            notifications.append((f"user{random.randint(1, args.users)}", i, random.choice(['immediate', 'immediate', 'summary']), checked_at))
+        if len(batch) >= 50000:
+            conn.executemany("INSERT INTO check_history (id, website_id, checked_at, screenshot_path, ai_description, change_detected) VALUES (?, ?, ?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO check_history (id, website_id, checked_at, screenshot_path, ai_description, change_detected) VALUES (?, ?, ?, ?, ?, ?)", batch)
+    conn.executemany("INSERT INTO notification (user_id, check_history_id, notification_type, created_at, sent, included_in_summary) VALUES (?, ?, ?, ?, 1, 0)", notifications)
+    conn.commit()
+    print(f"Seeded in {time.perf_counter() - start:.1f}s ({len(notifications)} notifications)")
+
+
+def run_queries(conn, args, label):
+    print(f"\n=== {label} ===")
+    conn.execute("ANALYZE")
+    results = {}
+    for name, sql, params in QUERIES:
+        plan = " | ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params(args)))
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            conn.execute(sql, params(args)).fetchall()
+        avg_ms = (time.perf_counter() - start) * 1000 / args.iterations
+        results[name] = avg_ms
+        print(f"- {name}\n    plan: {plan}\n    avg:  {avg_ms:.3f} ms")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--websites', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--db', default='benchmark_queries.db')
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    random.seed(42)
+    conn = sqlite3.connect(args.db)
+    try:
+        seed(conn, args)
+        before = run_queries(conn, args, "Without indexes")
+        start = time.perf_counter()
+        conn.executescript(INDEXES)
+        print(f"\nCreated indexes in {time.perf_counter() - start:.1f}s")
+        after = run_queries(conn, args, "With composite indexes")
+        print("\n=== Speedup ===")
+        for name in before:
+            print(f"- {name}: {before[name]:.3f} ms -> {after[name]:.3f} ms ({before[name] / max(after[name], 1e-6):.0f}x)")
+    finally:
+        conn.close()
+        os.remove(args.db)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Benchmark email notification throughput: a new SMTP connection + login per message (the old
+send_email_notification) versus the pooled sessions used now (app.SMTPSessionPool), sending
+one message at a time and in batches over one session.
+
+Runs against a local aiosmtpd stand-in (pip install aiosmtpd) that accepts any login and
+discards the mail. --handshake-ms adds server-side delay to EHLO and AUTH to approximate the
+round trips and TLS handshake of a remote provider.
+
+Usage: python benchmark_smtp.py [--messages 500] [--handshake-ms 0] [--batch 50]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import smtplib
+import sys
+import time
+from types import SimpleNamespace
+
+
+def start_server(port, handshake_ms):
+    from aiosmtpd.controller import Controller
+    from aiosmtpd.smtp import AuthResult
+
+    delay = handshake_ms / 1000.0
+
+    class Handler:
+        async def handle_EHLO(self, server, session, envelope, hostname, responses):
+            await asyncio.sleep(delay)
+            session.host_name = hostname
+            return responses
+
+        async def handle_DATA(self, server, session, envelope):
+            return '250 OK'
+
+    def authenticator(server, session, envelope, mechanism, auth_data):
+        time.sleep(delay)  # Blocks the server loop like a slow auth backend would
+        return AuthResult(success=True)
+
+    logging.getLogger('mail.log').setLevel(logging.ERROR)  # aiosmtpd logs every session
+    controller = Controller(Handler(), hostname='127.0.0.1', port=port,
+                            authenticator=authenticator, auth_require_tls=False)
+    controller.start()
+    return controller
+
+
+def connect_per_message(messages, host, port):
+    """The pre-pool flow: connect, EHLO, login, send, quit for every message."""
+    for from_addr, to_addr, message in messages:
+        with smtplib.SMTP(host, port) as server:
+            server.ehlo()
+            server.login('bench', 'bench')
+            server.sendmail(from_addr, to_addr, message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--handshake-ms', type=float, default=0.0)
+    parser.add_argument('--batch', type=int, default=50)
+    parser.add_argument('--port', type=int, default=8025)
+    args = parser.parse_args()
+
+    host = '127.0.0.1'
+    os.environ.update({'SMTP_HOST': host, 'SMTP_PORT': str(args.port), 'SMTP_USER': 'bench', 'SMTP_PASS': 'bench',
+                       'EMAIL_FROM': 'monitor@example.com', 'SMTP_STARTTLS': 'false'})
+    import app as app_module
+
+    controller = start_server(args.port, args.handshake_ms)
+    try:
+        users = [SimpleNamespace(user_id=f'user{i}', email=f'user{i}@example.com') for i in range(args.messages)]
+        items = [(user, 'Change Detected: https://example.com', 'Change detected: new banner.\n' * 20, None) for user in users]
+        raw = [('monitor@example.com', user.email, app_module.build_email_message(
+            'monitor@example.com', user.email, subject, body).as_string()) for user, subject, body, _ in items]
+
+        print(f"{args.messages} messages, handshake delay {args.handshake_ms:.0f} ms")
+        rates = {}
+        start = time.perf_counter()
+        connect_per_message(raw, host, args.port)
+        rates['per_message'] = args.messages / (time.perf_counter() - start)
+        print(f"- Connection per message (before): {rates['per_message']:.0f} msg/s")
+
+        with app_module.app.app_context():
+            pool = app_module.get_smtp_pool(host, args.port, 'bench', 'bench')
+            start = time.perf_counter()
+            for item in items:
+                ok, message = app_module.send_email_notification(*item)
+                if not ok:
+                    raise SystemExit(f"Send failed: {message}")
+            rates['pooled'] = args.messages / (time.perf_counter() - start)
+            print(f"- Pooled session, one message per call: {rates['pooled']:.0f} msg/s")
+
+            start = time.perf_counter()
+            for i in range(0, len(items), args.batch):
+                results = app_module.send_email_batch(items[i:i + args.batch])
+                if not all(ok for ok, _ in results):
+                    raise SystemExit("Batch send failed")
+            rates['batched'] = args.messages / (time.perf_counter() - start)
+            print(f"- Pooled session, batches of {args.batch}: {rates['batched']:.0f} msg/s")
+            print(f"Pool stats: {pool.stats}")
+    finally:
+        controller.stop()
+    print(f"Speedup (pooled vs per message): {rates['pooled'] / rates['per_message']:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
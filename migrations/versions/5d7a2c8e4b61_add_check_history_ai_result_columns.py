@@ -0,0 +1,38 @@
+"""add check_history AI result columns
+
+Revision ID: 5d7a2c8e4b61
+Revises: e1b7d3a9f642
+Create Date: 2026-10-19 16:24:05.318842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d7a2c8e4b61'
+down_revision = 'e1b7d3a9f642'
+branch_labels = None
+depends_on = None
+
+# Present on the model but never migrated; databases built with db.create_all() already have them
+AI_RESULT_COLUMNS = [
+    sa.Column('ai_significance', sa.String(length=256), nullable=True),
+    sa.Column('ai_detailed', sa.Text(), nullable=True),
+    sa.Column('ai_focus', sa.String(length=256), nullable=True),
+    sa.Column('ai_error', sa.String(length=256), nullable=True),
+]
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('check_history')}
+    with op.batch_alter_table('check_history', schema=None) as batch_op:
+        for column in AI_RESULT_COLUMNS:
+            if column.name not in existing:
+                batch_op.add_column(column)
+
+
+def downgrade():
+    with op.batch_alter_table('check_history', schema=None) as batch_op:
+        for column in reversed(AI_RESULT_COLUMNS):
+            batch_op.drop_column(column.name)
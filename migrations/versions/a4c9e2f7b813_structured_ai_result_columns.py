@@ -0,0 +1,88 @@
+"""store structured AI result fields on check_history
+
+Revision ID: a4c9e2f7b813
+Revises: 5d7a2c8e4b61
+Create Date: 2026-10-19 17:48:13.402751
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c9e2f7b813'
+down_revision = '5d7a2c8e4b61'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+# Legacy rows may hold plain text in ai_detailed; only cast values that look like JSON
+DETAILED_TO_JSON = r"CASE WHEN ai_detailed ~ '^\s*[\[{]' THEN ai_detailed::json ELSE NULL END"
+
+check_history = sa.table(
+    'check_history',
+    sa.column('id', sa.Integer),
+    sa.column('ai_description', sa.Text),
+    sa.column('ai_significance', sa.String),
+    sa.column('ai_detailed', sa.JSON),
+    sa.column('ai_focus', sa.Text),
+    sa.column('ai_error', sa.Text),
+)
+
+
+def upgrade():
+    with op.batch_alter_table('check_history', schema=None) as batch_op:
+        batch_op.alter_column('ai_detailed', existing_type=sa.Text(), type_=sa.JSON(),
+                              postgresql_using=DETAILED_TO_JSON)
+        batch_op.alter_column('ai_focus', existing_type=sa.String(length=256), type_=sa.Text())
+        batch_op.alter_column('ai_error', existing_type=sa.String(length=256), type_=sa.Text())
+
+    # Older rows stored the raw AI JSON in ai_description; split it into the columns once
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(check_history.c.id, check_history.c.ai_description)
+            .where(check_history.c.id > last_id, check_history.c.ai_description.like('{%'))
+            .order_by(check_history.c.id).limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        updates = []
+        for row in rows:
+            try:
+                data = json.loads(row.ai_description)
+            except ValueError:
+                continue
+            if not isinstance(data, dict):
+                continue
+            updates.append({
+                'b_id': row.id,
+                'ai_description': data.get('summary_of_changes') or row.ai_description,
+                'ai_significance': str(data.get('significance_level') or 'none')[:256],
+                'ai_detailed': data.get('detailed_changes') or [],
+                'ai_focus': data.get('focus_area_assessment') or data.get('ai_focus_area') or None,
+                'ai_error': data.get('error_message'),
+            })
+        if updates:
+            bind.execute(
+                check_history.update().where(check_history.c.id == sa.bindparam('b_id')).values(
+                    ai_description=sa.bindparam('ai_description'),
+                    ai_significance=sa.bindparam('ai_significance'),
+                    ai_detailed=sa.bindparam('ai_detailed'),
+                    ai_focus=sa.bindparam('ai_focus'),
+                    ai_error=sa.bindparam('ai_error'),
+                ),
+                updates,
+            )
+
+
+def downgrade():
+    with op.batch_alter_table('check_history', schema=None) as batch_op:
+        batch_op.alter_column('ai_error', existing_type=sa.Text(), type_=sa.String(length=256))
+        batch_op.alter_column('ai_focus', existing_type=sa.Text(), type_=sa.String(length=256))
+        batch_op.alter_column('ai_detailed', existing_type=sa.JSON(), type_=sa.Text(),
+                              postgresql_using='ai_detailed::text')
@@ -0,0 +1,24 @@
+"""merge migration heads
+
+Revision ID: e1b7d3a9f642
+Revises: c5e8f1a2b3d4, 7cdff76e99b3
+Create Date: 2026-10-19 16:22:38.914207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1b7d3a9f642'
+down_revision = ('c5e8f1a2b3d4', '7cdff76e99b3')
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    pass
+
+
+def downgrade():
+    pass
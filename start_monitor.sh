@@ -47,6 +47,17 @@ else
     echo "[WARNING] Could not open a new terminal for RQ worker. Please start the worker manually in a separate terminal."
 fi
 
+# --- Start Notification Worker ---
+echo "Starting notification worker in new terminal..."
+if [ "$(uname)" == "Darwin" ]; then
+    osascript -e "tell application \"Terminal\" to do script \"cd $(pwd) && source venv/bin/activate && python -m rq.cli worker notifications summaries --url $REDIS_URL --worker-class app.WindowsSimpleWorker --with-scheduler\""
+else
+    gnome-terminal -- bash -c "cd $(pwd) && source venv/bin/activate && python -m rq.cli worker notifications summaries --url $REDIS_URL --worker-class app.WindowsSimpleWorker --with-scheduler; exec bash" || \
+    xterm -e "cd $(pwd) && source venv/bin/activate && python -m rq.cli worker notifications summaries --url $REDIS_URL --worker-class app.WindowsSimpleWorker --with-scheduler" || \
+    konsole -e "cd $(pwd) && source venv/bin/activate && python -m rq.cli worker notifications summaries --url $REDIS_URL --worker-class app.WindowsSimpleWorker --with-scheduler" || \
+    echo "[WARNING] Could not open a new terminal for the notification worker. Please start it manually in a separate terminal."
+fi
+
 # --- Wait for worker to start ---
 echo "Waiting for worker to initialize..."
 sleep 3
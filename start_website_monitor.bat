@@ -39,6 +39,7 @@ echo Redis connection successful.
 REM --- Start RQ Worker ---
 echo Starting RQ Worker in new window...
 start "RQ Worker" cmd /k "call venv\Scripts\activate && python -m rq.cli worker default --url %REDIS_URL% --worker-class app.WindowsSimpleWorker --with-scheduler"
+start "Notification Worker" cmd /k "call venv\Scripts\activate && python -m rq.cli worker notifications summaries --url %REDIS_URL% --worker-class app.WindowsSimpleWorker --with-scheduler"
 
 REM --- Wait for worker to start ---
 echo Waiting for worker to initialize...
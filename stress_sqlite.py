@@ -0,0 +1,141 @@
+"""
+Concurrency stress test for the SQLite settings used by the app.
+
+Starts several writer processes (standing in for the web process, the APScheduler
+jobs and RQ workers) that each run check-like transactions: read the latest check
+for a website, insert a check_history row, update the website. Runs once with
+SQLite defaults and once with the app's tuning (config.apply_sqlite_pragmas:
+WAL, synchronous=NORMAL, busy_timeout) and reports throughput, p95 commit latency
+and 'database is locked' failures for each.
+
+Usage: python stress_sqlite.py [--writers 6] [--readers 2] [--transactions 300]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from config import apply_sqlite_pragmas
+
+SCHEMA = """
+CREATE TABLE website (id INTEGER PRIMARY KEY, url VARCHAR(2048), status VARCHAR(32), last_checked DATETIME);
+CREATE TABLE check_history (id INTEGER PRIMARY KEY, website_id INTEGER, checked_at DATETIME, ai_description TEXT, change_detected BOOLEAN);
+CREATE INDEX ix_check_history_website_id_checked_at ON check_history (website_id, checked_at);
+"""
+WEBSITES = 200
+
+
+def connect(path, tuned):
+    # Untuned mirrors what the app did before: sqlite3's 5s default wait, rollback journal, synchronous=FULL
+    conn = sqlite3.connect(path, timeout=5)
+    if tuned:
+        apply_sqlite_pragmas(conn)
+    return conn
+
+
+def writer(path, tuned, transactions, results):
+    conn = connect(path, tuned)
+    latencies, locked = [], 0
+    started = time.perf_counter()
+    for _ in range(transactions):
+        website_id = random.randint(1, WEBSITES)
+        start = time.perf_counter()
+        try:
+            conn.execute("SELECT id FROM check_history WHERE website_id = ? ORDER BY checked_at DESC LIMIT 1", (website_id,)).fetchone()
+            now = datetime.now().isoformat(sep=' ')
+            conn.execute("INSERT INTO check_history (website_id, checked_at, ai_description, change_detected) VALUES (?, ?, ?, ?)",
+                         (website_id, now, "No significant change." * 20, random.random() < 0.1))
+            conn.execute("UPDATE website SET status = 'no-change', last_checked = ? WHERE id = ?", (now, website_id))
+            conn.commit()
+            latencies.append(time.perf_counter() - start)
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            if 'locked' in str(e) or 'busy' in str(e):
+                locked += 1
+            else:
+                raise
+    conn.close()
+    results.put(('writer', (latencies, time.perf_counter() - started), locked))
+
+
+def reader(path, tuned, stop_at, results):
+    conn = connect(path, tuned)
+    reads, locked = 0, 0
+    while time.time() < stop_at:
+        try:
+            conn.execute("SELECT w.id, MAX(c.checked_at) FROM website w JOIN check_history c ON c.website_id = w.id GROUP BY w.id").fetchall()
+            reads += 1
+        except sqlite3.OperationalError as e:
+            if 'locked' in str(e) or 'busy' in str(e):
+                locked += 1
+            else:
+                raise
+    conn.close()
+    results.put(('reader', reads, locked))
+
+
+def run(args, tuned):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        conn = connect(path, tuned)
+        conn.executescript(SCHEMA)
+        conn.executemany("INSERT INTO website (id, url, status) VALUES (?, ?, 'active')",
+                         [(i, f"https://site{i}.example.com") for i in range(1, WEBSITES + 1)])
+        conn.commit()
+        conn.close()
+
+        results = multiprocessing.Queue()
+        writers = [multiprocessing.Process(target=writer, args=(path, tuned, args.transactions, results)) for _ in range(args.writers)]
+        for p in writers:
+            p.start()
+        readers = [multiprocessing.Process(target=reader, args=(path, tuned, time.time() + args.reader_seconds, results)) for _ in range(args.readers)]
+        for p in readers:
+            p.start()
+
+        latencies, elapsed, write_locked, reads, read_locked = [], 0.0, 0, 0, 0
+        for _ in range(len(writers) + len(readers)):
+            kind, value, locked = results.get()
+            if kind == 'writer':
+                latencies.extend(value[0])
+                elapsed = max(elapsed, value[1])  # Slowest writer bounds the wall time
+                write_locked += locked
+            else:
+                reads += value
+                read_locked += locked
+        for p in writers + readers:
+            p.join()
+    finally:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else float('nan')
+    label = "Tuned (WAL, synchronous=NORMAL, busy_timeout)" if tuned else "SQLite defaults"
+    print(f"\n=== {label} ===")
+    print(f"committed:      {len(latencies)}/{args.writers * args.transactions} in {elapsed:.1f}s ({len(latencies) / elapsed:.0f} commits/s)")
+    print(f"p95 commit:     {p95:.1f} ms")
+    print(f"locked writes:  {write_locked}")
+    print(f"reads:          {reads} ({read_locked} locked)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=6)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--transactions', type=int, default=300)
+    parser.add_argument('--reader-seconds', type=float, default=5.0)
+    args = parser.parse_args()
+    run(args, tuned=False)
+    run(args, tuned=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
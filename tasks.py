@@ -1,8 +1,15 @@
+import hashlib
 import os
-from datetime import datetime
+import random
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
 import logging # Import logging
-from rq import get_current_job
-from config import get_redis_connection, logger
+from rq import Queue, get_current_job
+from config import get_redis_connection, logger, http_get, publish_connection_stats
 import json # Import json
 import requests
 from app import app
@@ -30,6 +37,13 @@ def get_redis():
         logger.error(f"Error getting Redis connection in task: {e}")
         return None
 
+SUMMARY_QUEUE_TTL = 172800  # 48 hours expiry
+SUMMARY_QUEUE_BATCH = 1000  # Items moved per RPUSH inside the drain script
+
+def summary_queue_keys(user_id):
+    """The user's summary queue and the processing list its items sit in until a summary is committed."""
+    return f"summary_queue:{user_id}", f"summary_processing:{user_id}"
+
 # Function to safely add to the Redis queue
 def add_to_summary_queue(user_id, notification_payload):
     """Safely add a notification to the summary queue."""
@@ -39,21 +53,477 @@ def add_to_summary_queue(user_id, notification_payload):
             logger.error(f"Cannot queue summary for user {user_id}: Redis connection failed")
             return False
             
-        redis_key = f"summary_queue:{user_id}"
+        redis_key, _ = summary_queue_keys(user_id)
         payload_json = json.dumps(notification_payload)
-        redis_conn.rpush(redis_key, payload_json)
-        redis_conn.expire(redis_key, 172800)  # 48 hours expiry
+        pipe = redis_conn.pipeline(transaction=False)  # One round trip for both commands
+        pipe.rpush(redis_key, payload_json)
+        pipe.expire(redis_key, SUMMARY_QUEUE_TTL)
+        pipe.execute()
         logger.info(f"Queued summary for user {user_id}, notification ID: {notification_payload.get('notification_id', 'unknown')}")
         return True
     except Exception as e:
         logger.error(f"Failed to queue summary for user {user_id}: {e}")
         return False
 
+# Moves everything queued so far onto the processing list (kept from an unacknowledged earlier drain) and returns it
+DRAIN_SUMMARY_QUEUE_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        redis.call('RENAME', KEYS[1], KEYS[2])
+    end
+else
+    local items = redis.call('LRANGE', KEYS[1], 0, -1)
+    local batch = tonumber(ARGV[2])
+    for i = 1, #items, batch do
+        redis.call('RPUSH', KEYS[2], unpack(items, i, math.min(i + batch - 1, #items)))
+    end
+    redis.call('DEL', KEYS[1])
+end
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return redis.call('LRANGE', KEYS[2], 0, -1)
+"""
+
+def drain_summary_queue(redis_conn, user_id):
+    """Atomically take all of a user's queued summary items; call ack_summary_queue once they are committed.
+
+    Items from a drain that was never acknowledged (crash, failed commit) are returned again.
+    """
+    drain = redis_conn.register_script(DRAIN_SUMMARY_QUEUE_LUA)  # EVALSHA, loading the script on first use
+    return drain(keys=summary_queue_keys(user_id), args=[SUMMARY_QUEUE_TTL, SUMMARY_QUEUE_BATCH])
+
+def ack_summary_queue(redis_conn, user_id):
+    """Drop the items taken by the last drain_summary_queue call."""
+    redis_conn.delete(summary_queue_keys(user_id)[1])
+
+# --- Check result notifications (staged in the check's transaction, dispatched after commit) ---
+DEFAULT_NOTIFICATION_PROMPT = "You are an AI that summarizes the differences between two website screenshots/html based on user-specified criteria, your purpose is to send notification on the summary of what different. Write me output format to include bullet points with explanation. Summary what user want to compare. Skip what have been cover in the lastest notification, which include in the page. Be analytical and comprehensive."
+OUTBOX_RETRY_AFTER_MINUTES = 5  # Pending notifications older than this are re-dispatched by the sweeper
+OUTBOX_INLINE_SEND_LIMIT = int(os.getenv('OUTBOX_INLINE_SEND_LIMIT', '20'))  # Inline sends per sweep when the notification queue is down
+NOTIFICATION_QUEUE = os.getenv('NOTIFICATION_QUEUE', 'notifications')  # RQ queue served by the notification worker
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', '4'))  # Delivery attempts before a channel is given up
+NOTIFICATION_RETRY_BASE_SECONDS = int(os.getenv('NOTIFICATION_RETRY_BASE_SECONDS', '30'))  # Backoff doubles per attempt: 30s, 60s, 120s...
+TELEGRAM_COALESCE_MAX = int(os.getenv('TELEGRAM_COALESCE_MAX', '10'))  # Pending notifications merged into one Telegram message
+TELEGRAM_COALESCE_SEPARATOR = "\n\n---\n\n"
+ALERT_NOTIFICATIONS = {  # Check alerts: notification_type -> (channels it is sent on, subject)
+    'error': (('email',), "Website Monitor Error: {url}"),
+    'captcha': (('email',), "Website Monitor CAPTCHA: {url}"),
+    'anomaly': (('teams',), "Anomaly Detected: {url}"),
+}
+NOTIFICATION_DEDUP_WINDOW_MINUTES = int(os.getenv('NOTIFICATION_DEDUP_WINDOW_MINUTES', '360'))  # Same change not re-sent within this; 0 disables
+FLAP_CHANGE_THRESHOLD = int(os.getenv('FLAP_CHANGE_THRESHOLD', '4'))  # Changes within FLAP_WINDOW_MINUTES that mark a site as flapping; 0 disables
+FLAP_WINDOW_MINUTES = int(os.getenv('FLAP_WINDOW_MINUTES', '60'))
+FLAP_NOTIFY_INTERVAL_MINUTES = int(os.getenv('FLAP_NOTIFY_INTERVAL_MINUTES', '60'))  # At most one notification per interval while flapping
+CHANGE_REGION_COLUMNS = 8  # Changed-region grid used in the content hash: eighths of the width...
+CHANGE_REGION_BAND_PX = 400  # ...by 400px bands, so small layout shifts hash the same
+
+def build_notification_body(website, ai_description, change_detected, now):
+    """Immediate notification text; rewritten by Gemini when GEMINI_API_KEY is set. Makes no DB writes."""
+    stamp = now.strftime('%Y-%m-%d %H:%M:%S')
+    if change_detected:
+        body = f"Change detected on {website.url} at {stamp}:\n\n{ai_description}"
+    else:
+        body = f"Website check completed for {website.url} at {stamp}:\n\nNo changes detected. Status: {website.status}"
+
+    # Check if the AI description appears to be an error message
+    is_error_desc = "error" in ai_description.lower() or "failed" in ai_description.lower() or "exception" in ai_description.lower()
+    gemini_api_key = os.getenv('GEMINI_API_KEY')
+    if not gemini_api_key or not ai_description or is_error_desc:
+        return body
+
+    notification_prompt = os.getenv('AI_NOTIFICATION_SYSTEM_PROMPT', DEFAULT_NOTIFICATION_PROMPT)
+    try:
+        import google.generativeai as genai
+        genai.configure(api_key=gemini_api_key)
+        ai_prompt = f"{notification_prompt}\n\nWebsite: {website.url}\nTime: {stamp}\nChange description: {ai_description}"
+        response = genai.GenerativeModel('gemini-1.5-flash-latest').generate_content(ai_prompt)
+        if response and response.text:
+            app.logger.info("Generated enhanced AI notification message")
+            if change_detected:
+                return f"Change detected on {website.url} at {stamp}:\n\n{response.text}"
+            return f"Website check completed for {website.url} at {stamp}:\n\nNo changes detected. {response.text}"
+        app.logger.warning("AI notification generation returned empty result, using basic message")
+    except Exception as e:
+        app.logger.error(f"Error generating AI notification: {e}, using basic message")
+    return body
+
+def normalize_change_summary(text):
+    """Sorted, de-duplicated words of a change summary, without URLs and numbers, so re-worded or re-timed repeats match."""
+    text = re.sub(r'https?://\S+', ' ', (text or '').lower())
+    return ' '.join(sorted(set(re.findall(r'[^\W\d_]{3,}', text))))
+
+def change_region_key(previous_screenshot, screenshot_path):
+    """Grid cells spanned by the area that differs between two screenshots, or '' when unknown."""
+    from app import changed_region, resolve_data_path
+    from PIL import Image
+    before_path, after_path = resolve_data_path(previous_screenshot), resolve_data_path(screenshot_path)
+    if not before_path or not after_path:
+        return ''
+    try:
+        with Image.open(before_path) as before, Image.open(after_path) as after:
+            box = changed_region(before, after, padding=0)
+            column_width = after.width / CHANGE_REGION_COLUMNS
+        if not box:
+            return ''
+        return (f"{int(box[0] // column_width)},{box[1] // CHANGE_REGION_BAND_PX},"
+                f"{int(box[2] // column_width)},{box[3] // CHANGE_REGION_BAND_PX}")
+    except Exception as e:
+        logger.debug(f"Could not compare screenshots {previous_screenshot} and {screenshot_path}: {e}")
+        return ''
+
+def notification_content_hash(ai_description, region_key=''):
+    return hashlib.sha1(f"{normalize_change_summary(ai_description)}|{region_key}".encode('utf-8')).hexdigest()
+
+def check_notification_suppression(website, ai_description, screenshot_path, previous_screenshot, now):
+    """Decide whether a change notification for a check should be sent. Call before the check is flushed.
+
+    Returns (content_hash, reason); reason is None to notify, 'duplicate' when a notification with the
+    same hash was created within NOTIFICATION_DEDUP_WINDOW_MINUTES, or 'flapping' when the site changed
+    FLAP_CHANGE_THRESHOLD times within FLAP_WINDOW_MINUTES and was notified within FLAP_NOTIFY_INTERVAL_MINUTES.
+    """
+    from app import db, CheckHistory, Notification
+    content_hash = notification_content_hash(ai_description, change_region_key(previous_screenshot, screenshot_path))
+    with db.session.no_autoflush:  # The pending check must not count itself
+        if NOTIFICATION_DEDUP_WINDOW_MINUTES > 0:
+            duplicate = db.session.query(Notification.id).filter(
+                Notification.website_id == website.id,
+                Notification.created_at >= now - timedelta(minutes=NOTIFICATION_DEDUP_WINDOW_MINUTES),
+                Notification.content_hash == content_hash
+            ).first()
+            if duplicate:
+                return content_hash, 'duplicate'
+        if FLAP_CHANGE_THRESHOLD > 0:
+            recent_changes = db.session.query(db.func.count(CheckHistory.id)).filter(
+                CheckHistory.website_id == website.id,
+                CheckHistory.change_detected == True,
+                CheckHistory.checked_at >= now - timedelta(minutes=FLAP_WINDOW_MINUTES)
+            ).scalar()
+            if recent_changes + 1 >= FLAP_CHANGE_THRESHOLD:
+                notified = db.session.query(Notification.id).filter(
+                    Notification.website_id == website.id,
+                    Notification.created_at >= now - timedelta(minutes=FLAP_NOTIFY_INTERVAL_MINUTES),
+                    Notification.content_hash.isnot(None)
+                ).first()
+                if notified:
+                    return content_hash, 'flapping'
+    return content_hash, None
+
+def stage_check_notifications(user, website, check, ai_description, body, screenshot_path, now, change_detected, content_hash=None):
+    """Add the check's Notification rows to the session without committing.
+
+    Immediate notifications go in as outbox rows (dispatch_pending=True) and are sent by
+    dispatch_notification() once the check's transaction has committed.
+    Returns (outbox_notifications, summary_items) for finish_check_notifications().
+    """
+    from app import db, Notification
+    outbox, summaries = [], []
+    pref = user.notification_preference
+    if pref in ['immediate', 'both']:
+        notification = Notification(
+            user_id=user.user_id,
+            website_id=website.id,
+            check_history=check,
+            notification_type='immediate',
+            content=body,
+            screenshot_path=screenshot_path,
+            sent=False,
+            dispatch_pending=True,  # Outbox: sent after commit
+            content_hash=content_hash
+        )
+        db.session.add(notification)
+        outbox.append(notification)
+    if pref in ['summary', 'both']:
+        notification = Notification(
+            user_id=user.user_id,
+            website_id=website.id,
+            check_history=check,
+            notification_type='immediate',  # It's still an immediate notification, just for summary use
+            content=ai_description,  # Store the original AI description for summary use
+            screenshot_path=screenshot_path,
+            sent=False,  # Not sent directly, will be included in summary
+            included_in_summary=False,  # Not yet included in any summary
+            content_hash=content_hash
+        )
+        db.session.add(notification)
+        payload = {
+            'website_url': website.url,
+            'website_id': website.id,
+            'user_id': user.user_id,
+            'ai_description': ai_description,
+            'screenshot_path': screenshot_path,  # Relative path
+            'timestamp': now.isoformat(),
+            'change_detected': change_detected
+        }
+        summaries.append((notification, payload))
+    return outbox, summaries
+
+def stage_alert_notification(user, website, alert_type, content, check=None):
+    """Add an outbox Notification for a check alert (see ALERT_NOTIFICATIONS) without committing.
+
+    Dispatched after commit like change notifications, but only on the alert's own channels.
+    """
+    from app import db, Notification
+    notification = Notification(
+        user_id=user.user_id,
+        website_id=website.id,
+        check_history=check,
+        notification_type=alert_type,
+        content=content,
+        sent=False,
+        dispatch_pending=True  # Outbox: sent after commit
+    )
+    db.session.add(notification)
+    return notification
+
+def commit_alert(user, website, alert_type, content):
+    """Commit the pending website status with an alert notification and queue its dispatch."""
+    from app import db
+    notification = stage_alert_notification(user, website, alert_type, content)
+    db.session.commit()
+    enqueue_notification_dispatch(notification.id)
+
+def finish_check_notifications(user_id, outbox_ids, summary_items, subject=None):
+    """After-commit side effects of a check: hand outbox notifications to the notification queue and queue summary items."""
+    for notification_id in outbox_ids:
+        enqueue_notification_dispatch(notification_id, subject)
+    for payload in summary_items:
+        add_to_summary_queue(user_id, payload)
+    publish_worker_connection_stats()
+
+def publish_worker_connection_stats():
+    """Publish this worker's outbound connection reuse stats for /api/http_stats."""
+    from app import outbound_connection_stats
+    job = get_current_job()
+    name = f"worker:{job.worker_name}" if job and getattr(job, 'worker_name', None) else None  # Stable across forked work horses
+    try:
+        publish_connection_stats(outbound_connection_stats(), get_redis(), name=name)
+    except Exception as e:
+        logger.debug(f"Could not publish connection stats: {e}")
+
+def enqueue_notification_dispatch(notification_id, subject=None, delay_seconds=0):
+    """Queue dispatch_notification on the notification queue. Returns the job, or None (the outbox sweep retries it)."""
+    from app import NOTIFICATION_CHANNEL_TIMEOUT
+    redis_conn = get_redis()
+    if not redis_conn:
+        logger.error(f"Cannot queue notification {notification_id}: Redis connection failed; left for the outbox sweep")
+        return None
+    q = Queue(NOTIFICATION_QUEUE, connection=redis_conn)
+    job_timeout = NOTIFICATION_CHANNEL_TIMEOUT * 3
+    try:
+        if delay_seconds:
+            return q.enqueue_in(timedelta(seconds=delay_seconds), dispatch_notification, notification_id, subject, job_timeout=job_timeout)
+        return q.enqueue(dispatch_notification, notification_id, subject, job_timeout=job_timeout)
+    except Exception as e:
+        logger.error(f"Failed to queue notification {notification_id}: {e}; left for the outbox sweep")
+        return None
+
+def _notification_channels(user):
+    """Channels configured for a user, in the order they are reported."""
+    channels = []
+    if user.email:
+        channels.append('email')
+    if (user.telegram_token or os.getenv('TELEGRAM_BOT_TOKEN')) and (user.telegram_chat_id or os.getenv('TELEGRAM_CHAT_ID')):
+        channels.append('telegram')
+    if user.teams_webhook:
+        channels.append('teams')
+    return channels
+
+def _send_on_channel(channel, user_id, subject, content, screenshot_path, deadline):
+    """Send one notification on one channel from a worker thread. Returns the sender's (ok, message).
+
+    Every socket call is bounded by `deadline`, so the thread ends with the channel timeout.
+    """
+    from app import User, send_email_notification, send_telegram_notification, send_teams_notification
+    with app.app_context():  # Each thread gets its own app context and DB session
+        if channel == 'email':
+            return send_email_notification(User.query.filter_by(user_id=user_id).first(), subject, content, screenshot_path, deadline)
+        if channel == 'telegram':
+            return send_telegram_notification(user_id, content, deadline)
+        return send_teams_notification(user_id, content, deadline)
+
+def _send_on_channels(channels, user_id, subject, content, screenshot_path, channel_content=None):
+    """Send on all channels concurrently. Returns {channel: (status, error)} with status 'sent', 'failed' or 'timeout'.
+
+    channel_content overrides the text for individual channels (e.g. a coalesced Telegram message).
+    """
+    from app import NOTIFICATION_CHANNEL_TIMEOUT
+    if not channels:
+        return {}
+    channel_content = channel_content or {}
+    deadline = time.monotonic() + NOTIFICATION_CHANNEL_TIMEOUT
+    pool = ThreadPoolExecutor(max_workers=len(channels))
+    futures = {pool.submit(_send_on_channel, channel, user_id, subject, channel_content.get(channel, content), screenshot_path, deadline): channel
+               for channel in channels}
+    done, _ = wait(futures, timeout=NOTIFICATION_CHANNEL_TIMEOUT)
+    pool.shutdown(wait=False)  # A slow channel must not hold up the others; its socket timeout ends it shortly
+    results = {}
+    for future, channel in futures.items():
+        if future not in done:
+            results[channel] = ('timeout', f"No response within {NOTIFICATION_CHANNEL_TIMEOUT}s")
+            continue
+        try:
+            ok, message = future.result()
+        except Exception as e:
+            ok, message = False, str(e)
+        results[channel] = ('sent', None) if ok else ('failed', str(message)[:512])
+    return results
+
+def _claim_telegram_batch(notification, lease_until, now):
+    """Claim the user's other pending notifications that still owe a Telegram message, oldest first,
+    so one message to the chat carries them all (Telegram allows about one message per second per chat).
+    """
+    from app import db, Notification
+    candidates = Notification.query.filter(
+        Notification.user_id == notification.user_id,
+        Notification.id != notification.id,
+        Notification.notification_type.notin_(ALERT_NOTIFICATIONS),  # Alerts are never sent to Telegram
+        Notification.dispatch_pending == True,
+        db.or_(Notification.next_attempt_at.is_(None), Notification.next_attempt_at <= now)
+    ).order_by(Notification.id).limit(TELEGRAM_COALESCE_MAX - 1).all()
+    claimed = []
+    for sibling in candidates:
+        if (sibling.delivery_channels or {}).get('telegram', {}).get('status') == 'sent':
+            continue
+        if Notification.query.filter(
+            Notification.id == sibling.id,
+            Notification.dispatch_pending == True,
+            db.or_(Notification.next_attempt_at.is_(None), Notification.next_attempt_at <= now)
+        ).update({Notification.next_attempt_at: lease_until}, synchronize_session=False):
+            claimed.append(sibling.id)
+    db.session.commit()
+    return [db.session.get(Notification, sibling_id) for sibling_id in claimed]
+
+def dispatch_notification(notification_id, subject=None):
+    """Deliver a pending outbox Notification on every configured channel in parallel.
+
+    The row is claimed with a short lease (next_attempt_at) so concurrent dispatchers don't double-send.
+    Channels that already succeeded are skipped on retries; failures are retried with exponential
+    backoff up to NOTIFICATION_MAX_ATTEMPTS. Per-channel results are kept in delivery_channels.
+    Returns True once the notification is delivered on all channels.
+    """
+    from app import db, Notification, User, Website, CheckHistory, NOTIFICATION_CHANNEL_TIMEOUT, notification_email_image
+    with app.app_context():
+        now = datetime.now()
+        lease_until = now + timedelta(seconds=NOTIFICATION_CHANNEL_TIMEOUT * 2)
+        claimed = Notification.query.filter(
+            Notification.id == notification_id,
+            Notification.dispatch_pending == True,
+            db.or_(Notification.next_attempt_at.is_(None), Notification.next_attempt_at <= now)
+        ).update({Notification.next_attempt_at: lease_until}, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return False  # Already sent, held by another dispatcher, or waiting out its retry backoff
+
+        notification = db.session.get(Notification, notification_id)
+        user = User.query.filter_by(user_id=notification.user_id).first()
+        website = db.session.get(Website, notification.website_id) if notification.website_id else None
+        channels = _notification_channels(user) if user else []
+        if notification.notification_type in ALERT_NOTIFICATIONS:
+            alert_channels, alert_subject = ALERT_NOTIFICATIONS[notification.notification_type]
+            channels = [channel for channel in channels if channel in alert_channels]
+        if not channels or (notification.notification_type != 'summary' and not website):
+            notification.dispatch_pending = False
+            notification.next_attempt_at = None
+            notification.delivery_status = 'skipped'
+            db.session.commit()
+            return False
+        if not subject:
+            if notification.notification_type == 'summary':
+                subject = "Website Change Summary"
+            elif notification.notification_type in ALERT_NOTIFICATIONS:
+                subject = alert_subject.format(url=website.url)
+            else:
+                check = db.session.get(CheckHistory, notification.check_history_id) if notification.check_history_id else None
+                subject = f"Change Detected: {website.url}" if check is None or check.change_detected else f"Website Check: {website.url}"
+
+        delivery = dict(notification.delivery_channels or {})  # New dict so the JSON column is flagged as changed
+        todo = [channel for channel in channels if delivery.get(channel, {}).get('status') != 'sent']
+        batch = _claim_telegram_batch(notification, lease_until, now) if 'telegram' in todo and TELEGRAM_COALESCE_MAX > 1 else []
+        channel_content = {}
+        if batch:
+            channel_content['telegram'] = TELEGRAM_COALESCE_SEPARATOR.join(
+                n.content or '' for n in sorted(batch + [notification], key=lambda n: n.id))
+        email_image = notification.screenshot_path
+        if 'email' in todo:
+            email_image = notification_email_image(notification) or email_image  # Small contact sheet instead of the full-page PNG
+        attempted_at = datetime.now().isoformat(timespec='seconds')
+        results = _send_on_channels(todo, user.user_id, subject, notification.content, email_image, channel_content)
+        for channel, (status, error) in results.items():
+            delivery[channel] = {'status': status, 'error': error, 'at': attempted_at}
+            if error:
+                logger.warning(f"Notification {notification_id} {channel} delivery {status}: {error}")
+
+        # Record the shared Telegram result on the coalesced notifications and release them to their own dispatch
+        for sibling in batch:
+            status, error = results['telegram']
+            sibling_delivery = dict(sibling.delivery_channels or {})
+            sibling_delivery['telegram'] = {'status': status, 'error': error, 'at': attempted_at, 'coalesced_into': notification_id}
+            sibling.delivery_channels = sibling_delivery
+            sibling.next_attempt_at = None
+
+        notification.delivery_channels = delivery
+        notification.delivery_attempts = (notification.delivery_attempts or 0) + 1
+        failed = [channel for channel in channels if delivery[channel]['status'] != 'sent']
+        retry_in = None
+        if not failed:
+            notification.delivery_status = 'sent'
+        elif notification.delivery_attempts >= NOTIFICATION_MAX_ATTEMPTS:
+            notification.delivery_status = 'failed' if len(failed) == len(channels) else 'partial'
+        else:
+            notification.delivery_status = 'retrying'
+            retry_in = NOTIFICATION_RETRY_BASE_SECONDS * 2 ** (notification.delivery_attempts - 1)
+        notification.sent = len(failed) < len(channels)
+        notification.dispatch_pending = retry_in is not None
+        notification.next_attempt_at = now + timedelta(seconds=retry_in) if retry_in else None
+        db.session.commit()
+
+        if retry_in:
+            enqueue_notification_dispatch(notification_id, subject, delay_seconds=retry_in)
+        for sibling in batch:
+            enqueue_notification_dispatch(sibling.id)  # Its own job may have run while we held it; extra jobs are no-ops
+        publish_worker_connection_stats()
+        if notification.notification_type == 'summary' and notification.sent:
+            _note_summary_delivered(notification_id)
+        logger.info(f"Dispatched notification {notification_id} for user {user.user_id}: {notification.delivery_status} "
+                    f"(attempt {notification.delivery_attempts}, failed: {', '.join(failed) or 'none'})")
+        return not failed
+
+def dispatch_pending_notifications(older_than_minutes=OUTBOX_RETRY_AFTER_MINUTES):
+    """Re-queue outbox notifications whose dispatch job was lost (crash, Redis outage, expired lease).
+
+    Sends inline when the notification queue is unavailable, at most OUTBOX_INLINE_SEND_LIMIT per run;
+    the rest wait for the next sweep.
+    """
+    from app import db, Notification
+    with app.app_context():
+        cutoff = datetime.now() - timedelta(minutes=older_than_minutes)
+        pending_ids = [row.id for row in db.session.query(Notification.id).filter(
+            Notification.dispatch_pending == True,
+            db.or_(
+                db.and_(Notification.next_attempt_at.is_(None), Notification.created_at < cutoff),
+                Notification.next_attempt_at < cutoff
+            )
+        ).order_by(Notification.id)]
+    requeued = inline = 0
+    for notification_id in pending_ids:
+        if enqueue_notification_dispatch(notification_id):
+            requeued += 1
+            continue
+        if inline >= OUTBOX_INLINE_SEND_LIMIT:
+            continue  # Left pending for the next sweep
+        inline += 1
+        try:
+            dispatch_notification(notification_id)
+        except Exception as e:
+            logger.error(f"Failed to dispatch pending notification {notification_id}: {e}", exc_info=True)
+    if pending_ids:
+        logger.info(f"Outbox sweep: {requeued}/{len(pending_ids)} pending notifications re-queued, {inline} sent inline.")
+    return len(pending_ids)
+
 # --- Background Job: Check Website ---
 def check_website(website_id, retry_count=0, max_retries=3):
     logger.debug(f"Starting RQ job check_website for website ID: {website_id}") # Added logging
-    from app import db, User, Website, CheckHistory, safe_filename
-    from app import compare_html, fetch_website_content, gemini_vision_api_compare, detect_anomaly, send_email_notification, send_telegram_notification, send_teams_notification
+    from app import db, User, Website, CheckHistory, CheckRollup, safe_filename
+    from app import compare_html, fetch_website_content, gemini_vision_api_compare, detect_anomaly
     website = db.session.get(Website, website_id)
     if not website:
         logger.error(f"Website with ID {website_id} not found in check_website.") # Added logging
@@ -75,8 +545,7 @@ def check_website(website_id, retry_count=0, max_retries=3):
         if html and ('captcha' in html.lower() or 'recaptcha' in html.lower() or 'i am not a robot' in html.lower()):
             website.status = 'captcha'
             website.error_message = 'CAPTCHA detected on the website. Manual intervention required.'
-            db.session.commit()
-            send_email_notification(user, f'Website Monitor CAPTCHA: {website.url}', 'CAPTCHA detected. Please solve it manually.')
+            commit_alert(user, website, 'captcha', 'CAPTCHA detected. Please solve it manually.')
             return
         # Retry logic
         if retry_count < max_retries:
@@ -85,9 +554,8 @@ def check_website(website_id, retry_count=0, max_retries=3):
             time.sleep(2 ** retry_count)
             return check_website(website_id, retry_count + 1, max_retries)
         website.status = 'error'
-        website.error_message = error
-        db.session.commit()
-        send_email_notification(user, f'Website Monitor Error: {website.url}', error)
+        website.error_message = error[:512] if error else error  # Column is VARCHAR(512); Postgres rejects longer values
+        commit_alert(user, website, 'error', error)
         return
     # If ai_section is set, extract only that part from html for AI diff
     ai_section = website.ai_section
@@ -115,8 +583,7 @@ def check_website(website_id, retry_count=0, max_retries=3):
         if "CAPTCHA detected" in error_msg:
             website.status = 'captcha'
             website.error_message = 'CAPTCHA detected during screenshot capture. Manual intervention required.'
-            db.session.commit()
-            send_email_notification(user, f'Website Monitor CAPTCHA: {website.url}', 'CAPTCHA detected during screenshot capture. Please solve it manually.')
+            commit_alert(user, website, 'captcha', 'CAPTCHA detected during screenshot capture. Please solve it manually.')
             return # Stop processing if CAPTCHA is detected during screenshot
 
     # --- AI Comparison: Always provide both previous and current screenshots if available ---
@@ -177,13 +644,12 @@ def check_website(website_id, retry_count=0, max_retries=3):
         )
     # Store parsed fields for frontend/API
     ai_description = ai_data.get("summary_of_changes", "No significant change.")
-    ai_significance = ai_data.get("significance_level", "none")
+    ai_significance = str(ai_data.get("significance_level", "none"))[:256]
     ai_detailed = ai_data.get("detailed_changes", [])
     ai_focus = ai_data.get("focus_area_assessment", "")
     ai_change = ai_data.get("change_detected", False)
     ai_error = ai_data.get("error_message", None)
-    # Example: Save these fields in CheckHistory or API response for frontend
-    # (Frontend should use these fields, not the raw JSON)
+    # Persisted on CheckHistory below so pages never re-parse the AI output
     
     # Determine if changes were detected based on AI description
     change_indicators = ["website changed", "change detected", "difference found", "new content"]
@@ -218,161 +684,62 @@ def check_website(website_id, retry_count=0, max_retries=3):
         html_path=html_path,
         diff_path=diff_path,
         ai_description=ai_description,
+        ai_significance=ai_significance,
+        ai_detailed=ai_detailed,
+        ai_focus=ai_focus or None,
+        ai_error=ai_error,
         change_detected=change_detected,
         response_time=response_time,
-        error=error
+        error=error[:512] if error else error
     )
-    db.session.add(check)
     if anomalies:
         website.status = 'anomaly'
-        website.error_message = '; '.join(anomalies)
+        website.error_message = '; '.join(anomalies)[:512]
         logger.warning(f"Anomalies detected for website ID {website_id}: {website.error_message}") # Added logging
-        # Teams notification
-        if user.teams_webhook:
-            send_teams_notification(user.teams_webhook, f"Anomaly detected for {website.url}: {'; '.join(anomalies)}")
-        # Telegram/email notification logic can also be triggered here
     else:
         website.status = 'change' if change_detected else 'no-change'
         website.error_message = None
         logger.debug(f"Status set to '{website.status}' for website {website_id}.")
     website.last_checked = now
-    db.session.commit()
-    logger.debug(f"Check history saved and website status updated for website ID {website_id}.") # Added logging
 
-    if change_detected:
-        notify_msg = f'Change detected on {website.url}:\n{ai_description}'
-        logger.info(f"Change detected for website ID {website_id}. Sending notifications.") # Added logging
-        
-        # Send email notification
-        email_success, email_message = send_email_notification(user, f'Change Detected: {website.url}', notify_msg, screenshot_path)
-        if not email_success:
-            logger.error(f"Email notification failed for website ID {website_id}: {email_message}")
-
-        # Send Telegram notification
-        telegram_success, telegram_message = send_telegram_notification(user.user_id, notify_msg)
-        if not telegram_success:
-            logger.error(f"Telegram notification failed for website ID {website_id}: {telegram_message}")
-
-    # --- Handle Notifications/Summaries --- #
     # Check if we should send notifications based on user preferences and change detection
-    should_notify = change_detected or not getattr(user, 'notify_only_changes', True)
-    
-    if should_notify and user: # Only notify/summarize if appropriate and user exists
-        notification_payload = {
-            'website_url': website.url,
-            'website_id': website.id,
-            'user_id': user.user_id, # Store user_id
-            'ai_description': ai_description,
-            'screenshot_path': screenshot_path, # Relative path
-            'timestamp': now.isoformat(), # Use ISO format for timestamp
-            'change_detected': change_detected # Add change status to payload
-        }
-        pref = user.notification_preference
+    should_notify = bool(user) and (change_detected or not getattr(user, 'notify_only_changes', True))
+    content_hash = None
+    if should_notify and change_detected:
+        content_hash, suppressed = check_notification_suppression(
+            website, ai_description, screenshot_path, prev_check.screenshot_path if prev_check else None, now)
+        if suppressed:
+            logger.info(f"Notification for website ID {website_id} suppressed ({suppressed})")
+            should_notify = False
+    body = None
+    if should_notify and user.notification_preference in ['immediate', 'both']:
+        body = build_notification_body(website, ai_description, change_detected, now)  # Before any write: may call Gemini
 
-        if pref in ['immediate', 'both']:
-            # Set subject based on whether a change was detected
-            subject = f"Change Detected: {website.url}" if change_detected else f"Website Check: {website.url}"
-            logger.info(f"Sending immediate {'change' if change_detected else 'status'} notification for {website.url} to user {user.user_id}")
-            
-            # Check if the AI description appears to be an error message
-            is_error_desc = "error" in ai_description.lower() or "failed" in ai_description.lower() or "exception" in ai_description.lower()
-            
-            # Try to generate a better notification message using AI if available
-            default_notification_prompt = "You are an AI that summarizes the differences between two website screenshots/html based on user-specified criteria, your purpose is to send notification on the summary of what different. Write me output format to include bullet points with explanation. Summary what user want to compare. Skip what have been cover in the lastest notification, which include in the page. Be analytical and comprehensive."
-            notification_prompt = os.getenv('AI_NOTIFICATION_SYSTEM_PROMPT', default_notification_prompt)
-            
-            try:
-                # Check if we have a Gemini API key for AI notification enhancement
-                gemini_api_key = os.getenv('GEMINI_API_KEY')
-                if gemini_api_key and ai_description and not is_error_desc:
-                    # Import here to avoid circular imports
-                    import google.generativeai as genai
-                    
-                    genai.configure(api_key=gemini_api_key)
-                    
-                    # Prepare the prompt for the AI
-                    ai_prompt = f"{notification_prompt}\n\nWebsite: {website.url}\nTime: {now.strftime('%Y-%m-%d %H:%M:%S')}\nChange description: {ai_description}"
-                    
-                    # Generate the notification
-                    model = genai.GenerativeModel('gemini-1.5-flash-latest')
-                    response = model.generate_content(ai_prompt)
-                    
-                    if response and response.text:
-                        # Use the AI-generated notification
-                        if change_detected:
-                            body = f"Change detected on {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\n{response.text}"
-                        else:
-                            body = f"Website check completed for {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\nNo changes detected. {response.text}"
-                        app.logger.info("Generated enhanced AI notification message")
-                    else:
-                        # Fallback to basic notification
-                        if change_detected:
-                            body = f"Change detected on {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\n{ai_description}"
-                        else:
-                            body = f"Website check completed for {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\nNo changes detected. Status: {website.status}"
-                        app.logger.warning("AI notification generation returned empty result, using basic message")
-                else:
-                    # Use the basic notification if no API key or error in AI description
-                    if change_detected:
-                        body = f"Change detected on {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\n{ai_description}"
-                    else:
-                        body = f"Website check completed for {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\nNo changes detected. Status: {website.status}"
-            except Exception as e:
-                # Fallback to basic notification on any error
-                if change_detected:
-                    body = f"Change detected on {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\n{ai_description}"
-                else:
-                    body = f"Website check completed for {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\nNo changes detected. Status: {website.status}"
-                app.logger.error(f"Error generating AI notification: {e}, using basic message")
-            
-            # Store notification in database
-            try:
-                from app import Notification
-                notification = Notification(
-                    user_id=user.user_id,
-                    website_id=website.id,
-                    check_history_id=check.id,
-                    notification_type='immediate',
-                    content=body,
-                    screenshot_path=screenshot_path,
-                    sent=True  # Mark as sent since we're sending it immediately
-                )
-                db.session.add(notification)
-                db.session.commit()
-                logger.info(f"Stored immediate notification in database for user {user.user_id}, website {website.id}")
-            except Exception as e:
-                logger.error(f"Failed to store notification in database: {e}")
-                # Continue with sending even if storage fails
-            
-            # Trigger immediate notifications
-            send_email_notification(user, subject, body, screenshot_path)
-            send_telegram_notification(user.user_id, body)
-            send_teams_notification(user.user_id, body)
+    # --- Save the check, its notifications and the website status in one transaction --- #
+    db.session.add(check)
+    CheckRollup.record(check)
+    outbox, summaries = [], []
+    if should_notify:
+        outbox, summaries = stage_check_notifications(user, website, check, ai_description, body, screenshot_path, now, change_detected,
+                                                      content_hash=content_hash)
+    anomaly_alert = None
+    if anomalies and user.teams_webhook:
+        anomaly_alert = stage_alert_notification(user, website, 'anomaly', f"Anomaly detected for {website.url}: {'; '.join(anomalies)}", check)
+    db.session.flush()  # Assign IDs for the after-commit work
+    outbox_ids = [n.id for n in outbox]
+    anomaly_alert_id = anomaly_alert.id if anomaly_alert else None
+    summary_items = [dict(payload, notification_id=n.id) for n, payload in summaries]
+    db.session.commit()
+    logger.debug(f"Check history saved and website status updated for website ID {website_id}.") # Added logging
 
-        if pref in ['summary', 'both']:
-            try:
-                # Store the notification in the database for summary purposes
-                from app import Notification
-                notification = Notification(
-                    user_id=user.user_id,
-                    website_id=website.id,
-                    check_history_id=check.id,
-                    notification_type='immediate',  # It's still an immediate notification, just for summary use
-                    content=ai_description,  # Store the original AI description for summary use
-                    screenshot_path=screenshot_path,
-                    sent=False,  # Not sent directly, will be included in summary
-                    included_in_summary=False  # Not yet included in any summary
-                )
-                db.session.add(notification)
-                db.session.commit()
-                
-                # Add notification ID to the payload
-                notification_payload['notification_id'] = notification.id
-                
-                # Use the helper function to add to the queue
-                add_to_summary_queue(user.user_id, notification_payload)
-            except Exception as e:
-                logger.error(f"Failed to queue change summary for user {user.user_id}: {e}")
+    # --- After-commit side effects --- #
+    if anomaly_alert_id:
+        enqueue_notification_dispatch(anomaly_alert_id)
+
+    if should_notify:
+        logger.info(f"Dispatching {'change' if change_detected else 'status'} notifications for {website.url} to user {user.user_id}")
+        finish_check_notifications(user.user_id, outbox_ids, summary_items,
+                                   subject=f"Change Detected: {website.url}" if change_detected else f"Website Check: {website.url}")
 
     logger.debug(f"Finished RQ job check_website for website ID: {website_id}") # Added logging
 
@@ -382,11 +749,10 @@ def check_website_direct(website_id):
     """Direct execution version of check_website.\nTakes screenshot, gets HTML, calls AI for description, saves history.\nReturns tuple: (success_boolean, message_string, screenshot_path, ai_description)\n"""
     logger.info(f"[ManualCheck] Starting direct website check for ID: {website_id} at {datetime.now().isoformat()}")
     # Import necessary components locally
-    from app import db, Website, CheckHistory, User, safe_filename, gemini_vision_api_compare, send_email_notification, send_telegram_notification, send_teams_notification # Import needed functions locally
+    from app import db, Website, CheckHistory, CheckRollup, User, safe_filename, gemini_vision_api_compare # Import needed functions locally
     from browser_agent.screenshot import get_screenshot_playwright
     import os
     import difflib # Keep difflib for potential future use or logging
-    import requests
 
     screenshot_path = None
     ai_description = "AI analysis pending."
@@ -439,7 +805,7 @@ def check_website_direct(website_id):
                 
             try:
                 # Try to get a list of free proxies as last resort
-                response = requests.get('https://raw.githubusercontent.com/TheSpeedX/PROXY-List/master/http.txt', timeout=5)
+                response = http_get('https://raw.githubusercontent.com/TheSpeedX/PROXY-List/master/http.txt', timeout=5)
                 if response.status_code == 200:
                     proxy_list = response.text.strip().split('\n')
                     if proxy_list:
@@ -450,6 +816,7 @@ def check_website_direct(website_id):
             except Exception as e:
                 logger.warning(f"Failed to fetch alternative proxies: {e}")
             
+            capture_started = datetime.now()
             while screenshot_attempt <= max_screenshot_attempts and not success:
                 try:
                     # Use the website's proxy for the first attempt
@@ -481,15 +848,18 @@ def check_website_direct(website_id):
                     logger.error(error_message)
                     screenshot_attempt += 1
             
+            response_time = (datetime.now() - capture_started).total_seconds()  # Page load + capture, including retries
+
             # If all screenshot attempts failed
             if not success:
                 # Record an error in the database
                 check_history_entry = CheckHistory(
                     website_id=website.id,
-                    error=error_message,
+                    error=error_message[:512],
                     checked_at=now
                 )
                 db.session.add(check_history_entry)
+                CheckRollup.record(check_history_entry)
                 
                 # Update website status
                 website.status = 'error'
@@ -559,13 +929,12 @@ def check_website_direct(website_id):
                 )
             # Store parsed fields for frontend/API
             ai_description = ai_data.get("summary_of_changes", "No significant change.")
-            ai_significance = ai_data.get("significance_level", "none")
+            ai_significance = str(ai_data.get("significance_level", "none"))[:256]
             ai_detailed = ai_data.get("detailed_changes", [])
             ai_focus = ai_data.get("focus_area_assessment", "")
             ai_change = ai_data.get("change_detected", False)
             ai_error = ai_data.get("error_message", None)
-            # Example: Save these fields in CheckHistory or API response for frontend
-            # (Frontend should use these fields, not the raw JSON)
+            # Persisted on CheckHistory below so pages never re-parse the AI output
             
             # Step 3: Determine if there's a change based on AI description
             change_detected = False
@@ -586,7 +955,7 @@ def check_website_direct(website_id):
             html_path = f"data/html_{safe_filename(website.url)}_{now.strftime('%Y%m%d_%H%M%S')}.html"
             html = ""
             try:
-                response = requests.get(website.url, timeout=30)
+                response = http_get(website.url, timeout=30)
                 html = response.text
                 with open(html_path, 'w', encoding='utf-8') as f:
                     f.write(html)
@@ -594,153 +963,62 @@ def check_website_direct(website_id):
                 html_path = None
                 logger.warning(f"Failed to get HTML for website {website_id}: {e}")
             
-            # --- Save Check History --- #
+            # --- Save the check, its notifications and the website status in one transaction --- #
+            # Everything slow (AI notification text) happens before the first write, so the
+            # database write lock is held only for the final flush + commit.
+            notify = change_detected and user  # Only notify/summarize if change detected and user exists
+            content_hash = None
+            if notify:
+                content_hash, suppressed = check_notification_suppression(
+                    website, ai_description, screenshot_path_rel, prev_check.screenshot_path if prev_check else None, now)
+                if suppressed:
+                    logger.info(f"Notification for website ID {website_id} suppressed ({suppressed})")
+                    notify = False
+            if error_message:
+                if "CAPTCHA detected" in error_message:
+                    website.status = 'captcha'
+                else:
+                    website.status = 'error'
+                website.error_message = error_message[:512] # Truncate if needed
+            else:
+                website.status = 'change' if change_detected else 'no-change'
+                website.error_message = None
+            website.last_checked = now
+            body = None
+            if notify and user.notification_preference in ['immediate', 'both']:
+                body = build_notification_body(website, ai_description, change_detected, now)
+
             check_history_entry = CheckHistory(
                 website_id=website_id,
                 checked_at=now,
                 screenshot_path=screenshot_path_rel, # Relative path
                 html_path=html_path, # Currently None
                 ai_description=ai_description,
+                ai_significance=ai_significance,
+                ai_detailed=ai_detailed,
+                ai_focus=ai_focus or None,
+                ai_error=ai_error,
                 change_detected=change_detected,
-                error=error_message,
-                response_time=None # Add if needed
+                error=error_message[:512] if error_message else None,
+                response_time=response_time
             )
             db.session.add(check_history_entry)
-            db.session.commit()  # Commit to get the ID
+            CheckRollup.record(check_history_entry)
+            outbox, summaries = [], []
+            if notify:
+                outbox, summaries = stage_check_notifications(user, website, check_history_entry, ai_description, body,
+                                                              screenshot_path_rel, now, change_detected, content_hash=content_hash)
+            db.session.flush()  # Assign IDs for the after-commit work
+            outbox_ids = [n.id for n in outbox]
+            summary_items = [dict(payload, notification_id=n.id) for n, payload in summaries]
+            db.session.commit()
             logger.info(f"Check history saved for website {website_id}")
 
-            # --- Handle Notifications/Summaries --- #
-            if change_detected and user: # Only notify/summarize if change detected and user exists
-                notification_payload = {
-                    'website_url': website.url,
-                    'website_id': website.id,
-                    'user_id': user.user_id, # Store user_id
-                    'ai_description': ai_description,
-                    'screenshot_path': screenshot_path_rel, # Relative path
-                    'timestamp': now.isoformat() # Use ISO format for timestamp
-                }
-                pref = user.notification_preference
-
-                if pref in ['immediate', 'both']:
-                    logger.info(f"Sending immediate notification for direct check of {website.url} for user {user.user_id}")
-                    
-                    # Basic notification content
-                    subject = f"Change Detected (Manual Check): {website.url}"
-                    
-                    # Try to generate a better notification message using AI if available
-                    default_notification_prompt = "You are an AI that summarizes the differences between two website screenshots/html based on user-specified criteria, your purpose is to send notification on the summary of what different. Write me output format to include bullet points with explanation. Summary what user want to compare. Skip what have been cover in the lastest notification, which include in the page. Be analytical and comprehensive."
-                    notification_prompt = os.getenv('AI_NOTIFICATION_SYSTEM_PROMPT', default_notification_prompt)
-                    
-                    try:
-                        # Check if we have a Gemini API key for AI notification enhancement
-                        gemini_api_key = os.getenv('GEMINI_API_KEY')
-                        
-                        # Check if the AI description appears to be an error message
-                        is_error_desc = "error" in ai_description.lower() or "failed" in ai_description.lower() or "exception" in ai_description.lower()
-                        
-                        if gemini_api_key and ai_description and not is_error_desc:
-                            # Use Gemini API to generate notification
-                            import google.generativeai as genai
-                            
-                            genai.configure(api_key=gemini_api_key)
-                            
-                            # Prepare the prompt for the AI
-                            ai_prompt = f"{notification_prompt}\n\nWebsite: {website.url}\nTime: {now.strftime('%Y-%m-%d %H:%M:%S')}\nChange description: {ai_description}"
-                            
-                            # Generate the notification
-                            model = genai.GenerativeModel('gemini-1.5-flash-latest')
-                            response = model.generate_content(ai_prompt)
-                            
-                            if response and response.text:
-                                # Use the AI-generated notification
-                                if change_detected:
-                                    body = f"Change detected on {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\n{response.text}"
-                                else:
-                                    body = f"Website check completed for {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\nNo changes detected. {response.text}"
-                                app.logger.info("Generated enhanced AI notification message")
-                            else:
-                                # Fallback to basic notification
-                                if change_detected:
-                                    body = f"Change detected on {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\n{ai_description}"
-                                else:
-                                    body = f"Website check completed for {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\nNo changes detected. Status: {website.status}"
-                                app.logger.warning("AI notification generation returned empty result, using basic message")
-                        else:
-                            # Use the basic notification if no API key or error in AI description
-                            if change_detected:
-                                body = f"Change detected on {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\n{ai_description}"
-                            else:
-                                body = f"Website check completed for {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\nNo changes detected. Status: {website.status}"
-                    except Exception as e:
-                        # Fallback to basic notification on any error
-                        if change_detected:
-                            body = f"Change detected on {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\n{ai_description}"
-                        else:
-                            body = f"Website check completed for {website.url} at {now.strftime('%Y-%m-%d %H:%M:%S')}:\n\nNo changes detected. Status: {website.status}"
-                        app.logger.error(f"Error generating AI notification: {e}, using basic message")
-                    
-                    # Store notification in database
-                    try:
-                        from app import Notification
-                        notification = Notification(
-                            user_id=user.user_id,
-                            website_id=website.id,
-                            check_history_id=check_history_entry.id,
-                            notification_type='immediate',
-                            content=body,
-                            screenshot_path=screenshot_path_rel,
-                            sent=True  # Mark as sent since we're sending it immediately
-                        )
-                        db.session.add(notification)
-                        db.session.commit()
-                        logger.info(f"Stored immediate notification in database for user {user.user_id}, website {website.id}")
-                    except Exception as e:
-                        logger.error(f"Failed to store notification in database: {e}")
-                        # Continue with sending even if storage fails
-                    
-                    # Trigger immediate notifications
-                    send_email_notification(user, subject, body, screenshot_path_rel)
-                    send_telegram_notification(user.user_id, body)
-                    send_teams_notification(user.user_id, body)
-
-                if pref in ['summary', 'both']:
-                    try:
-                        # Store the notification in the database for summary purposes
-                        from app import Notification
-                        notification = Notification(
-                            user_id=user.user_id,
-                            website_id=website.id,
-                            check_history_id=check_history_entry.id,
-                            notification_type='immediate',  # It's still an immediate notification, just for summary use
-                            content=ai_description,  # Store the original AI description for summary use
-                            screenshot_path=screenshot_path_rel,
-                            sent=False,  # Not sent directly, will be included in summary
-                            included_in_summary=False  # Not yet included in any summary
-                        )
-                        db.session.add(notification)
-                        db.session.commit()
-                        
-                        # Add notification ID to the payload
-                        notification_payload['notification_id'] = notification.id
-                        
-                        # Use the helper function to add to the queue
-                        add_to_summary_queue(user.user_id, notification_payload)
-                    except Exception as e:
-                        logger.error(f"Failed to queue change summary for user {user.user_id}: {e}")
+            # --- Dispatch notifications / queue summaries (after commit) --- #
+            if notify:
+                logger.info(f"Sending notifications for direct check of {website.url} for user {user.user_id}")
+                finish_check_notifications(user.user_id, outbox_ids, summary_items, subject=f"Change Detected (Manual Check): {website.url}")
 
-            # --- Update Website Status --- #
-            if error_message:
-                if "CAPTCHA detected" in error_message:
-                    website.status = 'captcha'
-                else:
-                    website.status = 'error'
-                website.error_message = error_message[:512] # Truncate if needed
-            else:
-                website.status = 'change' if change_detected else 'no-change'
-                website.error_message = None
-            website.last_checked = now
-            db.session.commit()
-            
             # Always assume success if we get here
             success = True
             logger.info(f"[ManualCheck] Finished direct website check for ID: {website_id} at {datetime.now().isoformat()}")
@@ -753,6 +1031,597 @@ def check_website_direct(website_id):
         return False, error_message, screenshot_path, ai_description
 
 
+# --- Background Job: Data Retention ---
+RETENTION_BATCH_SIZE = 500  # CheckHistory rows deleted per transaction
+RETENTION_FILE_WORKERS = 8  # Threads used to unlink screenshot/html/diff files
+RETENTION_IN_CHUNK = 500  # Max website IDs per IN (...) clause (SQLite variable limit)
+
+def _remove_file(path):
+    """Remove a single data file. Returns (path, removed, error)."""
+    try:
+        os.remove(path)
+        return path, True, None
+    except FileNotFoundError:
+        return path, False, None
+    except OSError as e:
+        return path, False, str(e)
+
+def remove_data_files(paths):
+    """Remove files concurrently. Returns (removed_count, failed_paths)."""
+    removed = 0
+    failed = []
+    if not paths:
+        return removed, failed
+    with ThreadPoolExecutor(max_workers=RETENTION_FILE_WORKERS) as pool:
+        for path, ok, error in pool.map(_remove_file, paths):
+            if ok:
+                removed += 1
+            elif error:
+                logger.error(f"Error deleting file {path}: {error}")
+                failed.append(path)
+    return removed, failed
+
+def _publish_progress(job, report):
+    """Store a progress snapshot on the current RQ job (lists are reported as counts)."""
+    if job:
+        job.meta['progress'] = {k: (len(v) if isinstance(v, list) else v) for k, v in report.items()}
+        job.save_meta()
+
+def _retention_policy_groups(user_id=None, website_id=None, max_age_days=None):
+    """Group websites by effective retention days.
+
+    Precedence: explicit max_age_days > Website.retention_days > User.retention_days > DATA_RETENTION_DAYS.
+    Returns a list of (days, website_ids) where website_ids is None for "rows not owned by any website".
+    """
+    from app import db, User, Website, DATA_RETENTION_DAYS
+    query = db.session.query(Website.id, Website.retention_days, User.retention_days).outerjoin(User, User.user_id == Website.user_id)
+    if user_id:
+        query = query.filter(Website.user_id == user_id)
+    if website_id:
+        query = query.filter(Website.id == website_id)
+
+    groups = {}
+    for site_id, site_days, user_days in query:
+        days = max_age_days or site_days or user_days or DATA_RETENTION_DAYS
+        groups.setdefault(days, []).append(site_id)
+
+    policy_groups = []
+    for days, site_ids in sorted(groups.items()):
+        for i in range(0, len(site_ids), RETENTION_IN_CHUNK):
+            policy_groups.append((days, site_ids[i:i + RETENTION_IN_CHUNK]))
+    # A global run also sweeps history left behind by deleted websites
+    if not user_id and not website_id:
+        policy_groups.append((max_age_days or DATA_RETENTION_DAYS, None))
+    return policy_groups
+
+def apply_retention(user_id=None, website_id=None, max_age_days=None, batch_size=RETENTION_BATCH_SIZE):
+    """Delete CheckHistory rows and their files that are older than the applicable retention policy.
+
+    Rows are walked in keyset-paginated batches by id and removed with bulk DELETEs, one
+    transaction per batch. Files are unlinked in a thread pool after each batch commits.
+    Progress is published in job.meta['progress'] when running under RQ.
+    """
+    from app import db, Website, CheckHistory, Notification
+    job = get_current_job()
+    report = {
+        'deleted_records': 0,
+        'deleted_files': 0,
+        'failed_files': [],
+        'policies_done': 0,
+        'policies_total': 0
+    }
+
+    with app.app_context():
+        policy_groups = _retention_policy_groups(user_id, website_id, max_age_days)
+        report['policies_total'] = len(policy_groups)
+        logger.info(f"Starting data retention (user={user_id}, website={website_id}, max_age_days={max_age_days}) over {len(policy_groups)} policy group(s)")
+        _publish_progress(job, report)
+
+        for days, site_ids in policy_groups:
+            cutoff_date = datetime.now() - timedelta(days=days)
+            if site_ids is None:
+                scope = db.or_(CheckHistory.website_id.is_(None), CheckHistory.website_id.notin_(db.session.query(Website.id)))
+            else:
+                scope = CheckHistory.website_id.in_(site_ids)
+
+            last_id = 0
+            while True:
+                rows = db.session.query(
+                    CheckHistory.id, CheckHistory.screenshot_path, CheckHistory.html_path, CheckHistory.diff_path
+                ).filter(
+                    scope,
+                    CheckHistory.checked_at < cutoff_date,
+                    CheckHistory.id > last_id
+                ).order_by(CheckHistory.id).limit(batch_size).all()
+                if not rows:
+                    break
+
+                ids = [row.id for row in rows]
+                last_id = ids[-1]
+                try:
+                    # Detach notifications first so the FK stays valid on backends that enforce it
+                    Notification.query.filter(Notification.check_history_id.in_(ids)).update(
+                        {Notification.check_history_id: None}, synchronize_session=False)
+                    CheckHistory.query.filter(CheckHistory.id.in_(ids)).delete(synchronize_session=False)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Error deleting retention batch ending at CheckHistory ID {last_id}: {e}")
+                    continue
+
+                paths = [path for row in rows for path in (row.screenshot_path, row.html_path, row.diff_path) if path]
+                removed, failed = remove_data_files(paths)
+                report['deleted_records'] += len(ids)
+                report['deleted_files'] += removed
+                report['failed_files'].extend(failed)
+                _publish_progress(job, report)
+
+            report['policies_done'] += 1
+            _publish_progress(job, report)
+
+    logger.info(f"Data retention complete. Deleted {report['deleted_records']} history records and {report['deleted_files']} files ({len(report['failed_files'])} failed).")
+    return report
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def _downsample_screenshot(row_id, screenshot_path, tier):
+    """Re-encode a screenshot as WebP for the given tier. The original is left in place; the caller
+    removes it once the new path is committed.
+
+    Returns (row_id, new_path, bytes_before, bytes_after, error).
+    """
+    from PIL import Image
+    from app import RETENTION_REDUCED_SCALE, RETENTION_THUMBNAIL_WIDTH, IMAGE_QUALITY
+    if not screenshot_path or not os.path.exists(screenshot_path):
+        return row_id, screenshot_path, 0, 0, None
+    bytes_before = _file_size(screenshot_path)
+    new_path = os.path.splitext(screenshot_path)[0] + '.webp'
+    try:
+        with Image.open(screenshot_path) as img:
+            width, height = img.size
+            if tier == 'thumbnail':
+                scale = min(1.0, RETENTION_THUMBNAIL_WIDTH / width)
+            else:
+                scale = RETENTION_REDUCED_SCALE
+            if scale < 1.0:
+                img = img.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+            if img.mode not in ('RGB', 'RGBA'):
+                img = img.convert('RGB')
+            tmp_path = f"{new_path}.{os.getpid()}.tmp"
+            img.save(tmp_path, format='WEBP', quality=IMAGE_QUALITY)
+        os.replace(tmp_path, new_path)
+        return row_id, new_path, bytes_before, _file_size(new_path), None
+    except Exception as e:
+        return row_id, screenshot_path, bytes_before, bytes_before, str(e)
+
+def apply_retention_tiers(user_id=None, website_id=None, batch_size=RETENTION_BATCH_SIZE):
+    """Downsample old screenshots instead of deleting them, and optionally drop unchanged checks.
+
+    Tiers by check age: full PNG, then a half-size WebP ('reduced') after RETENTION_REDUCED_AFTER_DAYS,
+    then a thumbnail with the HTML snapshot removed ('thumbnail') after RETENTION_THUMBNAIL_AFTER_DAYS.
+    If RETENTION_KEEP_CHANGED_AFTER_DAYS is set, checks older than that with no change and no error
+    are deleted. The latest check of each website is never touched, since it is the baseline for
+    the next comparison. Returns a report including bytes_reclaimed.
+    """
+    from app import (db, Website, CheckHistory, Notification, RETENTION_REDUCED_AFTER_DAYS,
+                     RETENTION_THUMBNAIL_AFTER_DAYS, RETENTION_KEEP_CHANGED_AFTER_DAYS)
+    job = get_current_job()
+    report = {
+        'downsampled': 0,
+        'thumbnailed': 0,
+        'deleted_unchanged': 0,
+        'bytes_reclaimed': 0,
+        'failed_files': []
+    }
+
+    with app.app_context():
+        now = datetime.now()
+        reduced_cutoff = now - timedelta(days=RETENTION_REDUCED_AFTER_DAYS)
+        thumbnail_cutoff = now - timedelta(days=RETENTION_THUMBNAIL_AFTER_DAYS)
+        latest_ids = db.session.query(db.func.max(CheckHistory.id)).group_by(CheckHistory.website_id)
+        scope = [CheckHistory.id.notin_(latest_ids)]
+        if user_id:
+            scope.append(CheckHistory.website_id.in_(db.session.query(Website.id).filter(Website.user_id == user_id)))
+        if website_id:
+            scope.append(CheckHistory.website_id == website_id)
+        tier = db.func.coalesce(CheckHistory.storage_tier, 'full')
+        notification_paths = Notification.__table__.update().where(
+            Notification.__table__.c.screenshot_path == db.bindparam('old_path')
+        ).values(screenshot_path=db.bindparam('new_path'))
+
+        # 1. Drop unchanged checks past the keep-only-changed horizon
+        if RETENTION_KEEP_CHANGED_AFTER_DAYS > 0:
+            keep_changed_cutoff = now - timedelta(days=RETENTION_KEEP_CHANGED_AFTER_DAYS)
+            last_id = 0
+            while True:
+                rows = db.session.query(
+                    CheckHistory.id, CheckHistory.screenshot_path, CheckHistory.html_path, CheckHistory.diff_path
+                ).filter(
+                    *scope,
+                    CheckHistory.checked_at < keep_changed_cutoff,
+                    db.or_(CheckHistory.change_detected.is_(False), CheckHistory.change_detected.is_(None)),
+                    CheckHistory.error.is_(None),
+                    CheckHistory.id > last_id
+                ).order_by(CheckHistory.id).limit(batch_size).all()
+                if not rows:
+                    break
+                ids = [row.id for row in rows]
+                last_id = ids[-1]
+                try:
+                    Notification.query.filter(Notification.check_history_id.in_(ids)).update(
+                        {Notification.check_history_id: None}, synchronize_session=False)
+                    CheckHistory.query.filter(CheckHistory.id.in_(ids)).delete(synchronize_session=False)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Error deleting unchanged checks ending at CheckHistory ID {last_id}: {e}")
+                    continue
+                paths = [path for row in rows for path in (row.screenshot_path, row.html_path, row.diff_path) if path]
+                report['bytes_reclaimed'] += sum(_file_size(path) for path in paths)
+                _, failed = remove_data_files(paths)
+                report['deleted_unchanged'] += len(ids)
+                report['failed_files'].extend(failed)
+                _publish_progress(job, report)
+
+        # 2. Downsample screenshots into the reduced/thumbnail tiers
+        last_id = 0
+        while True:
+            rows = db.session.query(
+                CheckHistory.id, CheckHistory.checked_at, CheckHistory.screenshot_path, CheckHistory.html_path, tier.label('tier')
+            ).filter(
+                *scope,
+                db.or_(
+                    db.and_(tier == 'full', CheckHistory.checked_at < reduced_cutoff),
+                    db.and_(tier != 'thumbnail', CheckHistory.checked_at < thumbnail_cutoff)
+                ),
+                CheckHistory.id > last_id
+            ).order_by(CheckHistory.id).limit(batch_size).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            targets = {row.id: ('thumbnail' if row.checked_at < thumbnail_cutoff else 'reduced') for row in rows}
+            with ThreadPoolExecutor(max_workers=RETENTION_FILE_WORKERS) as pool:
+                results = list(pool.map(
+                    lambda row: _downsample_screenshot(row.id, row.screenshot_path, targets[row.id]), rows))
+
+            updates = []
+            renamed = []
+            html_to_remove = []
+            reclaimed = 0
+            for row, (row_id, new_path, bytes_before, bytes_after, error) in zip(rows, results):
+                if error:
+                    logger.error(f"Error downsampling screenshot for CheckHistory ID {row_id}: {error}")
+                    report['failed_files'].append(row.screenshot_path)
+                    continue
+                update = {'id': row_id, 'storage_tier': targets[row_id], 'screenshot_path': new_path}
+                reclaimed += bytes_before - bytes_after
+                if targets[row_id] == 'thumbnail' and row.html_path:
+                    html_to_remove.append(row.html_path)
+                    update['html_path'] = None
+                if new_path != row.screenshot_path:
+                    renamed.append({'old_path': row.screenshot_path, 'new_path': new_path})
+                updates.append(update)
+
+            try:
+                if updates:
+                    db.session.bulk_update_mappings(CheckHistory, updates)
+                if renamed:
+                    db.session.execute(notification_paths, renamed)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error recording retention tiers for batch ending at CheckHistory ID {last_id}: {e}")
+                remove_data_files([r['new_path'] for r in renamed])  # Rows still point at the originals
+                continue
+
+            for update in updates:
+                report['thumbnailed' if update['storage_tier'] == 'thumbnail' else 'downsampled'] += 1
+            report['bytes_reclaimed'] += reclaimed + sum(_file_size(path) for path in html_to_remove)
+            _, failed = remove_data_files([r['old_path'] for r in renamed] + html_to_remove)
+            report['failed_files'].extend(failed)
+            _publish_progress(job, report)
+
+    logger.info(f"Retention tiers complete. Downsampled {report['downsampled']}, thumbnailed {report['thumbnailed']}, "
+                f"deleted {report['deleted_unchanged']} unchanged checks, reclaimed {report['bytes_reclaimed'] / (1024 * 1024):.1f} MB.")
+    return report
+
+
+# --- Background Job: Orphan File Garbage Collection ---
+ORPHAN_GRACE_MINUTES = 60  # Skip recently written files; a running check saves files before its row commits
+ORPHAN_SAMPLE_SIZE = 100  # File names listed in the report
+
+def _referenced_data_files():
+    """Return (names, stems) of every data file referenced by CheckHistory or Notification."""
+    from app import db, CheckHistory, Notification
+    names = set()
+    columns = [
+        (CheckHistory.screenshot_path, CheckHistory.html_path, CheckHistory.diff_path),
+        (Notification.screenshot_path,)
+    ]
+    for cols in columns:
+        for row in db.session.query(*cols).execution_options(yield_per=5000):
+            for path in row:
+                if path:
+                    names.add(os.path.basename(path.replace('\\', '/')))
+    stems = {os.path.splitext(name)[0] for name in names}
+    return names, stems
+
+def _scan_orphans(directory, is_orphan, cutoff_ts):
+    """Yield DirEntry objects for orphaned files in directory (streamed with os.scandir)."""
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                if entry.stat().st_mtime > cutoff_ts:
+                    continue
+                if is_orphan(entry.name):
+                    yield entry
+    except FileNotFoundError:
+        return
+
+def _derived_source_stem(name):
+    """Map a derivative name like 'screenshot_x_w640.webp' back to its source stem 'screenshot_x'."""
+    stem = os.path.splitext(name)[0]
+    base, sep, width = stem.rpartition('_w')
+    return base if sep and width.isdigit() else stem
+
+def collect_orphan_files(dry_run=True, quarantine=False, batch_size=RETENTION_BATCH_SIZE, grace_minutes=ORPHAN_GRACE_MINUTES):
+    """Mark-and-sweep garbage collection for the data directory.
+
+    Mark: collect every file referenced by CheckHistory/Notification. Sweep: stream data/ (and the
+    data/_derived image cache) with os.scandir and remove, or move to data/_quarantine/<date>/,
+    every unreferenced file older than grace_minutes, in batches. With dry_run=True nothing is
+    touched and the report lists what would be collected.
+    """
+    from app import DERIVED_IMAGE_DIR
+    job = get_current_job()
+    report = {
+        'dry_run': dry_run,
+        'quarantine': quarantine,
+        'scanned_referenced': 0,
+        'orphans': 0,
+        'orphan_bytes': 0,
+        'removed': 0,
+        'failed_files': [],
+        'sample': []
+    }
+
+    with app.app_context():
+        data_dir = app.config.get('DATA_DIR', 'data')
+        names, stems = _referenced_data_files()
+        report['scanned_referenced'] = len(names)
+        _publish_progress(job, report)
+        logger.info(f"Orphan GC: {len(names)} referenced files, sweeping {data_dir} (dry_run={dry_run}, quarantine={quarantine})")
+
+        quarantine_dir = os.path.join(data_dir, '_quarantine', datetime.now().strftime('%Y%m%d_%H%M%S'))
+        cutoff_ts = (datetime.now() - timedelta(minutes=grace_minutes)).timestamp()
+        sweeps = [
+            (data_dir, lambda name: name not in names),
+            (DERIVED_IMAGE_DIR, lambda name: _derived_source_stem(name) not in stems)
+        ]
+
+        def flush(batch):
+            if dry_run or not batch:
+                return
+            if quarantine:
+                os.makedirs(quarantine_dir, exist_ok=True)
+                for path in batch:
+                    try:
+                        os.replace(path, os.path.join(quarantine_dir, os.path.basename(path)))
+                        report['removed'] += 1
+                    except OSError as e:
+                        logger.error(f"Error quarantining file {path}: {e}")
+                        report['failed_files'].append(path)
+            else:
+                removed, failed = remove_data_files(batch)
+                report['removed'] += removed
+                report['failed_files'].extend(failed)
+            _publish_progress(job, report)
+
+        for directory, is_orphan in sweeps:
+            batch = []
+            for entry in _scan_orphans(directory, is_orphan, cutoff_ts):
+                report['orphans'] += 1
+                report['orphan_bytes'] += entry.stat().st_size
+                if len(report['sample']) < ORPHAN_SAMPLE_SIZE:
+                    report['sample'].append(os.path.relpath(entry.path, data_dir))
+                batch.append(entry.path)
+                if len(batch) >= batch_size:
+                    flush(batch)
+                    batch = []
+            flush(batch)
+
+    _publish_progress(job, report)
+    logger.info(f"Orphan GC complete: {report['orphans']} orphaned files ({report['orphan_bytes'] / (1024 * 1024):.1f} MB), "
+                f"{'none removed (dry run)' if dry_run else str(report['removed']) + (' quarantined' if quarantine else ' removed')}.")
+    return report
+
+
+# --- Background Job: Daily Check Rollups ---
+def rebuild_check_rollups(website_id=None, batch_size=RETENTION_BATCH_SIZE):
+    """Recompute CheckRollup rows from CheckHistory (backfill, or repair after manual edits).
+
+    Works one website at a time: its history is streamed in (checked_at) order, aggregated per day,
+    and its rollups are replaced in a single transaction. Days already swept by retention keep
+    whatever rollups they had, since their history is gone. Today is left to the live counters in
+    CheckRollup.record, so checks saved while the rebuild runs are not dropped.
+    """
+    from app import db, Website, CheckHistory, CheckRollup
+    job = get_current_job()
+    report = {'websites': 0, 'checks': 0, 'rollups': 0}
+
+    with app.app_context():
+        query = db.session.query(Website.id).order_by(Website.id)
+        if website_id:
+            query = query.filter(Website.id == website_id)
+        site_ids = [row.id for row in query]
+        today_start = datetime.combine(datetime.now().date(), datetime.min.time())
+
+        for site_id in site_ids:
+            rollups = {}
+            rows = db.session.query(
+                CheckHistory.checked_at, CheckHistory.error, CheckHistory.change_detected, CheckHistory.response_time
+            ).filter(
+                CheckHistory.website_id == site_id, CheckHistory.checked_at.isnot(None),
+                CheckHistory.checked_at < today_start
+            ).order_by(CheckHistory.checked_at).execution_options(yield_per=batch_size)
+            for checked_at, error, change_detected, response_time in rows:
+                day = checked_at.date()
+                if day not in rollups:
+                    rollups[day] = CheckRollup.empty(site_id, day)
+                rollups[day].add(error, change_detected, response_time)
+                report['checks'] += 1
+
+            if rollups:
+                CheckRollup.query.filter(
+                    CheckRollup.website_id == site_id, CheckRollup.day.in_(list(rollups))
+                ).delete(synchronize_session=False)
+                db.session.add_all(rollups.values())
+            db.session.commit()
+            report['websites'] += 1
+            report['rollups'] += len(rollups)
+            _publish_progress(job, report)
+
+    logger.info(f"Rollup rebuild complete: {report['rollups']} daily rollups from {report['checks']} checks across {report['websites']} websites.")
+    return report
+
+
+# --- Background Job: Deleted Website Files ---
+def remove_deleted_files(paths):
+    """Remove the data files of deleted websites/users, plus their cached image derivatives.
+
+    Rows are already gone when this runs (delete_website / delete_user_post commit first), so
+    anything left behind by a failure here is picked up by collect_orphan_files later.
+    """
+    from app import DERIVED_IMAGE_DIR
+    job = get_current_job()
+    report = {'files': len(paths), 'deleted_files': 0, 'deleted_derivatives': 0, 'failed_files': []}
+
+    removed, failed = remove_data_files(paths)
+    report['deleted_files'] = removed
+    report['failed_files'].extend(failed)
+    _publish_progress(job, report)
+
+    stems = {os.path.splitext(os.path.basename(path.replace('\\', '/')))[0] for path in paths}
+    try:
+        with os.scandir(DERIVED_IMAGE_DIR) as entries:
+            derived = [entry.path for entry in entries if entry.is_file() and _derived_source_stem(entry.name) in stems]
+    except FileNotFoundError:
+        derived = []
+    removed, failed = remove_data_files(derived)
+    report['deleted_derivatives'] = removed
+    report['failed_files'].extend(failed)
+    _publish_progress(job, report)
+
+    logger.info(f"Removed {report['deleted_files']}/{len(paths)} files and {report['deleted_derivatives']} derivatives of deleted websites ({len(report['failed_files'])} failed).")
+    return report
+
+# --- Background Job: Summaries ---
+SUMMARY_QUEUE = os.getenv('SUMMARY_QUEUE', 'summaries')  # RQ queue for per-user summary jobs (served by a worker pool)
+SUMMARY_JOB_TIMEOUT = 600
+SUMMARY_AI_CONCURRENCY = int(os.getenv('SUMMARY_AI_CONCURRENCY', '4'))  # Gemini summary calls in flight across all workers
+SUMMARY_AI_WAIT_SECONDS = int(os.getenv('SUMMARY_AI_WAIT_SECONDS', '120'))  # Longer than this and the plain summary is sent instead
+SUMMARY_AI_LEASE_SECONDS = 300  # A slot held this long (crashed worker) is reclaimed
+SUMMARY_AI_SLOTS_KEY = 'summary_ai_slots'  # Sorted set of slot tokens scored by acquire time
+SUMMARY_DUE_KEY = 'summary_due'  # Hash: summary notification id -> epoch its slot was due, until it is delivered
+SUMMARY_LAG_KEY = 'summary_lag:{stage}:{day}'  # Daily lag histograms (response_time_bucket -> count)
+SUMMARY_LAG_RETENTION_DAYS = 8
+
+def enqueue_user_summaries(due):
+    """Queue one generate_user_summary job per {user_id: due datetime}. Returns False if they could not be queued."""
+    redis_conn = get_redis()
+    if not redis_conn:
+        return False
+    try:
+        q = Queue(SUMMARY_QUEUE, connection=redis_conn)
+        with redis_conn.pipeline() as pipe:
+            q.enqueue_many([Queue.prepare_data(generate_user_summary, args=(user_id, due_at.timestamp()), timeout=SUMMARY_JOB_TIMEOUT)
+                            for user_id, due_at in due.items()], pipeline=pipe)
+            pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to queue {len(due)} summary jobs: {e}", exc_info=True)
+        return False
+    return True
+
+def generate_user_summary(user_id, due_ts):
+    """Build one user's summary and hand it to the notification queue. Returns the summary notification id or None."""
+    from app import User, send_user_summary
+    redis_conn = get_redis()
+    if not redis_conn:
+        raise RuntimeError("Redis connection failed")  # Leave the job failed; the items stay queued for the next slot
+    with app.app_context():
+        user = User.query.filter_by(user_id=user_id).first()
+        if not user:
+            return None
+        return send_user_summary(user, redis_conn, datetime.fromtimestamp(due_ts).strftime('%H:%M'), due_ts=due_ts)
+
+@contextmanager
+def summary_ai_slot(redis_conn):
+    """Hold one of SUMMARY_AI_CONCURRENCY slots shared by all workers; raises TimeoutError after SUMMARY_AI_WAIT_SECONDS."""
+    if not redis_conn:
+        yield
+        return
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + SUMMARY_AI_WAIT_SECONDS
+    while True:
+        now = time.time()
+        with redis_conn.pipeline() as pipe:
+            pipe.zremrangebyscore(SUMMARY_AI_SLOTS_KEY, '-inf', now - SUMMARY_AI_LEASE_SECONDS)
+            pipe.zadd(SUMMARY_AI_SLOTS_KEY, {token: now})
+            pipe.zrank(SUMMARY_AI_SLOTS_KEY, token)
+            rank = pipe.execute()[-1]
+        if rank is not None and rank < SUMMARY_AI_CONCURRENCY:
+            break
+        redis_conn.zrem(SUMMARY_AI_SLOTS_KEY, token)
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"No AI summary slot free after {SUMMARY_AI_WAIT_SECONDS}s")
+        time.sleep(0.5 + random.random())  # Jitter so waiting workers don't retry in lockstep
+    try:
+        yield
+    finally:
+        redis_conn.zrem(SUMMARY_AI_SLOTS_KEY, token)
+
+def record_summary_lag(redis_conn, stage, seconds):
+    """Add one sample to today's lag histogram for a stage ('generated' or 'delivered')."""
+    from app import response_time_bucket
+    key = SUMMARY_LAG_KEY.format(stage=stage, day=datetime.now().date().isoformat())
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.hincrby(key, response_time_bucket(max(seconds, 0)), 1)
+    pipe.expire(key, SUMMARY_LAG_RETENTION_DAYS * 86400)
+    pipe.execute()
+
+def note_summary_generated(redis_conn, notification_id, due_ts):
+    """Record generation lag and remember the due time so delivery lag can be recorded when it is sent."""
+    try:
+        record_summary_lag(redis_conn, 'generated', time.time() - due_ts)
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.hset(SUMMARY_DUE_KEY, notification_id, due_ts)
+        pipe.expire(SUMMARY_DUE_KEY, SUMMARY_LAG_RETENTION_DAYS * 86400)
+        pipe.execute()
+    except Exception as e:
+        logger.debug(f"Could not record summary lag for notification {notification_id}: {e}")
+
+def _note_summary_delivered(notification_id):
+    redis_conn = get_redis()
+    if not redis_conn:
+        return
+    try:
+        due_ts = redis_conn.hget(SUMMARY_DUE_KEY, notification_id)
+        if due_ts is not None and redis_conn.hdel(SUMMARY_DUE_KEY, notification_id):  # First delivery only
+            lag = time.time() - float(due_ts)
+            record_summary_lag(redis_conn, 'delivered', lag)
+            logger.info(f"Summary notification {notification_id} delivered {lag:.0f}s after its due time")
+    except Exception as e:
+        logger.debug(f"Could not record summary delivery lag for notification {notification_id}: {e}")
+
+
 # --- Screenshot Logic (if needed) ---
 # The get_screenshot_playwright function is imported from browser_agent.screenshot
 # No need to redefine it here unless there's a specific task-related reason.